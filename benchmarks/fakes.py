@@ -0,0 +1,347 @@
+"""
+Локальные заменители облачных сервисов для бенчмарков:
+- FakeYdb — in-memory хранилище, исполняющее то подмножество YQL, которое использует бот;
+- RecordingSession — сессия aiogram, записывающая вызовы Bot API вместо HTTP-запросов;
+- install_gpt_stub — заглушка YandexGPT с настраиваемой задержкой.
+"""
+import re
+import time
+import asyncio
+import threading
+from datetime import date, datetime
+from types import SimpleNamespace
+import ydb
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, EditMessageText
+from aiogram.types import Message, Chat, User
+
+_EPOCH = date(1970, 1, 1)
+
+# Ключевые колонки таблиц — нужны для семантики UPSERT
+TABLE_KEYS = {
+    "user_state": ("user_id",),
+    "wells": ("well_number", "date"),
+    "wells_versions": ("date",),
+    "wells_changes": ("date", "version", "well_number"),
+    "wells_search": ("date",),
+    "wells_ingested": ("date",),
+    "callback_throttle": ("user_id",),
+    "fsm_state": ("storage_key",),
+    "subscriptions": ("user_id",),
+    "broadcast_cursor": ("date",),
+}
+
+_CREATE_TABLE_RE = re.compile(r"CREATE TABLE IF NOT EXISTS (\w+)", re.IGNORECASE)
+_DECLARE_RE = re.compile(r"DECLARE\s+\$\w+\s+AS\s+[^;]+;", re.IGNORECASE)
+_UPSERT_RE = re.compile(r"^UPSERT INTO (\w+) \(([^)]*)\) VALUES \((.*)\)$", re.IGNORECASE | re.DOTALL)
+_SELECT_RE = re.compile(
+    r"^SELECT (DISTINCT )?(.+?) FROM (\w+)"
+    r"(?: WHERE (.+?))?(?: ORDER BY (\w+)( DESC| ASC)?)?(?: LIMIT (\S+))?$",
+    re.IGNORECASE | re.DOTALL
+)
+_DELETE_RE = re.compile(r"^DELETE FROM (\w+)(?: WHERE (.+))?$", re.IGNORECASE | re.DOTALL)
+_COND_RE = re.compile(r"^(\w+)(\s*(?:<=|>=|=|<|>)\s*|\s+IN\s+)(.+)$", re.IGNORECASE)
+# UPSERT ... SELECT $a AS a, col FROM AS_TABLE(ListMap($list, ($x) -> (AsStruct($x AS col))))
+_UPSERT_LIST_RE = re.compile(
+    r"^UPSERT INTO (\w+) \((.+?)\) SELECT (.+?) FROM AS_TABLE\(ListMap\((\$\w+), "
+    r"\(\$\w+\) -> \(AsStruct\(\$\w+ AS (\w+)\)\)\)\)$",
+    re.IGNORECASE
+)
+
+
+def _native(value):
+    """Приводит значение параметра к виду, в котором YDB возвращает его в строках"""
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1_000_000)
+    if isinstance(value, date):
+        return (value - _EPOCH).days
+    return value
+
+
+def _split_values(text):
+    """Разбивает список значений VALUES (...) по запятым вне кавычек и скобок"""
+    parts, current, quote, depth = [], [], None, 0
+    for ch in text:
+        if quote:
+            current.append(ch)
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+            current.append(ch)
+        elif ch == "(":
+            depth += 1
+            current.append(ch)
+        elif ch == ")":
+            depth -= 1
+            current.append(ch)
+        elif ch == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append("".join(current).strip())
+    return parts
+
+
+def _literal(token, params):
+    token = token.strip()
+    if token.startswith("$"):
+        return _native(params[token])
+    match = re.match(r"^DATE\('([^']+)'\)$", token, re.IGNORECASE)
+    if match:
+        return (date.fromisoformat(match.group(1)) - _EPOCH).days
+    if token.upper() == "CURRENTUTCTIMESTAMP()":
+        return int(time.time() * 1_000_000)
+    if token.upper() == "NULL":
+        return None
+    if token[0] in "'\"" and token[-1] == token[0]:
+        return token[1:-1].replace(token[0] * 2, token[0])
+    return float(token) if "." in token else int(token)
+
+
+_OPS = {
+    "=": lambda a, b: a == b,
+    "<": lambda a, b: a is not None and a < b,
+    ">": lambda a, b: a is not None and a > b,
+    "IN": lambda a, b: a in b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">=": lambda a, b: a is not None and a >= b,
+}
+
+
+class FakeYdb:
+    """In-memory таблицы YDB с подсчётом сетевых обращений"""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000
+        self.tables = {name: {} for name in TABLE_KEYS}
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    # --- Исполнение YQL ---
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def execute(self, yql, params=None):
+        """Выполняет запрос(ы) и возвращает список result set'ов для SELECT"""
+        self._round_trip()
+        params = params or {}
+        text = _DECLARE_RE.sub("", yql)
+        results = []
+        with self._lock:
+            for statement in text.split(";"):
+                statement = " ".join(statement.split())
+                if not statement:
+                    continue
+                if statement.upper().startswith("UPSERT") and "AS_TABLE" in statement.upper():
+                    self._upsert_list(statement, params)
+                elif statement.upper().startswith("UPSERT"):
+                    self._upsert(statement, params)
+                elif statement.upper().startswith("DELETE"):
+                    self._delete(statement, params)
+                elif statement.upper().startswith("SELECT"):
+                    results.append(SimpleNamespace(rows=self._select(statement, params)))
+                else:
+                    raise NotImplementedError(f"FakeYdb: unsupported statement: {statement[:80]}")
+        return results
+
+    def _upsert(self, statement, params):
+        match = _UPSERT_RE.match(statement)
+        if not match:
+            raise NotImplementedError(f"FakeYdb: unsupported UPSERT: {statement[:80]}")
+        table, columns, values = match.groups()
+        columns = [c.strip() for c in columns.split(",")]
+        values = [_literal(v, params) for v in _split_values(values)]
+        self.upsert_row(table, dict(zip(columns, values)))
+
+    def _upsert_list(self, statement, params):
+        match = _UPSERT_LIST_RE.match(statement)
+        if not match:
+            raise NotImplementedError(f"FakeYdb: unsupported UPSERT ... AS_TABLE: {statement[:80]}")
+        table, _, projection, list_param, item_column = match.groups()
+        constants = {}
+        for item in _split_values(projection):
+            value, _, alias = item.partition(" AS ")
+            if alias:
+                constants[alias.strip()] = _literal(value, params)
+        for value in params[list_param]:
+            self.upsert_row(table, {**constants, item_column: _native(value)})
+
+    def upsert_row(self, table, row):
+        """UPSERT одной строки: обновляются только переданные колонки"""
+        key = tuple(row[k] for k in TABLE_KEYS[table])
+        self._table(table).setdefault(key, {}).update(row)
+
+    def _table(self, name):
+        """Строки таблицы; как и YDB, на отсутствующую таблицу отвечает SchemeError"""
+        if name not in self.tables:
+            raise ydb.SchemeError(f"Cannot find table '{name}'")
+        return self.tables[name]
+
+    def _where(self, where, params):
+        conditions = []
+        for cond in re.split(r"\s+AND\s+", where or "", flags=re.IGNORECASE):
+            if cond:
+                column, op, value = _COND_RE.match(cond.strip()).groups()
+                conditions.append((column, _OPS[op.strip().upper()], _literal(value, params)))
+        return lambda row: all(op(row.get(column), value) for column, op, value in conditions)
+
+    def _delete(self, statement, params):
+        match = _DELETE_RE.match(statement)
+        if not match:
+            raise NotImplementedError(f"FakeYdb: unsupported DELETE: {statement[:80]}")
+        table, where = match.groups()
+        matches = self._where(where, params)
+        for key in [k for k, row in self._table(table).items() if matches(row)]:
+            del self.tables[table][key]
+
+    def _select(self, statement, params):
+        match = _SELECT_RE.match(statement)
+        if not match:
+            raise NotImplementedError(f"FakeYdb: unsupported SELECT: {statement[:80]}")
+        distinct, columns, table, where, order_by, direction, limit = match.groups()
+        matches = self._where(where, params)
+        rows = [row for row in self._table(table).values() if matches(row)]
+        if order_by:
+            rows.sort(key=lambda r: r.get(order_by), reverse=(direction or "").strip().upper() == "DESC")
+        if limit:
+            rows = rows[:int(_literal(limit, params))]
+
+        names = [c.strip() for c in columns.split(",")]
+        result = [SimpleNamespace(**{n: row.get(n) for n in names}) for row in rows]
+        if distinct:
+            seen, unique = set(), []
+            for row in result:
+                key = tuple(vars(row).values())
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(row)
+            result = unique
+        return result
+
+    # --- Интерфейс SessionPool / Driver ---
+
+    def retry_operation_sync(self, callee, *args, **kwargs):
+        return callee(FakeSession(self), *args, **kwargs)
+
+    def wait(self, timeout=None, fail_fast=False):
+        return True
+
+    @property
+    def table_client(self):
+        return self
+
+    def scan_query(self, query, parameters=None, settings=None):
+        results = self.execute(query.yql_text, parameters)
+        return [SimpleNamespace(result_set=rs) for rs in results]
+
+    def bulk_upsert(self, table_path, rows, column_types, settings=None):
+        self._round_trip()
+        table = table_path.rsplit("/", 1)[-1]
+        with self._lock:
+            for row in rows:
+                self.upsert_row(table, {k: _native(v) for k, v in row.items()})
+
+    # --- Наполнение данными ---
+
+    def load_wells(self, rows, report_date=None):
+        """Загружает описания скважин за дату и выставляет версию данных"""
+        report_date = report_date or date.today()
+        days = (report_date - _EPOCH).days
+        for well_number, description in rows:
+            self.upsert_row("wells", {"well_number": well_number, "date": days, "description": description})
+        current = self.tables["wells_versions"].get((days,), {}).get("version", 0)
+        self.upsert_row("wells_versions", {"date": days, "version": current + 1})
+
+
+class FakeSession:
+    def __init__(self, db):
+        self._db = db
+
+    def prepare(self, query):
+        return SimpleNamespace(yql_text=query)
+
+    def transaction(self, tx_mode=None):
+        return FakeTransaction(self._db)
+
+    def execute_scheme(self, yql_text, settings=None):
+        self._db._round_trip()
+        for table in _CREATE_TABLE_RE.findall(yql_text):
+            self._db.tables.setdefault(table, {})
+
+    def describe_table(self, path, settings=None):
+        """Колонки таблицы: ключевые и встречающиеся в строках"""
+        table = path.rsplit("/", 1)[-1]
+        names = dict.fromkeys(TABLE_KEYS[table])
+        for row in self._db.tables[table].values():
+            names.update(dict.fromkeys(row))
+        return SimpleNamespace(columns=[SimpleNamespace(name=name) for name in names])
+
+
+class FakeTransaction:
+    def __init__(self, db):
+        self._db = db
+
+    def execute(self, query, parameters=None, commit_tx=False, settings=None):
+        yql = getattr(query, "yql_text", query)
+        return self._db.execute(yql, parameters)
+
+    def commit(self, settings=None):
+        return None
+
+
+def install_fake_ydb(db):
+    """Подставляет FakeYdb вместо драйвера и пула сессий в services"""
+    import services
+    services.ydb_driver = db
+    services.ydb_pool = db
+
+
+class RecordingSession(BaseSession):
+    """Сессия aiogram без сети: записывает вызовы Bot API и возвращает правдоподобные ответы"""
+
+    def __init__(self, latency_ms=0.0):
+        super().__init__()
+        self.latency = latency_ms / 1000
+        self.calls = []
+        self._message_id = 1000
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(type(method).__name__)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self._message_id += 1
+            chat_id = getattr(method, "chat_id", None) or 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=int(chat_id), type="private"),
+                from_user=User(id=bot.id, is_bot=True, first_name="bot"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def install_gpt_stub(latency_ms=0.0, text="Краткое summary (заглушка)"):
+    """Подменяет синхронный вызов YandexGPT заглушкой с задержкой"""
+    import gpt_client
+
+    def stub(description, timeout=None):
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        return text
+
+    gpt_client.sync_get_summary = stub
@@ -0,0 +1,234 @@
+"""
+Нагрузочный прогон: воспроизводит записанные апдейты Telegram через main.handler
+с заданной интенсивностью и параллельностью на локальных заменителях сервисов.
+
+    python -m benchmarks.replay updates.jsonl --rate 50 --concurrency 16 --duration 30
+    python -m benchmarks.replay --synthetic 500 --users 40 --rate 80 --concurrency 32
+
+Файл захвата — JSON Lines: в каждой строке либо объект Update, либо событие
+облачной функции с полем "body" (строка JSON апдейта, как в main.handler).
+Отчёт: пропускная способность, доля ошибок, хвосты задержек и пиковая память
+относительно лимита функции.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import resource
+import threading
+import tracemalloc
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCHMARK")
+
+import main
+import metrics
+import bot as bot_module
+import callbacks
+from benchmarks.fakes import FakeYdb, RecordingSession, install_fake_ydb, install_gpt_stub
+from benchmarks.run import sample_wells, percentile, _message_update, _callback_update
+
+FUNCTION_MEMORY_LIMIT_MB = 512
+
+
+def load_events(path):
+    """Читает захваченные апдейты и приводит их к событиям облачной функции"""
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "body" in record:
+                events.append({"body": record["body"]})
+            else:
+                events.append({"body": json.dumps(record, ensure_ascii=False)})
+    return events
+
+
+def synthetic_events(count, users, wells, seed=0):
+    """Генерирует поток апдейтов, похожий на утренний пик: в основном клики по скважинам"""
+    rng = random.Random(seed)
+    today_str = date.today().isoformat()
+    snapshot = tuple(sorted(wells))
+    weights = (("start", 1), ("mode", 2), ("well", 10), ("summary", 2), ("back", 3))
+    actions = [name for name, weight in weights for _ in range(weight)]
+    events = []
+    for n in range(1, count + 1):
+        user_id = 10_000 + rng.randrange(users)
+        action = rng.choice(actions)
+        if action == "start":
+            update = _message_update(n, "/start")
+        else:
+            data = {
+                "mode": lambda: callbacks.mode_data("drilling"),
+                "well": lambda: callbacks.well_data(rng.choice(wells), today_str, snapshot, "drilling"),
+                "summary": lambda: callbacks.summary_data(rng.choice(wells), today_str, snapshot),
+                "back": lambda: callbacks.wells_data("drilling"),
+            }[action]()
+            update = _callback_update(n, data)
+        body = update.get("message") or update.get("callback_query")
+        body["from"]["id"] = user_id
+        if "chat" in body:
+            body["chat"]["id"] = user_id
+        else:
+            body["message"]["chat"]["id"] = user_id
+        events.append({"body": json.dumps(update, ensure_ascii=False)})
+    return events
+
+
+def replay(events, rate, concurrency, duration=None):
+    """
+    Отправляет события в main.handler по расписанию с интенсивностью rate в секунду
+    (открытая модель нагрузки). Задержка считается от запланированного момента,
+    чтобы очередь при перегрузке попадала в хвосты.
+    """
+    latencies, service_times = [], []
+    errors = 0
+    lock = threading.Lock()
+
+    def invoke(event, scheduled):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = main.handler(event, None).get("statusCode") == 200
+        except Exception:
+            ok = False
+        finished = time.perf_counter()
+        with lock:
+            latencies.append((finished - scheduled) * 1000)
+            service_times.append((finished - started) * 1000)
+            if not ok:
+                errors += 1
+
+    interval = 1.0 / rate if rate > 0 else 0.0
+    started = time.perf_counter()
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            if duration is None and submitted >= len(events):
+                break
+            scheduled = started + submitted * interval
+            if duration is not None and scheduled - started >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(invoke, events[submitted % len(events)], scheduled)
+            submitted += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": submitted,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(submitted / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(errors / submitted, 4) if submitted else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies, default=0.0), 2),
+        },
+        "service_ms": {
+            "p50": round(percentile(service_times, 50), 2),
+            "p99": round(percentile(service_times, 99), 2),
+        },
+    }
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ (ru_maxrss — КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон записанных апдейтов")
+    parser.add_argument("capture", nargs="?", help="файл JSON Lines с апдейтами")
+    parser.add_argument("--synthetic", type=int, default=0, help="сгенерировать N апдейтов вместо файла")
+    parser.add_argument("--users", type=int, default=30, help="число пользователей для --synthetic")
+    parser.add_argument("--wells", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=20.0, help="апдейтов в секунду (0 — без пауз)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, help="длительность прогона в секундах (события по кругу)")
+    parser.add_argument("--ydb-latency-ms", type=float, default=5.0)
+    parser.add_argument("--api-latency-ms", type=float, default=30.0)
+    parser.add_argument("--gpt-latency-ms", type=float, default=800.0)
+    parser.add_argument("--trace-heap", action="store_true",
+                        help="считать пик Python-кучи через tracemalloc (заметно замедляет прогон)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if not args.capture and not args.synthetic:
+        parser.error("укажите файл захвата или --synthetic N")
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    db = FakeYdb(latency_ms=args.ydb_latency_ms)
+    wells = sample_wells(args.wells)
+    db.load_wells(wells)
+    install_fake_ydb(db)
+    install_gpt_stub(latency_ms=args.gpt_latency_ms)
+    session = RecordingSession(latency_ms=args.api_latency_ms)
+    main.setup_bot = lambda: bot_module.setup_bot(session=session)
+
+    if args.capture:
+        events = load_events(args.capture)
+    else:
+        events = synthetic_events(args.synthetic, args.users, [w for w, _ in wells])
+    # Пользователи уже выбирали режим: запись FSM по ключу fsm:<chat_id>:<user_id>
+    for user_id in range(10_000, 10_000 + args.users):
+        db.upsert_row("fsm_state", {
+            "storage_key": f"fsm:{user_id}:{user_id}",
+            "state": None,
+            "data": json.dumps({"mode": "drilling"}),
+        })
+
+    if args.trace_heap:
+        tracemalloc.start()
+    report = replay(events, args.rate, args.concurrency, args.duration)
+    heap_peak = None
+    if args.trace_heap:
+        heap_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+
+    rss = peak_rss_mb()
+    report["memory"] = {
+        "python_heap_peak_mb": heap_peak,
+        "peak_rss_mb": round(rss, 2),
+        "limit_mb": FUNCTION_MEMORY_LIMIT_MB,
+        "rss_of_limit": round(rss / FUNCTION_MEMORY_LIMIT_MB, 3),
+    }
+    report["bot_api_calls"] = len(session.calls)
+    report["ydb_round_trips"] = db.round_trips
+    report["suppressed"] = {
+        name.split(":", 1)[1]: value
+        for name, value in metrics.snapshot()["counters"].items()
+        if name.startswith("callbacks_suppressed_total:")
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    lat = report["latency_ms"]
+    mem = report["memory"]
+    print(f"requests:      {report['requests']} in {report['elapsed_s']} s")
+    print(f"throughput:    {report['throughput_rps']} rps")
+    print(f"error rate:    {report['error_rate'] * 100:.2f}%")
+    print(f"latency ms:    p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    print(f"service ms:    p50 {report['service_ms']['p50']}  p99 {report['service_ms']['p99']}")
+    heap = f"heap peak {mem['python_heap_peak_mb']} MB, " if mem["python_heap_peak_mb"] is not None else ""
+    print(f"memory:        {heap}RSS peak {mem['peak_rss_mb']} MB "
+          f"({mem['rss_of_limit'] * 100:.1f}% of {mem['limit_mb']} MB)")
+    print(f"dependencies:  {report['bot_api_calls']} Bot API calls, {report['ydb_round_trips']} YDB round-trips")
+    print(f"suppressed:    {report['suppressed'] or 'none'}")
+
+
+if __name__ == "__main__":
+    main_cli()
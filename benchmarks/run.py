@@ -0,0 +1,269 @@
+"""
+Офлайн-бенчмарк сценариев бота на локальных заменителях YDB, Telegram и YandexGPT.
+
+    python -m benchmarks.run --iterations 50 --ydb-latency-ms 5 --api-latency-ms 30 --gpt-latency-ms 800
+
+Для каждого сценария (start, mode select, well click, summary, back navigation, changes, inline)
+измеряется холодный путь (состояние экземпляра функции сброшено перед каждым вызовом)
+и тёплый (повторные вызовы в том же экземпляре). Выводятся p50/p95/p99 задержки,
+число вызовов Bot API и обращений к YDB на один апдейт.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCHMARK")
+# Сценарии повторяют одно и то же нажатие — отсев дублей исказил бы замеры
+os.environ.setdefault("THROTTLE_ENABLED", "0")
+
+import main
+import bot as bot_module
+import cache
+import metrics
+import services
+import callbacks
+from aiogram.types import Update
+from aiogram.fsm.storage.base import StorageKey
+from fsm_storage import WriteBehindStorage
+from state_backend import create_state_backend
+from benchmarks.fakes import FakeYdb, RecordingSession, install_fake_ydb, install_gpt_stub
+
+USER_ID = 777
+CHAT_ID = 777
+
+DESCRIPTION_TEMPLATE = (
+    "Работы за прошлые сутки (скв. {well}): бурение под эксплуатационную колонну "
+    "в интервале {start}-{end} м, промывка, проработка ствола.\n"
+    "Работы за текущие сутки: спуск КНБК, наращивание, бурение. " * 3 +
+    "\nПроблемные вопросы: поглощение бурового раствора, ожидание техники."
+)
+
+
+def sample_wells(count, days_ago=0):
+    """Генерирует описания скважин, похожие на суточный отчёт (днём раньше — на 150 м выше)"""
+    return [
+        (str(1000 + n), DESCRIPTION_TEMPLATE.format(
+            well=1000 + n, start=1500 + n * 10 - 150 * days_ago, end=1650 + n * 10 - 150 * days_ago
+        ))
+        for n in range(count)
+    ]
+
+
+def _message_update(update_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": CHAT_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            if text.startswith("/") else None,
+        },
+    }
+
+
+def _callback_update(update_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": CHAT_ID, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def _inline_update(update_id, query):
+    return {
+        "update_id": update_id,
+        "inline_query": {
+            "id": str(update_id),
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Bench"},
+            "query": query,
+            "offset": "",
+        },
+    }
+
+
+def build_scenarios(well, wells):
+    """Сценарии: имя -> фабрика апдейта по номеру (кнопки в том виде, в каком их отдаёт бот)"""
+    today_str = date.today().isoformat()
+    snapshot = tuple(sorted(wells))
+    return {
+        "start": lambda n: _message_update(n, "/start"),
+        "mode_select": lambda n: _callback_update(n, callbacks.mode_data("drilling")),
+        "well_click": lambda n: _callback_update(n, callbacks.well_data(well, today_str, snapshot, "drilling")),
+        "summary": lambda n: _callback_update(n, callbacks.summary_data(well, today_str, snapshot)),
+        "back_to_wells": lambda n: _callback_update(n, callbacks.wells_data("drilling")),
+        "changes": lambda n: _callback_update(n, callbacks.changes_data(well, today_str, snapshot, "drilling")),
+        "legacy_well_click": lambda n: _callback_update(n, well),
+        "inline_query": lambda n: _inline_update(n, well[:2]),
+    }
+
+
+def reset_instance_state():
+    """Сбрасывает состояние процесса, как у только что запущенного экземпляра функции"""
+    cache.clear_all()
+    services._data_versions.clear()
+    services._search_indexes.clear()
+    metrics.reset()
+
+
+def percentile(values, pct):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Harness:
+    """Прогоняет апдейты через main.handler или напрямую через диспетчер"""
+
+    def __init__(self, db, session, mode):
+        self.db = db
+        self.session = session
+        self.mode = mode
+        self._update_id = 0
+        if mode == "main":
+            main.setup_bot = lambda: bot_module.setup_bot(session=session)
+        else:
+            self.loop = asyncio.new_event_loop()
+            self.bot = bot_module.setup_bot(session=session)
+            self.dp = bot_module.setup_dispatcher()
+
+    def next_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def run_once(self, update_json):
+        """Выполняет один апдейт, возвращает (мс, вызовы Bot API, обращения к YDB, ошибка)"""
+        api_before = len(self.session.calls)
+        ydb_before = self.db.round_trips
+        started = time.perf_counter()
+        error = False
+        if self.mode == "main":
+            result = main.handler({"body": json.dumps(update_json)}, None)
+            error = result.get("statusCode") != 200
+        else:
+            try:
+                self.loop.run_until_complete(
+                    self.dp.feed_update(bot=self.bot, update=Update(**update_json))
+                )
+            except Exception:
+                error = True
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return (
+            elapsed_ms,
+            len(self.session.calls) - api_before,
+            self.db.round_trips - ydb_before,
+            error,
+        )
+
+    def close(self):
+        if self.mode != "main":
+            self.loop.close()
+
+
+def run_scenario(harness, factory, iterations, cold):
+    latencies, api_calls, round_trips, errors = [], [], [], 0
+    if not cold:
+        reset_instance_state()
+        harness.run_once(factory(harness.next_id()))  # прогрев
+    for _ in range(iterations):
+        if cold:
+            reset_instance_state()
+        ms, api, rtt, error = harness.run_once(factory(harness.next_id()))
+        latencies.append(ms)
+        api_calls.append(api)
+        round_trips.append(rtt)
+        errors += int(error)
+    return {
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "api_calls": round(sum(api_calls) / len(api_calls), 2),
+        "ydb_round_trips": round(sum(round_trips) / len(round_trips), 2),
+        "errors": errors,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк обработчиков бота")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--wells", type=int, default=40, help="число скважин в снимке")
+    parser.add_argument("--ydb-latency-ms", type=float, default=0.0)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0)
+    parser.add_argument("--gpt-latency-ms", type=float, default=0.0)
+    parser.add_argument("--mode", choices=["main", "dispatch"], default="main",
+                        help="main — через main.handler, dispatch — напрямую через диспетчер")
+    parser.add_argument("--state-backend", choices=["ydb", "sqlite", "memory"], default="ydb",
+                        help="хранилище состояния пользователей (ydb — на FakeYdb)")
+    parser.add_argument("--scenario", action="append", help="запустить только указанные сценарии")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи бота")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    db = FakeYdb(latency_ms=args.ydb_latency_ms)
+    wells = sample_wells(args.wells)
+    db.load_wells(wells)
+    # Предыдущий день — для сценария «Что изменилось»
+    db.load_wells(sample_wells(args.wells, days_ago=1), report_date=date.today() - timedelta(days=1))
+    install_fake_ydb(db)
+    if args.state_backend == "sqlite":
+        os.environ["STATE_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "state.sqlite3")
+    backend = create_state_backend(args.state_backend, get_pool=services.get_ydb_pool, run=services.run_ydb)
+    services.set_state_backend(backend)
+    storage_key = StorageKey(bot_id=123456, chat_id=CHAT_ID, user_id=USER_ID)
+    asyncio.run(WriteBehindStorage(backend).set_data(storage_key, {"mode": "drilling"}))
+    install_gpt_stub(latency_ms=args.gpt_latency_ms)
+    session = RecordingSession(latency_ms=args.api_latency_ms)
+
+    harness = Harness(db, session, args.mode)
+    scenarios = build_scenarios(wells[0][0], [w for w, _ in wells])
+    selected = args.scenario or list(scenarios)
+
+    results = {}
+    try:
+        for name in selected:
+            for phase in ("cold", "warm"):
+                results[f"{name}/{phase}"] = run_scenario(
+                    harness, scenarios[name], args.iterations, cold=(phase == "cold")
+                )
+    finally:
+        harness.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    header = f"{'scenario':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'api':>8}{'ydb rt':>8}{'err':>6}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(
+            f"{name:<22}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+            f"{r['api_calls']:>8}{r['ydb_round_trips']:>8}{r['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
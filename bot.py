@@ -1,19 +1,37 @@
 import os
+import re
+import html
+import hashlib
 import logging
-import asyncio
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
-from aiogram.filters import Command
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from services import set_user_state, get_user_state
-from services import get_well_list_ydb, get_well_description_ydb, get_ydb_pool
+from services import get_well_snapshot, get_well_description_ydb, sync_data_version, WELL_NOT_FOUND_TEXT
+from services import find_wells_by_prefix, get_well_descriptions
+from services import get_well_history_page, prefetch_well_history, search_wells
 from aiogram.client.default import DefaultBotProperties
-from gpt_client import get_summary
-from async_lru import alru_cache
+from gpt_client import get_summary, gpt_breaker
+from cache import get_cache
+from metrics import UpdateMetricsMiddleware, HandlerMetricsMiddleware, BotApiMetricsMiddleware
+from throttling import ThrottlingMiddleware, THROTTLE_ENABLED
+from fsm_storage import WriteBehindStorage, FsmFlushMiddleware
+from changes import diff_descriptions, render_changes
+from resilience import DeadlineMiddleware, DeadlineRequestMiddleware, is_degraded
+import callbacks as cbd
+from callbacks import CallbackRef, CallbackRoutingMiddleware, resolve_well
+from broadcast import subscribe, unsubscribe, get_subscription, ALL_WELLS_TOKENS
+from datetime import date, timedelta
 
 MAX_MESSAGE_LENGTH = 4096
+MAX_SEARCH_DAYS = 14
+# Inline-режим: результатов на страницу и сколько секунд Telegram кэширует ответ
+INLINE_RESULTS_LIMIT = 20
+INLINE_CACHE_SECONDS = int(os.environ.get("INLINE_CACHE_SECONDS", "300"))
 load_dotenv()
 
 def split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
@@ -34,21 +52,53 @@ def split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 logger = logging.getLogger(__name__)
 
+# Кэши отрисованных частей описания и summary по ключу (дата, скважина)
+parts_cache = get_cache("rendered_parts")
+summary_cache = get_cache("summary")
+# (сегодня, скважина) -> (предыдущий день, версия данных за него, ChangeDigest)
+changes_cache = get_cache("changes")
+
+SUMMARY_UNAVAILABLE_TEXT = "⚠️ Summary временно недоступно, попробуйте позже."
+
 # # Получаем ID таблиц из переменных окружения
 # SHEET_IDS = {
 #     "drilling": os.environ.get("DRILLING_SHEET_ID"),
 #     "completion": os.environ.get("COMPLETION_SHEET_ID")
 # }
 
-def setup_bot():
-    return Bot(
+def setup_bot(session=None):
+    bot = Bot(
         token=TELEGRAM_TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+    # Замер каждого вызова Bot API
+    bot.session.middleware(BotApiMetricsMiddleware())
+    # Внутри апдейта вызовы Bot API не переживают его дедлайн
+    bot.session.middleware(DeadlineRequestMiddleware())
+    return bot
 
 def setup_dispatcher():
     """Создает и настраивает диспетчер"""
-    dp = Dispatcher()
+    storage = WriteBehindStorage()
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    
+    # Дедлайн апдейта для вызовов YDB, YandexGPT и Bot API
+    dp.update.outer_middleware(DeadlineMiddleware())
+    # Метрики: апдейт целиком и отдельные обработчики
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    # FSMContext для обработчиков; изменения записываются одной транзакцией в конце апдейта
+    dp.update.outer_middleware(FsmFlushMiddleware(storage))
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    dp.inline_query.middleware(HandlerMetricsMiddleware())
+    
+    # Разбор callback_data и выбор обработчика по таблице маршрутов
+    dp.callback_query.outer_middleware(CallbackRoutingMiddleware(CALLBACK_ROUTES))
+    
+    # Отсев повторных нажатий и ограничение дорогих действий
+    if THROTTLE_ENABLED:
+        dp.callback_query.outer_middleware(ThrottlingMiddleware())
     
     # Регистрируем все обработчики
     register_all_handlers(dp)
@@ -58,42 +108,29 @@ def setup_dispatcher():
 def register_all_handlers(dp: Dispatcher):
     """Регистрирует все обработчики"""
     register_start_handlers(dp)
+    register_search_handlers(dp)
+    register_subscription_handlers(dp)
+    register_inline_handlers(dp)
     register_wells_handlers(dp)
 
 def register_wells_handlers(dp: Dispatcher):
-    """Регистрирует обработчики выбора режима и скважин"""
-    # Обработчик кнопки "Начать"
-    dp.callback_query.register(
-        process_start_button,
-        lambda c: c.data == "start_bot"
-    )
-    
-    # Обработчик выбора режима
-    dp.callback_query.register(
-        process_mode_selection,
-        lambda c: c.data in ["drilling", "completion"]
-    )
-    
-    # Обработчик возврата к списку скважин
-    dp.callback_query.register(
-        process_back_to_wells,
-        lambda c: c.data == "back_to_wells"
-    )
-    dp.callback_query.register(
-    process_summary_request,
-    lambda c: c.data.startswith("summary_")
-    )    
-    # Обработчик выбора скважины (все остальные колбэки)
-    dp.callback_query.register(process_well_selection)
+    """Регистрирует единый обработчик колбэков (маршрут выбирается по CALLBACK_ROUTES)"""
+    dp.callback_query.register(dispatch_callback)
+
+async def dispatch_callback(callback: CallbackQuery, cb: CallbackRef, callback_route, state: FSMContext):
+    """Вызывает обработчик, найденный CallbackRoutingMiddleware по действию кнопки"""
+    if callback_route is None:
+        logger.warning("No route for callback %r", callback.data)
+        await callback.answer()
+        return
+    await callback_route(callback, cb, state)
 
 async def cmd_start(message: Message):
     """Обработчик команды /start"""
     try:
-        logger.info(f"Processing /start command from user {message.from_user.id}")
-        
         # Показываем приветствие с кнопкой "Начать"
         builder = InlineKeyboardBuilder()
-        builder.button(text="🚀 Начать", callback_data="start_bot")
+        builder.button(text="🚀 Начать", callback_data=cbd.pack(cbd.START))
         
         await message.answer(
             "🔧 Добро пожаловать в бот для работы со скважинами!\n\n"
@@ -101,31 +138,188 @@ async def cmd_start(message: Message):
             reply_markup=builder.as_markup()
         )
     except Exception as e:
-        logger.error(f"Error in start command: {str(e)}")
+        logger.error("Error in start command: %s", e)
         await message.answer("⚠️ Произошла ошибка при обработке команды")
 
 def register_start_handlers(dp: Dispatcher):
     """Регистрирует обработчики команды старт"""
     dp.message.register(cmd_start, Command("start"))
 
-async def process_mode_selection(callback: CallbackQuery):
+def register_search_handlers(dp: Dispatcher):
+    """Регистрирует обработчик полнотекстового поиска"""
+    dp.message.register(cmd_search, Command("search"))
+
+def plain_preview(text: str, max_length: int = 120) -> str:
+    """Короткий текст без HTML-разметки (для подписи результата inline-запроса)"""
+    return " ".join(re.sub(r"<[^>]+>", "", text).split())[:max_length]
+
+def register_inline_handlers(dp: Dispatcher):
+    """Регистрирует обработчик inline-запросов (@bot 1234)"""
+    dp.inline_query.register(process_inline_query)
+
+async def process_inline_query(inline_query: InlineQuery):
+    """
+    Inline-поиск скважины по началу номера в сегодняшнем снимке. Ответ одинаков
+    для всех пользователей, поэтому кэшируется на стороне Telegram (is_personal=False).
+    """
+    try:
+        offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+        wells, has_more = await find_wells_by_prefix(inline_query.query, offset, INLINE_RESULTS_LIMIT)
+        # Описания недостающих в кэше скважин читаются одним запросом, а не по одному
+        descriptions = await get_well_descriptions(wells)
+
+        today_str = date.today().isoformat()
+        today_code = cbd.day_code(today_str)
+        results = []
+        for well in wells:
+            description = descriptions.get(well, WELL_NOT_FOUND_TEXT)
+            key = (today_str, str(well))
+            parts = parts_cache.get(key)
+            if parts is None:
+                parts = render_description(well, description)
+                if description != WELL_NOT_FOUND_TEXT:
+                    parts_cache.set(key, parts)
+            text = parts[0] if len(parts) == 1 else parts[0] + "\n\n…"
+            results.append(InlineQueryResultArticle(
+                # id — не больше 64 байт: номер скважины может быть длинным и не ASCII
+                id=hashlib.blake2b(f"{today_code}:{well}".encode("utf-8"), digest_size=16).hexdigest(),
+                title=f"Скважина {well}",
+                description=plain_preview(description),
+                input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+            ))
+
+        await inline_query.answer(
+            results,
+            cache_time=INLINE_CACHE_SECONDS,
+            is_personal=False,
+            next_offset=str(offset + len(wells)) if has_more else "",
+        )
+    except Exception as e:
+        logger.error("Error processing inline query: %s", e)
+        await inline_query.answer([], cache_time=5, is_personal=False)
+
+def register_subscription_handlers(dp: Dispatcher):
+    """Регистрирует обработчики подписки на утренний дайджест"""
+    dp.message.register(cmd_subscribe, Command("subscribe"))
+    dp.message.register(cmd_unsubscribe, Command("unsubscribe"))
+
+def describe_subscription(wells) -> str:
+    return "скважины: " + (", ".join(html.escape(w) for w in wells) if wells else "все")
+
+SUBSCRIBE_USAGE = (
+    "Подписка на утреннюю сводку:\n"
+    "<code>/subscribe все</code> — по всем скважинам,\n"
+    "<code>/subscribe 101 102</code> — по перечисленным скважинам.\n"
+    "Отписаться: /unsubscribe"
+)
+
+async def cmd_subscribe(message: Message, command: CommandObject):
+    """
+    Обработчик команды /subscribe: /subscribe все — дайджест по всем скважинам,
+    /subscribe 101 102 — только по перечисленным; без аргументов — текущая подписка и справка.
+    """
+    try:
+        tokens = (command.args or "").split()
+        if not tokens:
+            current = await get_subscription(message.from_user.id)
+            status = (
+                f"📬 Вы подписаны ({describe_subscription(current['wells'])}).\n\n" if current
+                else "📭 Подписки нет.\n\n"
+            )
+            await message.answer(status + SUBSCRIBE_USAGE)
+            return
+        wells = [] if tokens[0].lower() in ALL_WELLS_TOKENS else tokens
+
+        await subscribe(message.from_user.id, message.chat.id, wells)
+        logger.info("User %s subscribed: wells=%s", message.from_user.id, wells)
+        await message.answer(
+            f"📬 Подписка оформлена ({describe_subscription(wells)}).\n"
+            "Сводка придёт утром, как только появятся данные за день."
+        )
+    except Exception as e:
+        logger.error("Error in subscribe command: %s", e)
+        await message.answer("⚠️ Не удалось оформить подписку")
+
+async def cmd_unsubscribe(message: Message):
+    """Обработчик команды /unsubscribe"""
+    try:
+        await unsubscribe(message.from_user.id)
+        logger.info("User %s unsubscribed", message.from_user.id)
+        await message.answer("📭 Подписка отменена")
+    except Exception as e:
+        logger.error("Error in unsubscribe command: %s", e)
+        await message.answer("⚠️ Не удалось отменить подписку")
+
+async def cmd_search(message: Message, command: CommandObject):
+    """
+    Обработчик команды /search: /search прихват — поиск по сегодняшним описаниям,
+    /search -7 поглощение — за последние 7 дней.
+    """
+    try:
+        args = (command.args or "").strip()
+        days = 1
+        if args.startswith("-"):
+            days_arg, _, args = args[1:].partition(" ")
+            if days_arg.isdigit():
+                days = min(max(int(days_arg), 1), MAX_SEARCH_DAYS)
+            args = args.strip()
+
+        if not args:
+            await message.answer(
+                "🔎 Использование: <code>/search прихват</code>\n"
+                f"За несколько дней: <code>/search -7 поглощение</code> (до {MAX_SEARCH_DAYS})"
+            )
+            return
+
+        logger.debug("User %s searched %r for %s days", message.from_user.id, args, days)
+        results = await search_wells(args, days)
+        if not results:
+            await message.answer(f"🔎 По запросу «{html.escape(args)}» ничего не найдено")
+            return
+
+        today_str = date.today().isoformat()
+        snapshot = await get_well_snapshot(today_str)
+        builder = InlineKeyboardBuilder()
+        for date_str, well in results:
+            try:
+                if date_str == today_str:
+                    builder.button(text=well, callback_data=cbd.well_data(well, today_str, snapshot))
+                else:
+                    # Прошлые дни открываются через историю: страница "раньше следующего дня"
+                    next_day = (date.fromisoformat(date_str) + timedelta(days=1)).isoformat()
+                    day_text = date.fromisoformat(date_str).strftime('%d.%m')
+                    builder.button(
+                        text=f"{well} ({day_text})",
+                        callback_data=cbd.history_data(well, today_str, next_day, snapshot)
+                    )
+            except ValueError as e:
+                logger.warning("Skipping search result: %s", e)
+        builder.adjust(3)
+
+        await message.answer(
+            f"🔎 Найдено по запросу «{html.escape(args)}»: {len(results)}",
+            reply_markup=builder.as_markup()
+        )
+    except Exception as e:
+        logger.error("Error in search command: %s", e)
+        await message.answer("⚠️ Ошибка при поиске")
+
+async def process_mode_selection(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
     """Обработчик выбора режима"""
     try:
         user_id = callback.from_user.id
-        mode = callback.data
-        logger.info(f"User {user_id} selected mode: {mode}")
+        mode = cb.mode
+        logger.debug("User %s selected mode: %s", user_id, mode)
         
         if not mode:
-            logger.error(f"Mode is empty or None: {mode}")
+            logger.error("Mode is empty or None: %s", mode)
             await callback.message.answer("⚠️ Ошибка: не выбран режим")
             await callback.answer()
             return
         
-        # Сохраняем выбранный режим
-        await set_user_state(user_id, mode)
-        
-        # Получаем список скважин
-        wells = await get_well_list_ydb(mode)
+        # Режим не сохраняется: он передаётся в кнопках списка скважин
+        today_str = date.today().isoformat()
+        wells = await get_well_snapshot(today_str)
         
         # Определяем название режима для отображения
         mode_text = "Бурение" if mode == "drilling" else "Освоение"
@@ -134,146 +328,264 @@ async def process_mode_selection(callback: CallbackQuery):
         await callback.message.edit_text(
             f"🔧 <b>Режим: {mode_text}</b>\n\n"
             "Выберите скважину:",
-            reply_markup=get_wells_keyboard(wells)
+            reply_markup=get_wells_keyboard(wells, mode, today_str)
         )
         await callback.answer()
     except Exception as e:
-        logger.error(f"Error processing mode selection: {str(e)}")
+        logger.error("Error processing mode selection: %s", e)
         await callback.message.edit_text("⚠️ Ошибка при загрузке данных")
         await callback.answer()
 
 
 
-async def process_well_selection(callback: CallbackQuery):
+async def process_modes_menu(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
+    """Возврат к выбору режима"""
+    await callback.message.edit_text(
+        "Выберите режим работы:",
+        reply_markup=get_mode_keyboard()
+    )
+    await callback.answer()
+
+async def process_home(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
+    """Возврат к приветствию"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🚀 Начать", callback_data=cbd.pack(cbd.START))
+    await callback.message.edit_text(
+        "🔧 Добро пожаловать в бот для работы со скважинами!\n\n"
+        "Нажмите кнопку ниже для начала работы:",
+        reply_markup=builder.as_markup()
+    )
+    await callback.answer()
+
+async def process_well_selection(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
     try:
         user_id = callback.from_user.id
-        well_number = callback.data
-
-        if well_number == "back_to_modes":
-            await callback.message.edit_text(
-                "Выберите режим работы:",
-                reply_markup=get_mode_keyboard()
-            )
-            await callback.answer()
+        well_number = await resolve_well(cb)
+        if well_number is None:
+            await callback.answer("Список скважин обновился, откройте его заново")
             return
 
-        if well_number == "back_to_start":
-            builder = InlineKeyboardBuilder()
-            builder.button(text="🚀 Начать", callback_data="start_bot")
-            await callback.message.edit_text(
-                "🔧 Добро пожаловать в бот для работы со скважинами!\n\n"
-                "Нажмите кнопку ниже для начала работы:",
-                reply_markup=builder.as_markup()
+        # Режим не проверяется: описание от него не зависит, а из /search и inline-режима
+        # скважина открывается без режима. Кнопка "К списку скважин" без режима в cb
+        # берёт его из данных FSM, а если его нет и там — показывает выбор режима
+        logger.debug("Processing well selection %s for user %s", well_number, user_id)
+
+        # Кнопки ссылаются на скважину так же, как нажатая: без повторного поиска в снимке
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(text="🆕 Что изменилось", callback_data=cbd.follow(cb, cbd.CHANGES)),
+            InlineKeyboardButton(text="📝 Краткое summary", callback_data=cbd.follow(cb, cbd.SUMMARY))
+        )
+        builder.row(
+            InlineKeyboardButton(
+                text="📅 История",
+                callback_data=cbd.follow(cb, cbd.HISTORY, date.today().isoformat())
             )
-            await callback.answer()
-            return
+        )
+        builder.row(
+            InlineKeyboardButton(text="🔙 К списку скважин", callback_data=cbd.wells_data(cb.mode)),
+            InlineKeyboardButton(text="🔄 К выбору режима", callback_data=cbd.pack(cbd.MODES))
+        )
+        builder.row(
+            InlineKeyboardButton(text="🏠 В начало", callback_data=cbd.pack(cbd.HOME))
+        )
 
-        mode = await get_user_state(user_id)
+        parts = await get_rendered_parts(well_number)
+        await send_parts_replacing_last(callback, state, parts, builder.as_markup())
 
-        if mode:
-            logger.info(f"Processing well selection {well_number} in mode {mode}")
-
-            last_msg_id = await get_user_message_id(user_id)
-            if last_msg_id:
-                try:
-                    await callback.bot.delete_message(
-                        chat_id=callback.message.chat.id,
-                        message_id=last_msg_id
-                    )
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить старое сообщение: {e}")
+        await callback.answer()
+    except Exception as e:
+        logger.error("Error processing well selection: %s", e)
+        await callback.answer("⚠️ Ошибка при получении описания")
 
-            description = await get_well_description_ydb(well_number)
 
-            builder = InlineKeyboardBuilder()
-            builder.row(
-                InlineKeyboardButton(text="📝 Краткое summary", callback_data=f"summary_{well_number}")
-            )
-            builder.row(
-                InlineKeyboardButton(text="🔙 К списку скважин", callback_data="back_to_wells"),
-                InlineKeyboardButton(text="🔄 К выбору режима", callback_data="back_to_modes")
-            )
-            builder.row(
-                InlineKeyboardButton(text="🏠 В начало", callback_data="back_to_start")
+async def read_state_data(state: FSMContext) -> dict:
+    """Данные FSM пользователя; {} если хранилище состояния недоступно — ответ строится без них"""
+    try:
+        return await state.get_data()
+    except Exception as e:
+        logger.warning("Error reading FSM data: %s", e)
+        return {}
+
+
+async def send_parts_replacing_last(callback: CallbackQuery, state: FSMContext, parts: list[str], reply_markup):
+    """Удаляет предыдущее сообщение со скважиной и отправляет новое (клавиатура — у первой части)"""
+    last_msg_id = (await read_state_data(state)).get("message_id")
+    if last_msg_id:
+        try:
+            await callback.bot.delete_message(
+                chat_id=callback.message.chat.id,
+                message_id=last_msg_id
             )
+        except Exception as e:
+            logger.warning("Не удалось удалить старое сообщение: %s", e)
 
-            full_text = (
-                f"🔹 <b>Скважина {well_number}</b>\n\n"
-                f"📋 Описание работ:\n{description}"
+    for idx, part in enumerate(parts):
+        if idx == 0:
+            msg = await callback.message.answer(part, parse_mode="HTML", reply_markup=reply_markup)
+            try:
+                await state.update_data(message_id=msg.message_id)
+            except Exception as e:
+                logger.warning("Error saving FSM data: %s", e)
+        else:
+            await callback.message.answer(part, parse_mode="HTML")
+
+
+async def process_history_request(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
+    """Показывает описание скважины за ближайший день раньше указанной даты"""
+    try:
+        well_number = await resolve_well(cb)
+        if well_number is None:
+            await callback.answer("Список скважин обновился, откройте его заново")
+            return
+        before_date = cb.before
+        logger.debug("User %s requested history of %s before %s", callback.from_user.id, well_number, before_date)
+
+        page = await get_well_history_page(well_number, before_date)
+        if page is None:
+            await callback.answer("Более ранних данных нет")
+            return
+
+        page_date, description = page
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(
+                text="⬅️ Предыдущий день",
+                callback_data=cbd.follow(cb, cbd.HISTORY, page_date)
             )
-            parts = split_message(full_text)
-            for idx, part in enumerate(parts):
-                if idx == 0:
-                    msg = await callback.message.answer(part, parse_mode="HTML", reply_markup=builder.as_markup())
-                    await set_user_message_id(user_id, msg.message_id)
-                else:
-                    await callback.message.answer(part, parse_mode="HTML")
+        )
+        builder.row(
+            InlineKeyboardButton(text="🔹 К скважине", callback_data=cbd.follow(cb, cbd.WELL)),
+            InlineKeyboardButton(text="🔙 К списку скважин", callback_data=cbd.wells_data(cb.mode))
+        )
 
-            await callback.answer()
-        else:
-            await callback.answer("Режим не выбран.")
+        day_text = date.fromisoformat(page_date).strftime('%d.%m.%Y')
+        full_text = (
+            f"🔹 <b>Скважина {well_number}</b> — 📅 {day_text}\n\n"
+            f"📋 Описание работ:\n{description}"
+        )
+        await send_parts_replacing_last(callback, state, split_message(full_text), builder.as_markup())
+        await callback.answer()
+
+        # Следующая страница подгружается уже после ответа пользователю
+        await prefetch_well_history(well_number, page_date)
     except Exception as e:
-        logger.error(f"Error processing well selection: {str(e)}")
-        await callback.answer("⚠️ Ошибка при получении описания")
+        logger.error("Error processing history request: %s", e)
+        await callback.answer("⚠️ Ошибка при получении истории")
 
 
-async def process_summary_request(callback: CallbackQuery):
-    await callback.answer("Генерируем summary, это может занять до минуты...")  # Сразу отвечаем Telegram!
+async def process_changes_request(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
+    """
+    Что изменилось в описании скважины с предыдущего дня с данными: разница по разделам
+    считается локально, без YandexGPT. Кнопка summary предлагается, только если изменений много.
+    """
+    try:
+        well_number = await resolve_well(cb)
+        if well_number is None:
+            await callback.answer("Список скважин обновился, откройте его заново")
+            return
+        logger.debug("User %s requested changes of %s", callback.from_user.id, well_number)
 
-    well_number = callback.data.replace("summary_", "")
-    description = await get_well_description_ydb(well_number)
-    summary = await get_summary(description)
-    if summary:
-        text_to_send = f"🔹 <b>Скважина {well_number}</b>\n\n📝 <b>Краткое summary:</b>\n{summary}"
-    else:
-        text_to_send = "Не удалось получить summary."
-    parts = split_message(text_to_send)
-    for part in parts:
-        await callback.message.answer(part, parse_mode="HTML")
+        # Сравнивать не с чем: кнопка со вчерашнего сообщения, а за сегодня строки нет
+        if well_number not in await get_well_snapshot(date.today().isoformat()):
+            await callback.answer("За сегодня данных по скважине нет")
+            return
+
+        changes = await get_cached_changes(well_number)
+        if changes is None:
+            await callback.answer("Более ранних данных нет")
+            return
+
+        previous_date, digest = changes
+        builder = InlineKeyboardBuilder()
+        if digest.large:
+            builder.row(InlineKeyboardButton(
+                text="📝 Изменений много — краткое summary",
+                callback_data=cbd.follow(cb, cbd.SUMMARY)
+            ))
+        builder.row(
+            InlineKeyboardButton(text="🔹 К скважине", callback_data=cbd.follow(cb, cbd.WELL)),
+            InlineKeyboardButton(text="🔙 К списку скважин", callback_data=cbd.wells_data(cb.mode))
+        )
 
+        text = render_changes(digest, well_number, previous_date, date.today().isoformat())
+        await send_parts_replacing_last(callback, state, split_message(text), builder.as_markup())
+        await callback.answer()
+    except Exception as e:
+        logger.error("Error processing changes request: %s", e)
+        await callback.answer("⚠️ Ошибка при сравнении описаний")
 
 
+async def process_summary_request(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
+    """
+    Summary описания скважины от YandexGPT. Ошибка YDB или YandexGPT не уходит
+    из обработчика: иначе функция вернёт 500 и Telegram повторит апдейт вместе с запросами.
+    """
+    answered = False
+    try:
+        well_number = await resolve_well(cb)
+        if well_number is None:
+            await callback.answer("Список скважин обновился, откройте его заново")
+            return
+        # YandexGPT отключён выключателем — не заставляем ждать заведомо неудачный запрос
+        if not gpt_breaker.available() and summary_cache.get((date.today().isoformat(), well_number)) is None:
+            await callback.answer(SUMMARY_UNAVAILABLE_TEXT, show_alert=True)
+            return
+        await callback.answer("Генерируем summary, это может занять до минуты...")  # Сразу отвечаем Telegram!
+        answered = True
 
+        summary = await get_cached_summary(well_number)
+        if summary:
+            text_to_send = f"🔹 <b>Скважина {well_number}</b>\n\n📝 <b>Краткое summary:</b>\n{summary}"
+        else:
+            text_to_send = SUMMARY_UNAVAILABLE_TEXT if not gpt_breaker.available() else "Не удалось получить summary."
+        parts = split_message(text_to_send)
+        for part in parts:
+            await callback.message.answer(part, parse_mode="HTML")
+    except Exception as e:
+        logger.error("Error processing summary request: %s", e)
+        if answered:
+            await callback.message.answer(SUMMARY_UNAVAILABLE_TEXT)
+        else:
+            await callback.answer(SUMMARY_UNAVAILABLE_TEXT, show_alert=True)
 
 
 def get_mode_keyboard():
     """Создает клавиатуру выбора режима"""
     builder = InlineKeyboardBuilder()
-    builder.button(text="🔧 Бурение", callback_data="drilling")
-    builder.button(text="🛠 Освоение", callback_data="completion")
+    builder.button(text="🔧 Бурение", callback_data=cbd.mode_data("drilling"))
+    builder.button(text="🛠 Освоение", callback_data=cbd.mode_data("completion"))
     builder.adjust(2)  # Два режима в одном ряду
     
     # Добавляем кнопку возврата
     builder.row(
-        InlineKeyboardButton(text="🏠 В начало", callback_data="back_to_start")
+        InlineKeyboardButton(text="🏠 В начало", callback_data=cbd.pack(cbd.HOME))
     )
     
     return builder.as_markup()
 
-def get_wells_keyboard(wells, row_width=3):
-    """Создает клавиатуру выбора скважины с кнопкой возврата"""
+def get_wells_keyboard(wells, mode, date_str, row_width=3):
+    """Создает клавиатуру выбора скважины с кнопкой возврата (wells — снимок за date_str)"""
     builder = InlineKeyboardBuilder()
     
-    # Добавляем кнопки скважин
+    # Добавляем кнопки скважин: индекс в снимке вместо номера
     for well in wells:
-        builder.button(text=well, callback_data=well)
+        builder.button(text=well, callback_data=cbd.well_data(well, date_str, wells, mode))
     
     # Настраиваем расположение кнопок скважин
     builder.adjust(row_width)
     
     # Добавляем кнопки навигации в отдельный ряд
     builder.row(
-        InlineKeyboardButton(text="🔙 К выбору режима", callback_data="back_to_modes"),
-        InlineKeyboardButton(text="🏠 В начало", callback_data="back_to_start")
+        InlineKeyboardButton(text="🔙 К выбору режима", callback_data=cbd.pack(cbd.MODES)),
+        InlineKeyboardButton(text="🏠 В начало", callback_data=cbd.pack(cbd.HOME))
     )
     
     return builder.as_markup()
 
-async def process_start_button(callback: CallbackQuery):
+async def process_start_button(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
     """Обработчик кнопки 'Начать'"""
     try:
-        logger.info(f"User {callback.from_user.id} pressed start button")
-        
         # Показываем меню выбора режима
         await callback.message.edit_text(
             "Выберите режим работы:",
@@ -281,25 +593,26 @@ async def process_start_button(callback: CallbackQuery):
         )
         await callback.answer()
     except Exception as e:
-        logger.error(f"Error processing start button: {str(e)}")
+        logger.error("Error processing start button: %s", e)
         await callback.answer("⚠️ Произошла ошибка")
 
-async def process_back_to_wells(callback: CallbackQuery):
+async def process_back_to_wells(callback: CallbackQuery, cb: CallbackRef, state: FSMContext):
     """Обработчик возврата к списку скважин"""
     try:
-        user_id = callback.from_user.id
-        mode = await get_user_state(user_id)
+        # Режим приходит в кнопке; у старых кнопок — из сохранённых данных FSM
+        mode = cb.mode or (await read_state_data(state)).get("mode")
         
         if mode:
             # Получаем список скважин заново
-            wells = await get_well_list_ydb(mode)
+            today_str = date.today().isoformat()
+            wells = await get_well_snapshot(today_str)
             
             # Показываем список скважин
             mode_text = "Бурение" if mode == "drilling" else "Освоение"
             await callback.message.edit_text(
                 f"🔧 <b>Режим: {mode_text}</b>\n\n"
                 "Выберите скважину:",
-                reply_markup=get_wells_keyboard(wells)
+                reply_markup=get_wells_keyboard(wells, mode, today_str)
             )
             await callback.answer()
         else:
@@ -309,7 +622,7 @@ async def process_back_to_wells(callback: CallbackQuery):
             )
             await callback.answer()
     except Exception as e:
-        logger.error(f"Error returning to wells list: {str(e)}")
+        logger.error("Error returning to wells list: %s", e)
         await callback.answer("⚠️ Произошла ошибка")
 
 def split_message(text, max_length=4000):
@@ -335,120 +648,80 @@ def split_message(text, max_length=4000):
 
 logger = logging.getLogger(__name__)
 
-async def set_user_message_id(user_id: int, message_id: int):
-    """Надёжная запись message_id пользователя в YDB"""
-    try:
-        logger.info(f"Setting message_id={message_id} for user {user_id}")
-        pool = await get_ydb_pool()
+def render_description(well_number: str, description: str) -> list[str]:
+    """Текст описания скважины, разбитый на сообщения"""
+    return split_message(
+        f"🔹 <b>Скважина {well_number}</b>\n\n"
+        f"📋 Описание работ:\n{description}"
+    )
 
-        def tx(session):
-            # Method 1: Новый стиль через f-string (без параметров)
-            try:
-                query = f"""
-                UPSERT INTO user_state (user_id, message_id)
-                VALUES ({user_id}, {message_id});
-                """
-                session.transaction().execute(
-                    query,
-                    commit_tx=True
-                )
-                logger.info("Method 1 (f-string) worked")
-                return
-            except Exception as e:
-                logger.warning(f"Method 1 failed: {str(e)}")
 
-            # Method 2: Старый стиль с параметрами
-            try:
-                query = """
-                DECLARE $user_id AS Uint64;
-                DECLARE $message_id AS Uint64;
-                UPSERT INTO user_state (user_id, message_id)
-                VALUES ($user_id, $message_id);
-                """
-                params = {
-                    "$user_id": user_id,
-                    "$message_id": message_id
-                }
-                session.transaction().execute(
-                    query,
-                    parameters=params,
-                    commit_tx=True
-                )
-                logger.info("Method 2 (params) worked")
-                return
-            except Exception as e:
-                logger.warning(f"Method 2 failed: {str(e)}")
-
-            # Method 3: Прямой SQL с экранированием (на всякий случай)
-            query = f"""
-            UPSERT INTO user_state (user_id, message_id)
-            VALUES ({int(user_id)}, {int(message_id)});
-            """
-            session.transaction().execute(
-                query,
-                commit_tx=True
-            )
-            logger.info("Method 3 (fallback) worked")
+async def get_rendered_parts(well_number: str) -> list[str]:
+    """Возвращает описание скважины, разбитое на сообщения (кэшируется до изменения данных)"""
+    description = await get_well_description_ydb(well_number)
+    key = (date.today().isoformat(), str(well_number))
+    parts = parts_cache.get(key)
+    if parts is None:
+        parts = render_description(well_number, description)
+        # Ответ из запасного пути (последнее известное описание) и «не найдена» не кэшируются
+        if not is_degraded() and description != WELL_NOT_FOUND_TEXT:
+            parts_cache.set(key, parts)
+    return parts
 
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-        logger.info("User message_id saved successfully")
-    except Exception as e:
-        logger.error(f"Error setting user message_id: {str(e)}")
-        raise
 
-async def get_user_message_id(user_id: int):
-    """Получает message_id пользователя из YDB"""
-    try:
-        logger.info(f"Getting message_id for user {user_id}")
-        pool = await get_ydb_pool()
+async def get_cached_summary(well_number: str) -> str | None:
+    """Возвращает summary скважины (кэшируется до изменения данных)"""
+    description = await get_well_description_ydb(well_number)
+    if description == WELL_NOT_FOUND_TEXT:
+        # Пересказывать нечего; строка может появиться со следующей загрузкой
+        return description
+    key = (date.today().isoformat(), str(well_number))
+    summary = summary_cache.get(key)
+    if summary is None:
+        summary = await get_summary(description)
+        if summary and not is_degraded():
+            summary_cache.set(key, summary)
+    return summary
+
+
+async def get_cached_changes(well_number: str):
+    """
+    Изменения описания скважины относительно предыдущего дня с данными:
+    (предыдущий день, ChangeDigest) или None, если более ранних данных нет.
+    Кэшируется до изменения данных за сегодня (запись сбрасывает invalidate_wells)
+    или за предыдущий день (запись хранит его версию данных).
+    """
+    today_str = date.today().isoformat()
+    await sync_data_version(today_str)
+    key = (today_str, str(well_number))
+    cached = changes_cache.get(key)
+    if cached is not None:
+        previous_date, previous_version, digest = cached
+        if await sync_data_version(previous_date) == previous_version:
+            return previous_date, digest
 
-        def tx(session):
-            # Method 1: f-string (без параметров)
-            try:
-                query = f"""
-                SELECT message_id FROM user_state WHERE user_id = {user_id};
-                """
-                result = session.transaction().execute(
-                    query,
-                    commit_tx=True
-                )
-                if result[0].rows:
-                    logger.info("Method 1 (f-string) worked")
-                    return result[0].rows[0].message_id
-                return None
-            except Exception as e:
-                logger.warning(f"Method 1 failed: {str(e)}")
-
-            # Method 2: параметризованный запрос
-            query = """
-            DECLARE $user_id AS Uint64;
-            SELECT message_id FROM user_state WHERE user_id = $user_id;
-            """
-            params = {"$user_id": user_id}
-            result = session.transaction().execute(
-                query,
-                parameters=params,
-                commit_tx=True
-            )
-            rows = result[0].rows
-            logger.info("Method 2 (params) worked" if rows else "No rows found")
-            return rows[0].message_id if rows else None
-
-        loop = asyncio.get_event_loop()
-        message_id = await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-        logger.info(f"Retrieved message_id: {message_id}")
-        return message_id
-    except Exception as e:
-        logger.error(f"Error getting user message_id: {str(e)}")
+    description = await get_well_description_ydb(well_number)
+    page = await get_well_history_page(well_number, today_str)
+    if page is None:
         return None
-
-
-@alru_cache(maxsize=32)
-async def get_cached_summary(well_number: str) -> str:
-    description = await get_well_description_ydb_cached(well_number)
-    return await get_summary(description)
-
-
-
-
+    previous_date, previous_description = page
+    previous_version = await sync_data_version(previous_date)
+
+    digest = diff_descriptions(previous_description, description)
+    if not is_degraded():
+        changes_cache.set(key, (previous_date, previous_version, digest))
+    return previous_date, digest
+
+
+# Таблица маршрутов колбэков: действие -> обработчик(callback, cb, state)
+CALLBACK_ROUTES = {
+    cbd.START: process_start_button,
+    cbd.MODES: process_modes_menu,
+    cbd.HOME: process_home,
+    cbd.MODE: process_mode_selection,
+    cbd.WELLS: process_back_to_wells,
+    cbd.WELL: process_well_selection,
+    cbd.SUMMARY: process_summary_request,
+    cbd.HISTORY: process_history_request,
+    cbd.CHANGES: process_changes_request,
+}
@@ -0,0 +1,424 @@
+"""
+Подписки на утренний дайджест и его рассылка.
+
+Рассылка запускается триггером по таймеру (broadcast.handler), пока отчёт за день
+не загружен целиком (отметка в wells_ingested) — ждёт, затем отправляет заранее
+отрисованные дайджесты всем подписчикам с ограничением скорости. Прогресс сохраняется
+в broadcast_cursor после каждой страницы подписчиков, поэтому прерванная рассылка
+(дедлайн функции или исчерпанные повторы при flood control) продолжается
+со следующего запуска.
+
+Подписка — на все скважины или на перечисленные. Режимов у строк отчёта нет
+(списки скважин «Бурение» и «Освоение» совпадают), поэтому по режиму она не делится.
+"""
+import os
+import html
+import json
+import time
+import asyncio
+import logging
+from datetime import date
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from services import get_ydb_pool, run_ydb, YDB_LONG_TIMEOUT_SECONDS, is_ingest_complete, get_day_descriptions
+from metrics import inc
+from log_setup import setup_logging, flush_logs
+import callbacks as cbd
+import ydb
+
+logger = logging.getLogger(__name__)
+
+# Скорость отправки (сообщений в секунду; лимит Telegram — около 30) и параллельность
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "8"))
+# Подписчиков на страницу; курсор сохраняется после каждой страницы
+BROADCAST_PAGE_SIZE = int(os.environ.get("BROADCAST_PAGE_SIZE", "50"))
+# Запас времени до таймаута функции, после которого новые страницы не начинаются:
+# страница из 50 подписчиков по 2-3 сообщения при 25 сообщ./с занимает около 6 с
+BROADCAST_SAFETY_SECONDS = 15
+
+# Длина фрагмента описания скважины в дайджесте
+DIGEST_EXCERPT_CHARS = 300
+# Telegram допускает до 100 кнопок в клавиатуре
+MAX_DIGEST_BUTTONS = 100
+MAX_MESSAGE_LENGTH = 4000
+
+# Аргумент /subscribe для подписки на все скважины
+ALL_WELLS_TOKENS = ("все", "all")
+
+
+async def init_broadcast_tables():
+    """Создает таблицы subscriptions и broadcast_cursor если они не существуют"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                user_id Uint64,
+                chat_id Int64,
+                wells Utf8,
+                created_at Timestamp,
+                PRIMARY KEY (user_id)
+            )
+            """
+        )
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_cursor (
+                date Date,
+                last_user_id Uint64,
+                sent Uint64,
+                failed Uint64,
+                finished Bool,
+                updated_at Timestamp,
+                PRIMARY KEY (date)
+            )
+            """
+        )
+
+    await run_ydb("init_broadcast_tables", pool.retry_operation_sync, tx, timeout=YDB_LONG_TIMEOUT_SECONDS)
+    logger.info("subscriptions and broadcast_cursor tables initialized successfully")
+
+
+# --- Подписки ---
+
+async def subscribe(user_id: int, chat_id: int, wells: list):
+    """Создаёт или заменяет подписку пользователя (пустой список — все скважины)"""
+    pool = await get_ydb_pool()
+    query = """
+    DECLARE $user_id AS Uint64;
+    DECLARE $chat_id AS Int64;
+    DECLARE $wells AS Utf8;
+    UPSERT INTO subscriptions (user_id, chat_id, wells, created_at)
+    VALUES ($user_id, $chat_id, $wells, CurrentUtcTimestamp());
+    """
+    params = {
+        "$user_id": user_id,
+        "$chat_id": chat_id,
+        "$wells": json.dumps(wells, ensure_ascii=False) if wells else "",
+    }
+
+    def tx(session):
+        session.transaction().execute(session.prepare(query), params, commit_tx=True)
+
+    await run_ydb("subscribe", pool.retry_operation_sync, tx)
+
+
+async def unsubscribe(user_id: int):
+    """Удаляет подписку пользователя"""
+    pool = await get_ydb_pool()
+    query = """
+    DECLARE $user_id AS Uint64;
+    DELETE FROM subscriptions WHERE user_id = $user_id;
+    """
+
+    def tx(session):
+        session.transaction().execute(session.prepare(query), {"$user_id": user_id}, commit_tx=True)
+
+    await run_ydb("unsubscribe", pool.retry_operation_sync, tx)
+
+
+def _subscription_from_row(row) -> dict:
+    return {
+        "user_id": row.user_id,
+        "chat_id": row.chat_id,
+        "wells": tuple(json.loads(row.wells)) if row.wells else (),
+    }
+
+
+async def get_subscription(user_id: int):
+    """Возвращает подписку пользователя или None"""
+    pool = await get_ydb_pool()
+    query = """
+    DECLARE $user_id AS Uint64;
+    SELECT user_id, chat_id, wells FROM subscriptions WHERE user_id = $user_id;
+    """
+
+    def tx(session):
+        result = session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query), {"$user_id": user_id}, commit_tx=True
+        )
+        rows = result[0].rows
+        return _subscription_from_row(rows[0]) if rows else None
+
+    return await run_ydb("get_subscription", pool.retry_operation_sync, tx)
+
+
+async def get_subscribers_page(after_user_id: int, limit: int = BROADCAST_PAGE_SIZE) -> list:
+    """Страница подписчиков в порядке user_id, начиная после after_user_id"""
+    pool = await get_ydb_pool()
+    query = """
+    DECLARE $after AS Uint64;
+    DECLARE $limit AS Uint64;
+    SELECT user_id, chat_id, wells FROM subscriptions
+    WHERE user_id > $after ORDER BY user_id LIMIT $limit;
+    """
+
+    def tx(session):
+        result = session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query), {"$after": after_user_id, "$limit": limit}, commit_tx=True
+        )
+        return [_subscription_from_row(row) for row in result[0].rows]
+
+    return await run_ydb("get_subscribers_page", pool.retry_operation_sync, tx)
+
+
+# --- Курсор рассылки ---
+
+async def load_cursor(date_str: str) -> dict:
+    pool = await get_ydb_pool()
+    query = """
+    DECLARE $date AS Date;
+    SELECT last_user_id, sent, failed, finished FROM broadcast_cursor WHERE date = $date;
+    """
+
+    def tx(session):
+        result = session.transaction().execute(
+            session.prepare(query), {"$date": date.fromisoformat(date_str)}, commit_tx=True
+        )
+        rows = result[0].rows
+        if not rows:
+            return {"last_user_id": 0, "sent": 0, "failed": 0, "finished": False}
+        row = rows[0]
+        return {
+            "last_user_id": row.last_user_id or 0,
+            "sent": row.sent or 0,
+            "failed": row.failed or 0,
+            "finished": bool(row.finished),
+        }
+
+    return await run_ydb("load_broadcast_cursor", pool.retry_operation_sync, tx)
+
+
+async def save_cursor(date_str: str, cursor: dict):
+    pool = await get_ydb_pool()
+    query = """
+    DECLARE $date AS Date;
+    DECLARE $last_user_id AS Uint64;
+    DECLARE $sent AS Uint64;
+    DECLARE $failed AS Uint64;
+    DECLARE $finished AS Bool;
+    UPSERT INTO broadcast_cursor (date, last_user_id, sent, failed, finished, updated_at)
+    VALUES ($date, $last_user_id, $sent, $failed, $finished, CurrentUtcTimestamp());
+    """
+    params = {
+        "$date": date.fromisoformat(date_str),
+        "$last_user_id": cursor["last_user_id"],
+        "$sent": cursor["sent"],
+        "$failed": cursor["failed"],
+        "$finished": cursor["finished"],
+    }
+
+    def tx(session):
+        session.transaction().execute(session.prepare(query), params, commit_tx=True)
+
+    await run_ydb("save_broadcast_cursor", pool.retry_operation_sync, tx)
+
+
+# --- Отрисовка дайджестов ---
+
+def _excerpt(description: str) -> str:
+    text = " ".join(description.split())
+    if len(text) > DIGEST_EXCERPT_CHARS:
+        text = text[:DIGEST_EXCERPT_CHARS].rsplit(" ", 1)[0] + "…"
+    return html.escape(text)
+
+
+class DigestRenderer:
+    """
+    Отрисовывает дайджест один раз на каждый набор скважин:
+    у большинства подписчиков подписки совпадают, и сообщения переиспользуются.
+    """
+
+    def __init__(self, date_str: str, descriptions: dict):
+        self.date_str = date_str
+        self.descriptions = descriptions
+        self.snapshot = tuple(sorted(descriptions))
+        self._rendered = {}
+
+    def render(self, wells: tuple) -> list:
+        if wells not in self._rendered:
+            self._rendered[wells] = self._render(wells)
+        return self._rendered[wells]
+
+    def _render(self, wells):
+        selected = [w for w in (wells or self.snapshot) if w in self.descriptions]
+        day_text = date.fromisoformat(self.date_str).strftime('%d.%m.%Y')
+        header = f"☀️ <b>Сводка на {day_text}</b>, скважин: {len(selected)}\n"
+        if not selected:
+            return [(header + "\nЗа сегодня данных по выбранным скважинам нет.", None)]
+
+        blocks = [
+            f"🔹 <b>{html.escape(w)}</b>: {_excerpt(self.descriptions[w])}"
+            for w in selected
+        ]
+        messages, current = [], header
+        for block in blocks:
+            if len(current) + len(block) + 2 > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = ""
+            current += "\n" + block + "\n"
+        messages.append(current)
+
+        # Кнопки открытия скважин — у последнего сообщения
+        builder = InlineKeyboardBuilder()
+        for well in selected[:MAX_DIGEST_BUTTONS]:
+            try:
+                builder.button(text=well, callback_data=cbd.well_data(well, self.date_str, self.snapshot))
+            except ValueError as e:
+                logger.warning("Skipping digest button: %s", e)
+        builder.adjust(4)
+        markup = builder.as_markup()
+        return [(text, None) for text in messages[:-1]] + [(messages[-1], markup)]
+
+
+# --- Отправка ---
+
+class FloodControlError(Exception):
+    """Telegram продолжает отвечать 429 — рассылку нужно продолжить позже"""
+
+
+class RateLimitedSender:
+    """
+    Отправляет сообщения не быстрее rate в секунду (равномерно, без всплесков)
+    и не более concurrency запросов одновременно; на 429 ждёт retry_after.
+    Если повторы исчерпаны, отправитель останавливается: следующие отправки
+    сразу выбрасывают FloodControlError.
+    """
+
+    def __init__(self, bot, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self.interval = 1 / rate
+        self.halted = False
+        self._next_at = 0.0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _wait_slot(self):
+        now = time.monotonic()
+        slot = max(now, self._next_at)
+        self._next_at = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def send(self, chat_id, text, reply_markup=None, attempts=3):
+        async with self._semaphore:
+            for attempt in range(attempts):
+                if self.halted:
+                    raise FloodControlError("sender halted by flood control")
+                await self._wait_slot()
+                try:
+                    await self.bot.send_message(chat_id, text, reply_markup=reply_markup)
+                    return
+                except TelegramRetryAfter as e:
+                    logger.warning("Flood control, retry after %s s", e.retry_after)
+                    inc("broadcast_retries_total")
+                    # Все следующие отправки тоже сдвигаются
+                    self._next_at = max(self._next_at, time.monotonic() + e.retry_after)
+            self.halted = True
+            raise FloodControlError(f"Gave up sending to chat {chat_id} after {attempts} attempts")
+
+
+# Исходы доставки дайджеста подписчику
+SENT, FAILED, DROPPED, POSTPONED = "sent", "failed", "dropped", "postponed"
+
+
+async def _deliver(sender, subscription, messages):
+    """Отправляет дайджест одному подписчику; возвращает исход доставки"""
+    try:
+        for text, markup in messages:
+            await sender.send(subscription["chat_id"], text, markup)
+        return SENT
+    except FloodControlError:
+        return POSTPONED
+    except TelegramForbiddenError as e:
+        # Бот заблокирован пользователем — подписка больше не нужна
+        logger.info("Dropping subscription of user %s: %s", subscription["user_id"], e)
+        return DROPPED
+    except TelegramBadRequest as e:
+        logger.warning("Error sending digest to user %s: %s", subscription["user_id"], e)
+        return DROPPED if "chat not found" in str(e).lower() else FAILED
+    except Exception as e:
+        logger.error("Error sending digest to user %s: %s", subscription["user_id"], e)
+        return FAILED
+
+
+async def run_broadcast(bot, date_str=None, deadline=None):
+    """
+    Рассылает дайджест за дату всем подписчикам. Возвращает статус:
+    waiting (отчёт за день ещё не загружен целиком), done,
+    partial (остановлено по deadline или flood control; продолжится со следующего запуска).
+    """
+    date_str = date_str or date.today().isoformat()
+    cursor = await load_cursor(date_str)
+    if cursor["finished"]:
+        return {"status": "done", **cursor}
+
+    if not await is_ingest_complete(date_str):
+        logger.info("Report for %s is not fully ingested yet, broadcast postponed", date_str)
+        return {"status": "waiting"}
+
+    # Все описания за день одним scan-запросом
+    renderer = DigestRenderer(date_str, await get_day_descriptions(date_str))
+    sender = RateLimitedSender(bot, BROADCAST_RATE, BROADCAST_CONCURRENCY)
+
+    while True:
+        if deadline is not None and time.monotonic() > deadline:
+            logger.info("Broadcast deadline reached, progress saved: %s", cursor)
+            return {"status": "partial", **cursor}
+
+        page = await get_subscribers_page(cursor["last_user_id"], BROADCAST_PAGE_SIZE)
+        if not page:
+            break
+
+        results = await asyncio.gather(*(
+            _deliver(sender, sub, renderer.render(sub["wells"]))
+            for sub in page
+        ))
+        # Курсор доходит только до первого отложенного подписчика: с него рассылка
+        # продолжится в следующий запуск (отправленные после него получат дайджест повторно)
+        sent = 0
+        for sub, outcome in zip(page, results):
+            if outcome == POSTPONED:
+                break
+            cursor["sent" if outcome == SENT else "failed"] += 1
+            sent += outcome == SENT
+            if outcome == DROPPED:
+                await unsubscribe(sub["user_id"])
+            cursor["last_user_id"] = sub["user_id"]
+        inc("broadcast_sent_total", value=sent)
+        await save_cursor(date_str, cursor)
+        if sender.halted:
+            logger.warning("Broadcast paused by flood control, progress saved: %s", cursor)
+            return {"status": "partial", **cursor}
+
+    cursor["finished"] = True
+    await save_cursor(date_str, cursor)
+    logger.info("Broadcast for %s finished: %s", date_str, cursor)
+    return {"status": "done", **cursor}
+
+
+def handler(event, context):
+    """Точка входа для Yandex Cloud Functions (триггер по таймеру, например раз в 5 минут с 08:00)"""
+    from bot import setup_bot
+    setup_logging()
+
+    async def run():
+        deadline = None
+        remaining = getattr(context, "get_remaining_time_in_millis", None)
+        if remaining is not None:
+            deadline = time.monotonic() + remaining() / 1000 - BROADCAST_SAFETY_SECONDS
+        bot = setup_bot()
+        try:
+            return await run_broadcast(bot, deadline=deadline)
+        finally:
+            await bot.session.close()
+
+    try:
+        result = asyncio.run(run())
+        return {"statusCode": 200, "body": json.dumps({"ok": True, **result})}
+    except Exception as e:
+        logger.error("Broadcast failed: %s", e, exc_info=True)
+        return {"statusCode": 500, "body": json.dumps({"ok": False, "error": str(e)})}
+    finally:
+        flush_logs()
@@ -0,0 +1,78 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Ключ для кэша списка скважин за дату
+WELL_LIST_KEY = "*"
+
+
+class KeyedCache:
+    """LRU-кэш с ключами (дата, скважина) и точечной инвалидацией"""
+
+    def __init__(self, name, maxsize=256):
+        self.name = name
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        # Кэш может использоваться из нескольких потоков (например, при нагрузочном прогоне)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, keys):
+        """Удаляет переданные ключи, возвращает число удалённых записей"""
+        removed = 0
+        with self._lock:
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_caches = {}
+
+
+def get_cache(name, maxsize=256):
+    """Возвращает (создаёт при необходимости) именованный кэш"""
+    cache = _caches.get(name)
+    if cache is None:
+        cache = _caches[name] = KeyedCache(name, maxsize)
+    return cache
+
+
+def invalidate_wells(date_str, well_numbers):
+    """Сбрасывает во всех кэшах записи изменившихся скважин за дату"""
+    keys = [(date_str, well) for well in well_numbers]
+    keys.append((date_str, WELL_LIST_KEY))
+    removed = sum(cache.invalidate(keys) for cache in _caches.values())
+    logger.log(
+        logging.INFO if removed else logging.DEBUG,
+        "Invalidated %s cache entries for %s wells on %s", removed, len(well_numbers), date_str
+    )
+    return removed
+
+
+def clear_all():
+    """Полностью очищает все кэши"""
+    for cache in _caches.values():
+        cache.clear()
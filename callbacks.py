@@ -0,0 +1,206 @@
+"""
+Компактные callback_data кнопок и маршрутизация колбэков.
+
+Формат: "<действие>:<поле>:...". Скважина передаётся ссылкой на снимок списка
+скважин за день — "<индекс>.<контроль>", где контроль — младший байт crc32 номера
+(защита от сдвига индексов, если список за день обновился), либо, если снимка
+под рукой нет, самим номером: "~<номер>". Старые кнопки (номер скважины,
+summary_<номер>, history_<номер>_<дата>, back_to_wells...) по-прежнему разбираются.
+"""
+import zlib
+import bisect
+import logging
+from typing import NamedTuple, Optional
+from datetime import date, timedelta
+from aiogram import BaseMiddleware
+from services import get_well_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину callback_data, байт
+MAX_CALLBACK_BYTES = 64
+
+# Действия
+START = "st"        # кнопка "Начать"
+MODES = "md"        # меню выбора режима
+MODE = "m"          # m:<режим>
+WELLS = "l"         # l:<режим> — список скважин
+WELL = "w"          # w:<режим>:<день>:<ссылка>
+SUMMARY = "s"       # s:<день>:<ссылка>
+HISTORY = "h"       # h:<режим>:<день>:<раньше дня>:<ссылка>
+CHANGES = "c"       # c:<режим>:<день>:<ссылка> — что изменилось с предыдущего дня
+HOME = "0"          # приветствие
+
+# Коды режимов
+MODE_CODES = {"drilling": "d", "completion": "c"}
+MODES_BY_CODE = {code: mode for mode, code in MODE_CODES.items()}
+
+_EPOCH = date(1970, 1, 1)
+
+# Старые callback_data без параметров
+_LEGACY_SIMPLE = {
+    "start_bot": (START, None),
+    "drilling": (MODE, "drilling"),
+    "completion": (MODE, "completion"),
+    "back_to_wells": (WELLS, None),
+    "back_to_modes": (MODES, None),
+    "back_to_start": (HOME, None),
+}
+
+
+class CallbackRef(NamedTuple):
+    """Разобранные callback_data"""
+    action: str
+    mode: Optional[str] = None
+    day: Optional[str] = None       # дата снимка, к которому относится ссылка на скважину
+    index: Optional[int] = None
+    check: Optional[int] = None
+    well: Optional[str] = None      # номер скважины, если передан явно
+    before: Optional[str] = None    # для истории: показать запись раньше этой даты
+
+
+def day_code(date_str: str) -> str:
+    """Дата -> номер дня от 1970-01-01"""
+    return str((date.fromisoformat(date_str) - _EPOCH).days)
+
+
+def day_from_code(code: str) -> str:
+    return (_EPOCH + timedelta(days=int(code))).isoformat()
+
+
+def _check(well: str) -> int:
+    return zlib.crc32(well.encode("utf-8")) & 0xFF
+
+
+def well_ref(well: str, snapshot=None) -> str:
+    """Ссылка на скважину: индекс в отсортированном снимке или сам номер"""
+    if snapshot:
+        idx = bisect.bisect_left(snapshot, well)
+        if idx < len(snapshot) and snapshot[idx] == well:
+            return f"{idx}.{_check(well):02x}"
+    return f"~{well}"
+
+
+def pack(action: str, *fields) -> str:
+    """Собирает callback_data и проверяет ограничение Telegram"""
+    data = action + ":" + ":".join(str(f) for f in fields)
+    if len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data too long: {data!r}")
+    return data
+
+
+def mode_data(mode):
+    return pack(MODE, MODE_CODES[mode])
+
+
+def wells_data(mode=None):
+    return pack(WELLS, MODE_CODES.get(mode, ""))
+
+
+def well_data(well, date_str, snapshot=None, mode=None):
+    return pack(WELL, MODE_CODES.get(mode, ""), day_code(date_str), well_ref(well, snapshot))
+
+
+def summary_data(well, date_str, snapshot=None):
+    return pack(SUMMARY, day_code(date_str), well_ref(well, snapshot))
+
+
+def history_data(well, date_str, before_date_str, snapshot=None, mode=None):
+    return pack(
+        HISTORY, MODE_CODES.get(mode, ""), day_code(date_str), day_code(before_date_str), well_ref(well, snapshot)
+    )
+
+
+def changes_data(well, date_str, snapshot=None, mode=None):
+    return pack(CHANGES, MODE_CODES.get(mode, ""), day_code(date_str), well_ref(well, snapshot))
+
+
+def ref_text(ref: "CallbackRef") -> str:
+    """Ссылка на скважину из разобранных данных — для кнопок, ведущих к той же скважине"""
+    if ref.well is not None:
+        return f"~{ref.well}"
+    return f"{ref.index}.{ref.check:02x}"
+
+
+def follow(ref: "CallbackRef", action: str, before_date_str: str = None) -> str:
+    """callback_data действия над той же скважиной с тем же режимом и снимком"""
+    mode = MODE_CODES.get(ref.mode, "")
+    day = day_code(ref.day)
+    if action in (WELL, CHANGES):
+        return pack(action, mode, day, ref_text(ref))
+    if action == SUMMARY:
+        return pack(SUMMARY, day, ref_text(ref))
+    if action == HISTORY:
+        return pack(HISTORY, mode, day, day_code(before_date_str), ref_text(ref))
+    raise ValueError(f"Unsupported action for follow(): {action}")
+
+
+def _parse_ref(ref: str, day_str: str, **fields) -> dict:
+    if ref.startswith("~"):
+        return dict(fields, day=day_str, well=ref[1:])
+    index, _, check = ref.partition(".")
+    return dict(fields, day=day_str, index=int(index), check=int(check, 16))
+
+
+def _decode_legacy(data: str) -> CallbackRef:
+    if data in _LEGACY_SIMPLE:
+        action, mode = _LEGACY_SIMPLE[data]
+        return CallbackRef(action, mode=mode)
+    today_str = date.today().isoformat()
+    if data.startswith("summary_"):
+        return CallbackRef(SUMMARY, day=today_str, well=data[len("summary_"):])
+    if data.startswith("history_") and "_" in data[len("history_"):]:
+        well, before = data[len("history_"):].rsplit("_", 1)
+        return CallbackRef(HISTORY, day=today_str, well=well, before=before)
+    return CallbackRef(WELL, day=today_str, well=data)
+
+
+def decode(data: str) -> CallbackRef:
+    """Разбирает callback_data (новый формат или старый)"""
+    action, sep, rest = (data or "").partition(":")
+    try:
+        if sep and action in (START, MODES, HOME):
+            return CallbackRef(action)
+        if sep and action in (MODE, WELLS):
+            return CallbackRef(action, mode=MODES_BY_CODE.get(rest))
+        if sep and action in (WELL, CHANGES):
+            mode, day, ref = rest.split(":", 2)
+            return CallbackRef(action, **_parse_ref(ref, day_from_code(day), mode=MODES_BY_CODE.get(mode)))
+        if sep and action == SUMMARY:
+            day, ref = rest.split(":", 1)
+            return CallbackRef(SUMMARY, **_parse_ref(ref, day_from_code(day)))
+        if sep and action == HISTORY:
+            mode, day, before, ref = rest.split(":", 3)
+            return CallbackRef(HISTORY, **_parse_ref(
+                ref, day_from_code(day), mode=MODES_BY_CODE.get(mode), before=day_from_code(before)
+            ))
+    except ValueError:
+        logger.warning("Malformed callback_data %r, treating as legacy", data)
+    return _decode_legacy(data)
+
+
+async def resolve_well(ref: CallbackRef) -> Optional[str]:
+    """Номер скважины по ссылке; None, если снимок за день изменился и ссылка устарела"""
+    if ref.well is not None:
+        return ref.well
+    snapshot = await get_well_snapshot(ref.day)
+    if ref.index < len(snapshot) and _check(snapshot[ref.index]) == ref.check:
+        return snapshot[ref.index]
+    logger.info("Stale well reference %s.%02x for %s", ref.index, ref.check, ref.day)
+    return None
+
+
+class CallbackRoutingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware колбэков: один раз разбирает callback_data и находит обработчик
+    в таблице маршрутов. Результат передаётся дальше как data["cb"] и data["callback_route"].
+    """
+
+    def __init__(self, routes: dict):
+        self.routes = routes
+
+    async def __call__(self, handler, event, data):
+        ref = decode(event.data)
+        data["cb"] = ref
+        data["callback_route"] = self.routes.get(ref.action)
+        return await handler(event, data)
@@ -0,0 +1,134 @@
+"""
+Что изменилось в описании скважины по сравнению с предыдущим днём — без YandexGPT.
+
+Описание делится на разделы по заголовкам, которые выделяет format_description
+(«Работы за прошлые сутки», «Работы за текущие сутки», «Проблемные вопросы»),
+разделы разбиваются на фразы и сравниваются difflib'ом. Расчёт занимает миллисекунды.
+"""
+import re
+import html
+import difflib
+from typing import NamedTuple
+from datetime import date
+
+# Доля изменившегося текста, начиная с которой изменения лучше пересказать через summary
+LARGE_CHANGE_RATIO = 0.5
+# Сколько фраз показывать в разделе и до какой длины их обрезать
+MAX_FRAGMENTS = 8
+MAX_FRAGMENT_LENGTH = 300
+
+# Раздел до первого заголовка
+PREAMBLE_TITLE = "Общее"
+
+_HEADING_RE = re.compile(r"<b>(.*?)</b>", re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+_FRAGMENT_SPLIT_RE = re.compile(r"(?<=[.;!?])\s+|[\r\n]+")
+
+# Заголовки format_description: после них могут идти уточнения («... (скв. 101):»)
+_KNOWN_HEADINGS = ("Работы за прошлые сутки", "Работы за текущие сутки", "Проблемные вопросы")
+
+
+class SectionChange(NamedTuple):
+    """Изменения одного раздела: добавленные и исчезнувшие фразы"""
+    title: str
+    added: list
+    removed: list
+
+
+class ChangeDigest(NamedTuple):
+    """Изменения описания по разделам (в порядке сегодняшнего описания)"""
+    sections: list
+    ratio: float        # доля изменившегося текста, 0..1
+
+    @property
+    def changed(self) -> bool:
+        return any(s.added or s.removed for s in self.sections)
+
+    @property
+    def large(self) -> bool:
+        return self.ratio >= LARGE_CHANGE_RATIO
+
+
+def _heading_title(heading: str) -> str:
+    heading = " ".join(_TAG_RE.sub("", heading).split()).rstrip(":")
+    for known in _KNOWN_HEADINGS:
+        if heading.lower().startswith(known.lower()):
+            return known
+    return heading
+
+
+def split_sections(formatted: str) -> dict:
+    """Описание после format_description -> {заголовок: [фразы]} в порядке следования"""
+    parts = _HEADING_RE.split(formatted or "")
+    sections = {}
+    titles = [PREAMBLE_TITLE] + [_heading_title(h) for h in parts[1::2]]
+    for title, body in zip(titles, parts[0::2]):
+        # Двоеточие после «Проблемные вопросы» остаётся вне заголовка — отрезается здесь
+        fragments = [
+            " ".join(f.split()).lstrip(": ") for f in _FRAGMENT_SPLIT_RE.split(_TAG_RE.sub(" ", body))
+        ]
+        sections.setdefault(title, []).extend(f for f in fragments if f)
+    if not sections.get(PREAMBLE_TITLE):
+        sections.pop(PREAMBLE_TITLE, None)
+    return sections
+
+
+def diff_descriptions(previous: str, current: str) -> ChangeDigest:
+    """Сравнивает два описания (оба после format_description) по разделам"""
+    old_sections = split_sections(previous)
+    new_sections = split_sections(current)
+    titles = list(new_sections) + [t for t in old_sections if t not in new_sections]
+
+    result, changed_chars, total_chars = [], 0, 0
+    for title in titles:
+        old = old_sections.get(title, [])
+        new = new_sections.get(title, [])
+        matcher = difflib.SequenceMatcher(None, [f.lower() for f in old], [f.lower() for f in new], autojunk=False)
+        added, removed = [], []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            removed.extend(old[i1:i2])
+            added.extend(new[j1:j2])
+            old_text, new_text = " ".join(old[i1:i2]), " ".join(new[j1:j2])
+            # Заменённая фраза, в которой поменялись только цифры, — небольшое изменение
+            similarity = difflib.SequenceMatcher(None, old_text, new_text).ratio() if tag == "replace" else 0.0
+            changed_chars += (1 - similarity) * (len(old_text) + len(new_text))
+        total_chars += sum(map(len, old)) + sum(map(len, new))
+        result.append(SectionChange(title, added, removed))
+
+    return ChangeDigest(result, changed_chars / total_chars if total_chars else 0.0)
+
+
+def _fragment_lines(marker: str, fragments: list) -> list:
+    lines = [
+        f"{marker} {html.escape(f if len(f) <= MAX_FRAGMENT_LENGTH else f[:MAX_FRAGMENT_LENGTH] + '…')}"
+        for f in fragments[:MAX_FRAGMENTS]
+    ]
+    if len(fragments) > MAX_FRAGMENTS:
+        lines.append(f"{marker} … и ещё {len(fragments) - MAX_FRAGMENTS}")
+    return lines
+
+
+def _day_text(date_str: str) -> str:
+    return date.fromisoformat(date_str).strftime('%d.%m.%Y')
+
+
+def render_changes(digest: ChangeDigest, well_number: str, previous_date_str: str, date_str: str) -> str:
+    """HTML-текст изменений для сообщения бота"""
+    lines = [
+        f"🆕 <b>Скважина {html.escape(str(well_number))}: что изменилось</b>",
+        f"📅 {_day_text(previous_date_str)} → {_day_text(date_str)}",
+    ]
+    if not digest.changed:
+        lines += ["", "Описание не изменилось."]
+        return "\n".join(lines)
+
+    for section in digest.sections:
+        lines += ["", f"<b>{html.escape(section.title)}</b>"]
+        if not (section.added or section.removed):
+            lines.append("без изменений")
+            continue
+        lines += _fragment_lines("➕", section.added)
+        lines += _fragment_lines("➖", section.removed)
+    return "\n".join(lines)
@@ -0,0 +1,117 @@
+import logging
+import contextvars
+from aiogram.fsm.state import State
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import DisabledEventIsolation
+from services import get_state_backend
+
+logger = logging.getLogger(__name__)
+
+# Записи FSM, прочитанные или изменённые в текущем апдейте: ключ -> _Record
+_update_records = contextvars.ContextVar("fsm_update_records", default=None)
+
+
+class _Record:
+    __slots__ = ("state", "data", "dirty")
+
+    def __init__(self, state, data):
+        self.state = state
+        self.data = data
+        self.dirty = False
+
+
+class WriteBehindStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram поверх хранилища состояния (YDB / SQLite / память).
+    В пределах апдейта запись читается из хранилища один раз, изменения копятся
+    в памяти и записываются одной транзакцией в конце апдейта (FsmFlushMiddleware).
+    Вне апдейта чтение и запись идут напрямую.
+    """
+
+    def __init__(self, backend=None, key_builder=None):
+        self._backend = backend
+        self.key_builder = key_builder or DefaultKeyBuilder()
+
+    @property
+    def backend(self):
+        return self._backend or get_state_backend()
+
+    async def _load(self, key):
+        records = _update_records.get()
+        storage_key = self.key_builder.build(key)
+        if records is not None and storage_key in records:
+            return storage_key, records[storage_key]
+        state, data = await self.backend.get_fsm(storage_key)
+        record = _Record(state, data)
+        if records is not None:
+            records[storage_key] = record
+        return storage_key, record
+
+    async def _store(self, storage_key, record):
+        if _update_records.get() is not None:
+            record.dirty = True
+        else:
+            await self.backend.set_fsm_many({storage_key: (record.state, record.data)})
+
+    async def set_state(self, key, state=None):
+        storage_key, record = await self._load(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._store(storage_key, record)
+
+    async def get_state(self, key):
+        _, record = await self._load(key)
+        return record.state
+
+    async def set_data(self, key, data):
+        storage_key, record = await self._load(key)
+        record.data = dict(data)
+        await self._store(storage_key, record)
+
+    async def get_data(self, key):
+        _, record = await self._load(key)
+        return dict(record.data)
+
+    async def flush(self):
+        """Записывает изменения текущего апдейта одной транзакцией"""
+        records = _update_records.get()
+        if not records:
+            return
+        dirty = {k: (r.state, r.data) for k, r in records.items() if r.dirty}
+        if not dirty:
+            return
+        await self.backend.set_fsm_many(dirty)
+        for record in records.values():
+            record.dirty = False
+
+    async def close(self):
+        pass
+
+
+class FsmFlushMiddleware(FSMContextMiddleware):
+    """
+    Замена стандартного FSM middleware aiogram (Dispatcher(disable_fsm=True)):
+    открывает кэш записей на апдейт, передаёт обработчикам FSMContext
+    и сбрасывает изменения в конце апдейта.
+
+    raw_state заранее не читается — обработчики, которым состояние не нужно,
+    не платят за запрос к хранилищу. Фильтры StateFilter поэтому не поддерживаются.
+    """
+
+    def __init__(self, storage: WriteBehindStorage):
+        super().__init__(storage=storage, events_isolation=DisabledEventIsolation())
+
+    async def __call__(self, handler, event, data):
+        token = _update_records.set({})
+        try:
+            data["fsm_storage"] = self.storage
+            context = self.resolve_event_context(data["bot"], data)
+            if context:
+                data["state"] = context
+            return await handler(event, data)
+        finally:
+            try:
+                await self.storage.flush()
+            except Exception as e:
+                logger.error("Error flushing FSM state: %s", e)
+            _update_records.reset(token)
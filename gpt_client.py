@@ -1,58 +1,83 @@
 import os
 import logging
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from yandex_cloud_ml_sdk import YCloudML
 from yandex_cloud_ml_sdk.auth import APIKeyAuth
+from metrics import timed
+from log_setup import log_sampled
+from resilience import CircuitOpenError, bounded, get_breaker, timeout_for
 
 logger = logging.getLogger(__name__)
 
 FOLDER_ID = os.getenv('FOLDER_ID')
 YANDEX_API_KEY = os.getenv('YANDEX_API_KEY')
 
-def sync_get_summary(text: str) -> str | None:
-    try:
-        if not all([FOLDER_ID, YANDEX_API_KEY]):
-            logger.error("Не заданы FOLDER_ID или YANDEX_API_KEY в окружении")
-            return None
-
-        if not text or not text.strip():
-            logger.error("Пустой текст для YandexGPT")
-            return None
-
-        logger.info(f"Запрос к YandexGPT. Длина текста: {len(text)} символов. Превью: {text[:100]!r}")
-
-        sdk = YCloudML(
-            folder_id=FOLDER_ID,
-            auth=APIKeyAuth(YANDEX_API_KEY)
-        )
-        model = sdk.models.completions("yandexgpt",  model_version="rc")
-        model = model.configure(temperature=0)
-        prompt = (
-            "Ты специалист по бурению нефтяных и газовых скважин. "
-            "Суммируй текст кратко и по делу:\n"
-            f"{text}"
-        )
-
-        logger.debug(f"Отправляемый prompt в YandexGPT: {prompt[:300]!r}")
-
-        result = model.run(prompt)
-        logger.info("Ответ от YandexGPT успешно получен")
-        if result and hasattr(result[0], "text"):
-            logger.debug(f"Ответ YandexGPT (первые 300 символов): {result[0].text[:300]!r}")
-            return result[0].text.strip()
-        else:
-            logger.error("Пустой ответ от YandexGPT")
-            return None
+# Потолок на один запрос к YandexGPT (внутри апдейта ещё и не позже его дедлайна), с
+GPT_TIMEOUT_SECONDS = float(os.getenv('GPT_TIMEOUT_SECONDS', '30'))
 
-    except Exception as e:
-        logger.error(f"Ошибка YandexGPT: {str(e)}", exc_info=True)
+gpt_breaker = get_breaker("gpt")
+
+# Свой пул потоков: запрос, не уложившийся в таймаут, не прерывается и занимает поток
+# до ответа SDK — пул ограничен, и asyncio.run при завершении его потоки не ждёт
+GPT_EXECUTOR_WORKERS = int(os.getenv('GPT_EXECUTOR_WORKERS', '4'))
+_gpt_executor = ThreadPoolExecutor(max_workers=GPT_EXECUTOR_WORKERS, thread_name_prefix="gpt")
+
+def sync_get_summary(text: str, timeout: float = GPT_TIMEOUT_SECONDS) -> str | None:
+    """
+    Синхронный запрос к YandexGPT. Ошибки SDK пробрасываются — их учитывает
+    выключатель в get_summary.
+    """
+    if not all([FOLDER_ID, YANDEX_API_KEY]):
+        logger.error("Не заданы FOLDER_ID или YANDEX_API_KEY в окружении")
+        return None
+
+    if not text or not text.strip():
+        logger.error("Пустой текст для YandexGPT")
+        return None
+
+    logger.debug("Запрос к YandexGPT. Длина текста: %s символов", len(text))
+    log_sampled(logger, "gpt.preview", "Превью текста для YandexGPT: %r", text[:100])
+
+    sdk = YCloudML(
+        folder_id=FOLDER_ID,
+        auth=APIKeyAuth(YANDEX_API_KEY)
+    )
+    model = sdk.models.completions("yandexgpt",  model_version="rc")
+    model = model.configure(temperature=0)
+    prompt = (
+        "Ты специалист по бурению нефтяных и газовых скважин. "
+        "Суммируй текст кратко и по делу:\n"
+        f"{text}"
+    )
+
+    log_sampled(logger, "gpt.prompt", "Отправляемый prompt в YandexGPT: %r", prompt[:300])
+
+    result = model.run(prompt, timeout=timeout)
+    logger.debug("Ответ от YandexGPT успешно получен")
+    if result and hasattr(result[0], "text"):
+        log_sampled(logger, "gpt.response", "Ответ YandexGPT (первые 300 символов): %r", result[0].text[:300])
+        return result[0].text.strip()
+    else:
+        logger.error("Пустой ответ от YandexGPT")
         return None
 
 async def get_summary(text: str) -> str | None:
-    """Асинхронная обертка для синхронного вызова"""
+    """
+    Асинхронная обертка для синхронного вызова: не дольше GPT_TIMEOUT_SECONDS и дедлайна
+    апдейта, через выключатель YandexGPT. None — summary получить не удалось.
+    """
     try:
         loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, sync_get_summary, text)
+        timeout = timeout_for(GPT_TIMEOUT_SECONDS)
+        async with gpt_breaker.guard():
+            async with timed("gpt", "get_summary"):
+                return await bounded(
+                    lambda: loop.run_in_executor(_gpt_executor, sync_get_summary, text, timeout), GPT_TIMEOUT_SECONDS
+                )
+    except CircuitOpenError as e:
+        logger.warning("YandexGPT skipped: %s", e)
+        return None
     except Exception as e:
-        logger.error(f"Ошибка в асинхронном вызове YandexGPT: {str(e)}", exc_info=True)
+        logger.error("Ошибка в асинхронном вызове YandexGPT: %s", e, exc_info=True)
         return None
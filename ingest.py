@@ -0,0 +1,536 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import logging
+import hashlib
+import argparse
+from datetime import date
+import ydb
+from dotenv import load_dotenv
+from utils import download_file
+from services import get_ydb_driver, get_ydb_pool, note_data_version, rebuild_search_index, YDB_DATABASE
+from services import run_ydb, YDB_LONG_TIMEOUT_SECONDS
+from cache import invalidate_wells
+from log_setup import setup_logging, flush_logs
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация источника отчёта
+CREDS_URL = os.environ.get("CREDS_URL")
+DRILLING_SHEET_ID = os.environ.get("DRILLING_SHEET_ID")
+SHEET_NAMES = {
+    "drilling": "08:00",
+    "completion": "08:00 ОСВ"
+}
+
+# Размер пачки для BulkUpsert и страницы чтения из Google Sheets
+BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "500"))
+SHEETS_PAGE_SIZE = int(os.environ.get("INGEST_SHEETS_PAGE_SIZE", "1000"))
+
+WELLS_TABLE = "wells"
+
+
+def wells_column_types():
+    """Типы колонок таблицы wells для BulkUpsert"""
+    return (
+        ydb.BulkUpsertColumns()
+        .add_column("well_number", ydb.OptionalType(ydb.PrimitiveType.Utf8))
+        .add_column("date", ydb.OptionalType(ydb.PrimitiveType.Date))
+        .add_column("description", ydb.OptionalType(ydb.PrimitiveType.Utf8))
+        .add_column("content_hash", ydb.OptionalType(ydb.PrimitiveType.Uint64))
+    )
+
+
+def content_hash(description):
+    """64-битный хэш содержимого строки отчёта"""
+    digest = hashlib.blake2b(description.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _normalize_row(row):
+    """Приводит строку отчёта к паре (номер скважины, описание) или None"""
+    if not row:
+        return None
+    well_number = str(row[0] or "").strip()
+    if not well_number:
+        return None
+    description = str(row[1]).strip() if len(row) > 1 and row[1] is not None else ""
+    return well_number, description
+
+
+# --- Адаптеры источников ---
+
+def iter_csv_rows(path, skip_header=True, encoding="utf-8-sig"):
+    """Построчно читает отчёт из CSV (колонки: скважина, описание)"""
+    with open(path, newline="", encoding=encoding) as f:
+        reader = csv.reader(f)
+        if skip_header:
+            next(reader, None)
+        for row in reader:
+            normalized = _normalize_row(row)
+            if normalized:
+                yield normalized
+
+
+def iter_xlsx_rows(path, sheet_name=None, skip_header=True):
+    """Построчно читает отчёт из XLSX в режиме read-only (нужен openpyxl)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("Для чтения XLSX установите openpyxl")
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.active
+        rows = sheet.iter_rows(min_row=2 if skip_header else 1, max_col=2, values_only=True)
+        for row in rows:
+            normalized = _normalize_row(row)
+            if normalized:
+                yield normalized
+    finally:
+        workbook.close()
+
+
+async def iter_sheet_rows(sheet_id, sheet_name, page_size=SHEETS_PAGE_SIZE):
+    """Постранично читает отчёт из Google Sheets, не загружая весь диапазон целиком"""
+    from aiogoogle import Aiogoogle
+    from aiogoogle.auth.creds import ServiceAccountCreds
+
+    creds_dict = await download_file(CREDS_URL, is_json=True)
+    creds = ServiceAccountCreds(
+        scopes=["https://www.googleapis.com/auth/spreadsheets.readonly"],
+        **creds_dict
+    )
+
+    async with Aiogoogle(service_account_creds=creds) as aiogoogle:
+        sheets_api = await aiogoogle.discover("sheets", "v4")
+        start = 2
+        while True:
+            end = start + page_size - 1
+            result = await aiogoogle.as_service_account(
+                sheets_api.spreadsheets.values.get(
+                    spreadsheetId=sheet_id,
+                    range=f"{sheet_name}!A{start}:B{end}"
+                )
+            )
+            values = result.get("values", [])
+            for row in values:
+                normalized = _normalize_row(row)
+                if normalized:
+                    yield normalized
+            if len(values) < page_size:
+                break
+            start = end + 1
+
+
+async def _aiter(rows):
+    """Оборачивает синхронный итератор строк в асинхронный"""
+    for row in rows:
+        yield row
+
+
+def open_source(source, sheet_name=None):
+    """
+    Возвращает асинхронный итератор строк отчёта по описанию источника:
+    - путь к .csv / .xlsx файлу;
+    - "sheets" — Google Sheets (DRILLING_SHEET_ID, лист по sheet_name).
+    """
+    if source == "sheets":
+        if not DRILLING_SHEET_ID:
+            raise ValueError("DRILLING_SHEET_ID not set")
+        return iter_sheet_rows(DRILLING_SHEET_ID, sheet_name or SHEET_NAMES["drilling"])
+    lower = source.lower()
+    if lower.endswith(".csv"):
+        return _aiter(iter_csv_rows(source))
+    if lower.endswith(".xlsx"):
+        return _aiter(iter_xlsx_rows(source, sheet_name))
+    raise ValueError(f"Unsupported report source: {source}")
+
+
+# --- Загрузка в YDB ---
+
+async def init_wells_table():
+    """Создает таблицы wells, wells_versions, wells_changes, wells_search и wells_ingested если они не существуют"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS wells (
+                well_number Utf8,
+                date Date,
+                description Utf8,
+                content_hash Uint64,
+                PRIMARY KEY (well_number, date)
+            )
+            """
+        )
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS wells_versions (
+                date Date,
+                version Uint64,
+                updated_at Timestamp,
+                PRIMARY KEY (date)
+            )
+            """
+        )
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS wells_changes (
+                date Date,
+                version Uint64,
+                well_number Utf8,
+                PRIMARY KEY (date, version, well_number)
+            )
+            """
+        )
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS wells_search (
+                date Date,
+                version Uint64,
+                payload String,
+                PRIMARY KEY (date)
+            )
+            """
+        )
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS wells_ingested (
+                date Date,
+                wells Uint64,
+                completed_at Timestamp,
+                PRIMARY KEY (date)
+            )
+            """
+        )
+
+    await run_ydb("init_wells_table", pool.retry_operation_sync, tx, timeout=YDB_LONG_TIMEOUT_SECONDS)
+    logger.info("wells table initialized successfully")
+    await migrate_wells_table()
+
+
+_wells_migrated = False
+_tables_ready = False
+
+async def init_all_tables():
+    """
+    Создает все таблицы проекта (данные скважин и таблицы бота) и выполняет миграции.
+    Вызывается один раз на процесс из ingest.handler и из CLI (--init): загрузка
+    отчёта идёт по таймеру, поэтому к первому апдейту бота таблицы уже существуют.
+    """
+    global _tables_ready
+    if _tables_ready:
+        return
+    # Модули бота импортируются здесь: для разбора отчёта они не нужны
+    from services import init_fsm_state_table, migrate_user_state
+    from throttling import init_throttle_table
+    from broadcast import init_broadcast_tables
+
+    await init_wells_table()
+    await init_fsm_state_table()
+    await migrate_user_state()
+    await init_throttle_table()
+    await init_broadcast_tables()
+    _tables_ready = True
+
+async def migrate_wells_table():
+    """
+    Добавляет колонку content_hash в таблицу wells, созданную до её появления
+    (CREATE TABLE IF NOT EXISTS существующую таблицу не меняет). Выполняется
+    один раз на процесс; если колонка уже есть, ничего не делает.
+    """
+    global _wells_migrated
+    if _wells_migrated:
+        return
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        description = session.describe_table(f"{YDB_DATABASE}/{WELLS_TABLE}")
+        if any(column.name == "content_hash" for column in description.columns):
+            return False
+        session.execute_scheme(f"ALTER TABLE {WELLS_TABLE} ADD COLUMN content_hash Uint64;")
+        return True
+
+    if await run_ydb("migrate_wells_table", pool.retry_operation_sync, tx, timeout=YDB_LONG_TIMEOUT_SECONDS):
+        logger.info("Column content_hash added to %s", WELLS_TABLE)
+    _wells_migrated = True
+
+
+async def _bulk_upsert(driver, rows):
+    """Отправляет одну пачку строк в wells через BulkUpsert"""
+    table_path = f"{YDB_DATABASE}/{WELLS_TABLE}"
+    column_types = wells_column_types()
+    await run_ydb(
+        "bulk_upsert_wells", driver.table_client.bulk_upsert, table_path, rows, column_types,
+        timeout=YDB_LONG_TIMEOUT_SECONDS
+    )
+
+
+async def load_existing_hashes(report_date):
+    """Читает хэши уже загруженных за дату строк (scan-запросом, без лимита в 1000 строк)"""
+    driver = await get_ydb_driver()
+    query = ydb.ScanQuery(
+        """
+        DECLARE $date AS Date;
+        SELECT well_number, content_hash FROM wells WHERE date = $date;
+        """,
+        {"$date": ydb.PrimitiveType.Date}
+    )
+
+    def scan():
+        hashes = {}
+        for part in driver.table_client.scan_query(query, {"$date": report_date}):
+            for row in part.result_set.rows:
+                hashes[row.well_number] = row.content_hash
+        return hashes
+
+    return await run_ydb("load_existing_hashes", scan, timeout=YDB_LONG_TIMEOUT_SECONDS)
+
+
+async def delete_wells(report_date, well_numbers):
+    """Удаляет строки скважин за дату (скважины, пропавшие из отчёта)"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        session.transaction(ydb.SerializableReadWrite()).execute(
+            session.prepare("""
+            DECLARE $date AS Date;
+            DECLARE $wells AS List<Utf8>;
+            DELETE FROM wells WHERE date = $date AND well_number IN $wells;
+            """),
+            {"$date": report_date, "$wells": sorted(well_numbers)},
+            commit_tx=True
+        )
+
+    await run_ydb("delete_wells", pool.retry_operation_sync, tx)
+
+
+async def mark_ingest_complete(report_date, wells_count):
+    """Отмечает, что отчёт за дату загружен целиком (по этой отметке стартует рассылка)"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        session.transaction().execute(
+            session.prepare("""
+            DECLARE $date AS Date;
+            DECLARE $wells AS Uint64;
+            UPSERT INTO wells_ingested (date, wells, completed_at)
+            VALUES ($date, $wells, CurrentUtcTimestamp());
+            """),
+            {"$date": report_date, "$wells": wells_count},
+            commit_tx=True
+        )
+
+    await run_ydb("mark_ingest_complete", pool.retry_operation_sync, tx)
+
+
+async def commit_data_version(report_date, changed_wells):
+    """
+    Увеличивает версию данных за дату и записывает список изменившихся скважин
+    в wells_changes одной транзакцией. Возвращает новую версию.
+    """
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        transaction = session.transaction(ydb.SerializableReadWrite())
+        result = transaction.execute(
+            session.prepare("""
+            DECLARE $date AS Date;
+            SELECT version FROM wells_versions WHERE date = $date;
+            """),
+            {"$date": report_date}
+        )
+        rows = result[0].rows
+        version = (rows[0].version if rows else 0) + 1
+        transaction.execute(
+            session.prepare("""
+            DECLARE $date AS Date;
+            DECLARE $version AS Uint64;
+            DECLARE $wells AS List<Utf8>;
+            UPSERT INTO wells_versions (date, version, updated_at)
+            VALUES ($date, $version, CurrentUtcTimestamp());
+            UPSERT INTO wells_changes (date, version, well_number)
+            SELECT $date AS date, $version AS version, well_number
+            FROM AS_TABLE(ListMap($wells, ($w) -> (AsStruct($w AS well_number))));
+            """),
+            {"$date": report_date, "$version": version, "$wells": sorted(changed_wells)},
+            commit_tx=True
+        )
+        return version
+
+    return await run_ydb("commit_data_version", pool.retry_operation_sync, tx)
+
+
+async def publish_changes(report_date, changed):
+    """
+    Новая версия данных за дату: номера изменившихся скважин попадают в wells_changes,
+    сбрасываются в локальных кэшах, поисковый индекс перестраивается. Возвращает версию.
+    """
+    date_str = report_date.isoformat()
+    version = await commit_data_version(report_date, changed)
+    note_data_version(date_str, version)
+    invalidate_wells(date_str, changed)
+    try:
+        await rebuild_search_index(date_str, version)
+    except Exception as e:
+        logger.error("Error rebuilding search index: %s", e, exc_info=True)
+    return version
+
+
+async def ingest_report(rows, report_date=None, batch_size=BATCH_SIZE, seen=None):
+    """
+    Загружает строки отчёта в таблицу wells пачками по batch_size.
+    rows — асинхронный итератор пар (номер скважины, описание).
+    Записываются только строки, чей хэш содержимого отличается от уже загруженного;
+    номера изменившихся скважин попадают в wells_changes и сбрасываются в локальных кэшах.
+    В seen (если передано) добавляются номера всех скважин отчёта.
+    Возвращает статистику загрузки.
+    """
+    report_date = report_date or date.today()
+    date_str = report_date.isoformat()
+    driver = await get_ydb_driver()
+    await migrate_wells_table()
+
+    started = time.perf_counter()
+    existing = await load_existing_hashes(report_date)
+    total = 0
+    written = 0
+    batches = 0
+    batch = []
+    changed = set()
+
+    async for well_number, description in rows:
+        total += 1
+        if seen is not None:
+            seen.add(well_number)
+        row_hash = content_hash(description)
+        if existing.get(well_number) == row_hash:
+            continue
+        existing[well_number] = row_hash
+        changed.add(well_number)
+        batch.append({
+            "well_number": well_number,
+            "date": report_date,
+            "description": description,
+            "content_hash": row_hash,
+        })
+        if len(batch) >= batch_size:
+            await _bulk_upsert(driver, batch)
+            written += len(batch)
+            batches += 1
+            batch = []
+
+    if batch:
+        await _bulk_upsert(driver, batch)
+        written += len(batch)
+        batches += 1
+
+    version = None
+    if changed:
+        version = await publish_changes(report_date, changed)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "date": date_str,
+        "rows": total,
+        "written": written,
+        "unchanged": total - written,
+        "batches": batches,
+        "version": version,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(total / elapsed, 1) if elapsed > 0 else float(total),
+        "changed_wells": sorted(changed),
+    }
+    logger.info("Ingestion finished: %s", json.dumps(stats, ensure_ascii=False))
+    return stats
+
+
+async def remove_missing_wells(report_date, seen):
+    """
+    Удаляет за дату скважины, которых нет в отчёте, и публикует их как изменения
+    (кэши и кнопки ботов перестают их показывать). Возвращает удалённые номера.
+    """
+    if not seen:
+        # Пустой отчёт скорее означает сбой источника, чем отсутствие скважин
+        logger.warning("Report for %s is empty, missing wells are not removed", report_date)
+        return set()
+    missing = set(await load_existing_hashes(report_date)) - seen
+    if missing:
+        await delete_wells(report_date, missing)
+        await publish_changes(report_date, missing)
+        logger.info("Removed %s wells missing from the report for %s", len(missing), report_date)
+    return missing
+
+
+async def run_ingestion(source, report_date=None, sheet_names=None):
+    """
+    Загружает отчёт из одного источника (для Sheets — по всем листам режимов).
+    Если прочитан отчёт целиком (листы не выбраны явно), скважины, пропавшие
+    из него, удаляются за дату, а дата отмечается в wells_ingested как загруженная.
+    """
+    if source == "sheets":
+        names = sheet_names or list(SHEET_NAMES.values())
+    else:
+        names = sheet_names or [None]
+
+    report_date = report_date or date.today()
+    seen = set()
+    results = []
+    for sheet_name in names:
+        rows = open_source(source, sheet_name)
+        results.append(await ingest_report(rows, report_date, seen=seen))
+    if not sheet_names:
+        removed = await remove_missing_wells(report_date, seen)
+        results[-1]["removed_wells"] = sorted(removed)
+        if seen:
+            await mark_ingest_complete(report_date, len(seen))
+    return results
+
+
+def handler(event, context):
+    """Точка входа для Yandex Cloud Functions (триггер по таймеру)"""
+    setup_logging()
+    source = os.environ.get("REPORT_SOURCE", "sheets")
+
+    async def run():
+        await init_all_tables()
+        return await run_ingestion(source)
+
+    try:
+        results = asyncio.run(run())
+        return {"statusCode": 200, "body": json.dumps({"ok": True, "results": results})}
+    except Exception as e:
+        logger.error("Ingestion failed: %s", e, exc_info=True)
+        return {"statusCode": 500, "body": json.dumps({"ok": False, "error": str(e)})}
+    finally:
+        flush_logs()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Загрузка суточного отчёта в YDB")
+    parser.add_argument("source", nargs="?", help="путь к .csv/.xlsx или 'sheets' (без него — только --init)")
+    parser.add_argument("--date", help="дата отчёта YYYY-MM-DD (по умолчанию сегодня)")
+    parser.add_argument("--sheet", action="append", help="имя листа (можно несколько)")
+    parser.add_argument("--init", action="store_true", help="создать все таблицы перед загрузкой")
+    args = parser.parse_args()
+    if not args.source and not args.init:
+        parser.error("укажите источник отчёта или --init")
+
+    async def main_cli():
+        if args.init:
+            await init_all_tables()
+        if not args.source:
+            return []
+        report_date = date.fromisoformat(args.date) if args.date else None
+        return await run_ingestion(args.source, report_date, args.sheet)
+
+    for result in asyncio.run(main_cli()):
+        print(json.dumps(result, ensure_ascii=False))
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# Уровень и формат логов: LOG_FORMAT=json — по JSON-объекту на строку
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
+# Доли сэмплирования событий горячего пути: "ydb.state=0.01,gpt.prompt=0"
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+DEFAULT_SAMPLE_RATE = float(os.environ.get("LOG_DEFAULT_SAMPLE_RATE", "0.05"))
+
+# Идентификаторы для связывания записей одного апдейта
+_correlation = contextvars.ContextVar("log_correlation", default={})
+
+_queue = None
+_listener = None
+
+
+def _parse_rates(spec):
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+_sample_rates = _parse_rates(LOG_SAMPLE_RATES)
+
+
+def bind(**ids):
+    """Добавляет идентификаторы (request_id, update_id, user_id...) к записям текущего контекста"""
+    _correlation.set({**_correlation.get(), **{k: v for k, v in ids.items() if v is not None}})
+
+
+def correlation_ids():
+    """Возвращает идентификаторы текущего контекста"""
+    return dict(_correlation.get())
+
+
+def clear_correlation():
+    _correlation.set({})
+
+
+def sampled(event):
+    """Решает, пишется ли очередная запись события event"""
+    rate = _sample_rates.get(event, DEFAULT_SAMPLE_RATE)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def log_sampled(logger, event, msg, *args, level=logging.DEBUG):
+    """
+    Пишет запись события горячего пути с сэмплированием. Проверки уровня
+    и сэмплирования выполняются до создания записи, аргументы не форматируются.
+    Сэмплируются только DEBUG и INFO: предупреждения и ошибки пишутся всегда.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if level >= logging.WARNING or sampled(event):
+        logger.log(level, msg, *args, extra={"event": event})
+
+
+def log_record(logger, fields, level=logging.INFO):
+    """Пишет одну структурированную запись с идентификаторами текущего контекста"""
+    if logger.isEnabledFor(level):
+        fields = {**correlation_ids(), **fields}
+        logger.log(level, "%s", _JsonPayload(fields), extra={"structured": fields})
+
+
+class _JsonPayload:
+    """Откладывает json.dumps до форматирования записи в потоке-слушателе"""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, ensure_ascii=False, default=str)
+
+
+class CorrelationFilter(logging.Filter):
+    """Прикрепляет к записи идентификаторы текущего апдейта"""
+
+    def filter(self, record):
+        record.correlation = _correlation.get()
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке: в очередь уходит запись,
+    а не готовая строка, и формат (текст/JSON) применяет поток QueueListener.
+    """
+
+    def prepare(self, record):
+        # Аргументы могут измениться, пока запись ждёт в очереди, — текст сообщения
+        # фиксируется сразу. Структурированная запись владеет своим словарём,
+        # поэтому её JSON по-прежнему собирается в потоке-слушателе
+        if not hasattr(record, "structured"):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        ids = getattr(record, "correlation", None)
+        # В структурированной записи идентификаторы уже есть
+        if ids and not hasattr(record, "structured"):
+            text += " [" + " ".join(f"{k}={v}" for k, v in ids.items()) + "]"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        structured = getattr(record, "structured", None)
+        if structured is not None:
+            payload.update(structured)
+        else:
+            payload["msg"] = record.getMessage()
+        payload.update(getattr(record, "correlation", None) or {})
+        event = getattr(record, "event", None)
+        if event:
+            payload["event"] = event
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def setup_logging(level=None):
+    """
+    Настраивает логирование бота: корневой логгер пишет в очередь,
+    а форматирование и вывод выполняет отдельный поток.
+    """
+    global _queue, _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter("%(levelname)s:%(name)s:%(message)s"))
+
+    _queue = queue.Queue()
+    queue_handler = LazyQueueHandler(_queue)
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level or LOG_LEVEL)
+    # aiogram пишет свою строку на каждый апдейт — её заменяет запись из metrics
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    _listener = QueueListener(_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def flush_logs(timeout=1.0):
+    """Дожидается вывода накопленных записей (перед заморозкой экземпляра функции)"""
+    if _queue is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def stop_logging():
+    """Останавливает поток вывода, дописав очередь"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -6,15 +6,18 @@ import logging
 from aiogram.types import Update
 from bot import setup_bot, setup_dispatcher
 from services import cleanup_temp_files
+from log_setup import setup_logging, flush_logs, bind, clear_correlation
+from resilience import deadline_from_context
+from metrics import PROMETHEUS_FILE, run_prometheus_writer
 
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: вывод в отдельном потоке, без блокировки event loop
+setup_logging()
 logger = logging.getLogger(__name__)
 
-async def process_webhook_update(update_json):
-    """Обрабатывает webhook-запрос от Telegram"""
+async def process_webhook_update(update_json, deadline=None):
+    """Обрабатывает webhook-запрос от Telegram (deadline — time.monotonic(), до которого нужно уложиться)"""
     bot = None
     try:
         bot = setup_bot()
@@ -24,11 +27,11 @@ async def process_webhook_update(update_json):
         update = Update(**update_json)
         
         # Обрабатываем обновление
-        await dp.feed_update(bot=bot, update=update)
+        await dp.feed_update(bot=bot, update=update, update_deadline=deadline)
         
         return {"statusCode": 200, "body": json.dumps({"ok": True})}
     except Exception as e:
-        logger.error(f"Error processing update: {str(e)}", exc_info=True)
+        logger.error("Error processing update: %s", e, exc_info=True)
         return {"statusCode": 500, "body": json.dumps({"ok": False, "error": str(e)})}
     finally:
         # Закрываем HTTP сессию бота
@@ -36,12 +39,15 @@ async def process_webhook_update(update_json):
             try:
                 await bot.session.close()
             except Exception as e:
-                logger.warning(f"Error closing bot session: {e}")
+                logger.warning("Error closing bot session: %s", e)
 
 def handler(event, context):
     """Упрощенный обработчик для Yandex Cloud Functions"""
     try:
-        logger.info(f"Received event")
+        clear_correlation()
+        bind(request_id=getattr(context, "request_id", None))
+        # Время, оставшееся у функции, — общий дедлайн всех вызовов внутри апдейта
+        deadline = deadline_from_context(context)
         
         # Проверяем наличие тела запроса
         if 'body' not in event or not event['body']:
@@ -52,35 +58,45 @@ def handler(event, context):
         try:
             update_json = json.loads(event['body'])
         except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {str(e)}")
+            logger.error("JSON decode error: %s", e)
             return {"statusCode": 200, "body": json.dumps({"ok": True, "message": "Invalid JSON in body"})}
         
         # Используем asyncio.run() для простоты
-        result = asyncio.run(process_webhook_update(update_json))
+        result = asyncio.run(process_webhook_update(update_json, deadline))
         return result
         
     except Exception as e:
-        logger.error(f"Global error: {str(e)}", exc_info=True)
+        logger.error("Global error: %s", e, exc_info=True)
         return {"statusCode": 500, "body": json.dumps({"ok": False, "error": str(e)})}
     finally:
         # Очистка временных файлов
         try:
             cleanup_temp_files()
         except Exception as e:
-            logger.warning(f"Error cleaning up temp files: {e}")
+            logger.warning("Error cleaning up temp files: %s", e)
+        # Логи должны уйти до заморозки экземпляра функции
+        flush_logs()
 
 # Для локального тестирования
 if __name__ == "__main__":
+    # Один процесс владеет всем состоянием — хватает локального SQLite вместо YDB
+    os.environ.setdefault("STATE_BACKEND", "sqlite")
+
     async def main_local():
         logger.info("Starting bot in polling mode...")
+        # Снимок метрик пишется по таймеру, а не после каждого апдейта
+        writer = asyncio.create_task(run_prometheus_writer(PROMETHEUS_FILE)) if PROMETHEUS_FILE else None
         try:
             bot = setup_bot()
             dp = setup_dispatcher()
             await bot.delete_webhook(drop_pending_updates=True)
             await dp.start_polling(bot)
         except Exception as e:
-            logger.error(f"Error in polling: {str(e)}")
+            logger.error("Error in polling: %s", e)
         finally:
+            if writer:
+                writer.cancel()
+                await asyncio.gather(writer, return_exceptions=True)
             cleanup_temp_files()
     
     asyncio.run(main_local())
@@ -0,0 +1,244 @@
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import asynccontextmanager
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from log_setup import bind, log_record
+
+logger = logging.getLogger("metrics")
+
+# Границы корзин гистограмм задержек, мс
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+# Файл для Prometheus-снимка (например, для textfile collector); пусто — не писать
+PROMETHEUS_FILE = os.environ.get("METRICS_PROMETHEUS_FILE")
+# Как часто переписывать файл, с
+PROMETHEUS_INTERVAL = float(os.environ.get("METRICS_PROMETHEUS_INTERVAL", "15"))
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+
+    __slots__ = ("counts", "total", "sum_ms")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def observe(self, value_ms):
+        self.total += 1
+        self.sum_ms += value_ms
+        for idx, bound in enumerate(BUCKETS_MS):
+            if value_ms <= bound:
+                self.counts[idx] += 1
+                break
+
+
+# (вид, имя) -> Histogram; вид: handler, ydb, telegram, gpt, update
+_histograms = {}
+# (имя счётчика, метка) -> значение
+_counters = {}
+_gauges = {}
+
+_cold_start = True
+
+# Замеры текущего апдейта: список (вид, имя, мс)
+_update_timings = contextvars.ContextVar("update_timings", default=None)
+
+
+def observe(kind, name, value_ms):
+    """Записывает задержку в гистограмму и в замеры текущего апдейта"""
+    histogram = _histograms.get((kind, name))
+    if histogram is None:
+        histogram = _histograms[(kind, name)] = Histogram()
+    histogram.observe(value_ms)
+
+    timings = _update_timings.get()
+    if timings is not None:
+        timings.append((kind, name, value_ms))
+
+
+def inc(name, label="", value=1):
+    """Увеличивает счётчик"""
+    _counters[(name, label)] = _counters.get((name, label), 0) + value
+
+
+def set_gauge(name, label, value):
+    """Устанавливает значение метрики-индикатора"""
+    _gauges[(name, label)] = value
+
+
+def consume_cold_start():
+    """Возвращает True только для первого апдейта в экземпляре функции"""
+    global _cold_start
+    cold, _cold_start = _cold_start, False
+    return cold
+
+
+@asynccontextmanager
+async def timed(kind, name):
+    """Замеряет время выполнения блока как обращения к зависимости kind"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("dependency_errors_total", f"{kind}:{name}")
+        raise
+    finally:
+        observe(kind, name, (time.perf_counter() - started) * 1000)
+
+
+def _summarize(timings):
+    """Сводка замеров апдейта по видам зависимостей"""
+    deps = {}
+    for kind, name, value_ms in timings:
+        entry = deps.setdefault(kind, {"count": 0, "ms": 0.0, "calls": {}})
+        entry["count"] += 1
+        entry["ms"] += value_ms
+        entry["calls"][name] = round(entry["calls"].get(name, 0.0) + value_ms, 2)
+    for entry in deps.values():
+        entry["ms"] = round(entry["ms"], 2)
+    return deps
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: замеряет обработку целиком
+    и пишет одну структурированную JSON-строку на апдейт.
+    """
+
+    async def __call__(self, handler, event, data):
+        timings = []
+        token = _update_timings.set(timings)
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        bind(
+            update_id=getattr(event, "update_id", None),
+            user_id=user.id if user else None,
+            chat_id=chat.id if chat else None,
+        )
+        cold = consume_cold_start()
+        update_type = getattr(event, "event_type", "unknown")
+        status = "ok"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            total_ms = (time.perf_counter() - started) * 1000
+            _update_timings.reset(token)
+            observe("update", update_type, total_ms)
+            inc("updates_total", update_type)
+            if status == "error":
+                inc("update_errors_total", update_type)
+            if cold:
+                inc("cold_starts_total")
+
+            # Единственная INFO-запись на апдейт: идентификаторы, обработчик и задержки
+            handlers = [name for kind, name, _ in timings if kind == "handler"]
+            log_record(logger, {
+                "event": "update",
+                "type": update_type,
+                "handler": handlers[0] if handlers else None,
+                "cold_start": cold,
+                "status": status,
+                "total_ms": round(total_ms, 2),
+                "deps": _summarize([t for t in timings if t[0] != "handler"]),
+            })
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware событий: замеряет конкретный обработчик"""
+
+    async def __call__(self, handler, event, data):
+        # Для колбэков — обработчик из таблицы маршрутов, а не общий диспетчер
+        route = data.get("callback_route")
+        handler_object = data.get("handler")
+        if route is not None:
+            name = route.__name__
+        else:
+            name = handler_object.callback.__name__ if handler_object else "unknown"
+        async with timed("handler", name):
+            return await handler(event, data)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: замеряет каждый вызов Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        async with timed("telegram", type(method).__name__):
+            return await make_request(bot, method)
+
+
+def render_prometheus():
+    """Возвращает снимок метрик в текстовом формате Prometheus"""
+    lines = [
+        "# HELP bot_latency_ms Latency of updates, handlers and dependencies in milliseconds",
+        "# TYPE bot_latency_ms histogram",
+    ]
+    for (kind, name), histogram in sorted(_histograms.items()):
+        labels = f'kind="{kind}",name="{name}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS_MS, histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'bot_latency_ms_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"bot_latency_ms_sum{{{labels}}} {histogram.sum_ms:.3f}")
+        lines.append(f"bot_latency_ms_count{{{labels}}} {histogram.total}")
+
+    for kind, values in (("counter", _counters), ("gauge", _gauges)):
+        for name in sorted({name for name, _ in values}):
+            lines.append(f"# TYPE bot_{name} {kind}")
+            for (metric, label), value in sorted(values.items()):
+                if metric == name:
+                    suffix = f'{{label="{label}"}}' if label else ""
+                    lines.append(f"bot_{name}{suffix} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """Атомарно записывает Prometheus-снимок в файл"""
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning("Error writing Prometheus snapshot: %s", e)
+
+
+async def run_prometheus_writer(path, interval=PROMETHEUS_INTERVAL):
+    """Фоновая задача: переписывает файл раз в interval секунд и последний раз — при остановке"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            write_prometheus(path)
+    finally:
+        write_prometheus(path)
+
+
+def snapshot():
+    """Возвращает метрики в виде словаря (для тестов и бенчмарков)"""
+    return {
+        "histograms": {
+            f"{kind}:{name}": {"count": h.total, "sum_ms": round(h.sum_ms, 3)}
+            for (kind, name), h in _histograms.items()
+        },
+        "counters": {f"{name}:{label}" if label else name: v for (name, label), v in _counters.items()},
+        "gauges": {f"{name}:{label}": v for (name, label), v in _gauges.items()},
+    }
+
+
+def reset():
+    """Сбрасывает все метрики (и признак холодного старта)"""
+    global _cold_start
+    _histograms.clear()
+    _counters.clear()
+    _gauges.clear()
+    _cold_start = True
@@ -0,0 +1,237 @@
+"""
+Дедлайн апдейта и автоматические выключатели (circuit breaker) внешних зависимостей.
+
+Дедлайн берётся из контекста облачной функции (get_remaining_time_in_millis) и ограничивает
+каждый вызов YDB, YandexGPT и Bot API внутри апдейта: деградировавшая зависимость
+не держит экземпляр до таймаута платформы.
+
+Выключатель после BREAKER_FAILURES отказов подряд перестаёт обращаться к зависимости
+на BREAKER_RESET_SECONDS и сразу выбрасывает CircuitOpenError, после чего пропускает
+один пробный вызов. Обработчики в это время отвечают деградированно (последнее известное
+описание, «summary временно недоступно»). Состояние выключателей — метрика
+circuit_breaker_state: 0 — замкнут, 1 — пробный вызов, 2 — разомкнут.
+"""
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError
+from metrics import inc, set_gauge
+
+logger = logging.getLogger(__name__)
+
+# Бюджет апдейта, если платформа его не сообщила (polling, бенчмарки), с
+UPDATE_BUDGET_SECONDS = float(os.environ.get("UPDATE_BUDGET_SECONDS", "25"))
+# Запас от времени функции: после дедлайна зависимостей ещё можно ответить Telegram, с
+DEADLINE_RESERVE_SECONDS = float(os.environ.get("DEADLINE_RESERVE_SECONDS", "2"))
+
+# Ответ пользователю на апдейт, отброшенный по дедлайну или выключателю
+UNAVAILABLE_TEXT = "⚠️ Сервис временно недоступен, попробуйте позже"
+
+# Выключатель: отказов подряд до размыкания и пауза до пробного вызова, с
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+_STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half-open", OPEN: "open"}
+
+# Дедлайн текущего апдейта (time.monotonic()) и зависимости, отданные из запасного пути
+_deadline = contextvars.ContextVar("update_deadline", default=None)
+_degraded = contextvars.ContextVar("update_degraded", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Время на обработку апдейта истекло"""
+
+
+class CircuitOpenError(Exception):
+    """Выключатель зависимости разомкнут — вызов не выполнялся"""
+
+
+def deadline_from_context(context):
+    """Дедлайн (time.monotonic()) по контексту облачной функции; None, если он неизвестен"""
+    remaining_ms = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining_ms is None:
+        return None
+    return time.monotonic() + remaining_ms() / 1000 - DEADLINE_RESERVE_SECONDS
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Задаёт дедлайн для вызовов внутри блока"""
+    deadline_token = _deadline.set(deadline)
+    degraded_token = _degraded.set(set())
+    try:
+        yield
+    finally:
+        _degraded.reset(degraded_token)
+        _deadline.reset(deadline_token)
+
+
+def remaining():
+    """Секунд до дедлайна апдейта; None вне апдейта"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def timeout_for(cap, grace=0.0):
+    """Таймаут вызова: не больше cap и не позже дедлайна (плюс grace)"""
+    left = remaining()
+    if left is None:
+        return cap
+    left += grace
+    if left <= 0:
+        raise DeadlineExceeded("update deadline reached")
+    return min(cap, left)
+
+
+async def bounded(make_call, cap, grace=0.0):
+    """
+    Выполняет make_call() не дольше timeout_for(cap, grace). Если ограничил дедлайн,
+    а не cap, выбрасывается DeadlineExceeded (зависимость в этом не виновата).
+    """
+    timeout = timeout_for(cap, grace)
+    try:
+        return await asyncio.wait_for(make_call(), timeout)
+    except asyncio.TimeoutError:
+        if timeout < cap:
+            raise DeadlineExceeded(f"update deadline reached after {timeout:.2f}s") from None
+        raise
+
+
+def mark_degraded(dependency):
+    """Отмечает, что ответ апдейта собран без зависимости (такой ответ не кэшируется)"""
+    degraded = _degraded.get()
+    if degraded is not None:
+        degraded.add(dependency)
+    inc("degraded_responses_total", dependency)
+
+
+def is_degraded():
+    return bool(_degraded.get())
+
+
+class CircuitBreaker:
+    """Выключатель одной зависимости (состояние живёт в экземпляре функции)"""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        set_gauge("circuit_breaker_state", name, CLOSED)
+
+    def _set_state(self, state):
+        if state != self.state:
+            log = logger.warning if state == OPEN else logger.info
+            log("Circuit breaker %s: %s -> %s", self.name, _STATE_NAMES[self.state], _STATE_NAMES[state])
+            self.state = state
+        set_gauge("circuit_breaker_state", self.name, state)
+
+    def available(self):
+        """Можно ли сейчас обратиться к зависимости (без изменения состояния)"""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return not (self.state == HALF_OPEN and self._probe_in_flight)
+
+    def _before_call(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self._set_state(HALF_OPEN)
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probe_in_flight):
+            inc("circuit_breaker_rejected_total", self.name)
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        inc("dependency_failures_total", self.name)
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    @asynccontextmanager
+    async def guard(self):
+        """Оборачивает вызов зависимости: отказ размыкает выключатель, успех замыкает"""
+        self._before_call()
+        try:
+            yield
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        finally:
+            self._probe_in_flight = False
+        self.record_success()
+
+
+_breakers = {}
+
+
+def get_breaker(name):
+    """Возвращает (создаёт при необходимости) выключатель зависимости"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+class DeadlineMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: задаёт дедлайн обработки. Дедлайн передаётся
+    в feed_update(update_deadline=...); без него берётся UPDATE_BUDGET_SECONDS.
+    Апдейт, не уложившийся в дедлайн, подтверждается: повтор от Telegram упёрся бы в ту же зависимость.
+    Пользователь перед этим получает короткий ответ, а не вечные «часики» на кнопке.
+    """
+
+    async def __call__(self, handler, event, data):
+        deadline = data.get("update_deadline") or time.monotonic() + UPDATE_BUDGET_SECONDS
+        with deadline_scope(deadline):
+            try:
+                return await handler(event, data)
+            except (DeadlineExceeded, CircuitOpenError) as e:
+                inc("updates_dropped_total", type(e).__name__)
+                logger.warning("Update dropped: %s", e)
+                await self._answer_unavailable(event)
+
+    @staticmethod
+    async def _answer_unavailable(update):
+        """Отвечает на отброшенный апдейт (успевает за счёт запаса DEADLINE_RESERVE_SECONDS)"""
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(UNAVAILABLE_TEXT)
+            elif update.inline_query:
+                await update.inline_query.answer([], cache_time=5, is_personal=False)
+            elif update.message:
+                await update.message.answer(UNAVAILABLE_TEXT)
+        except Exception as e:
+            logger.warning("Could not answer dropped update: %s", e)
+
+
+class DeadlineRequestMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: внутри апдейта вызов Bot API ограничен дедлайном
+    плюс DEADLINE_RESERVE_SECONDS, чтобы успеть отправить деградированный ответ.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        if remaining() is None:
+            return await make_request(bot, method)
+        try:
+            return await bounded(
+                lambda: make_request(bot, method), bot.session.timeout, grace=DEADLINE_RESERVE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise TelegramNetworkError(method=method, message="Request timeout error") from None
@@ -0,0 +1,115 @@
+import re
+import json
+import zlib
+import logging
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+
+# Окончания для упрощённого стемминга русских слов (длинные проверяются первыми)
+_ENDINGS = sorted({
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "иях",
+    "ях", "ах", "ов", "ев", "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые",
+    "ие", "ия", "ию", "ью", "ья", "ом", "ем", "ам", "ям", "ую", "юю", "ть", "ся",
+    "ет", "ют", "ут", "ит", "ат", "ят",
+    "а", "я", "о", "е", "и", "ы", "у", "ю", "ь", "й",
+}, key=len, reverse=True)
+
+_STOPWORDS = {
+    "и", "в", "во", "на", "по", "с", "со", "к", "ко", "о", "об", "от", "до", "за",
+    "из", "у", "не", "но", "а", "что", "как", "для", "при", "под", "над", "без",
+}
+
+MIN_STEM_LENGTH = 3
+
+
+def stem(word: str) -> str:
+    """Отрезает одно типичное окончание, оставляя основу не короче MIN_STEM_LENGTH"""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Разбивает текст на нормализованные основы (регистр, ё→е, без HTML-тегов и стоп-слов)"""
+    text = _TAG_RE.sub(" ", text or "").lower().replace("ё", "е")
+    return [
+        stem(token) for token in _TOKEN_RE.findall(text)
+        if token not in _STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+class SearchIndex:
+    """Инвертированный индекс: основа слова -> отсортированные номера скважин в снимке"""
+
+    def __init__(self, wells, postings):
+        self.wells = tuple(wells)
+        self.postings = postings
+        self.terms = sorted(postings)
+
+    @classmethod
+    def build(cls, rows):
+        """Строит индекс по парам (номер скважины, описание)"""
+        rows = sorted(rows)
+        postings = {}
+        for idx, (_, description) in enumerate(rows):
+            for term in set(tokenize(description)):
+                postings.setdefault(term, array("H")).append(idx)
+        return cls([well for well, _ in rows], postings)
+
+    def _match_term(self, token):
+        """Номера скважин для основ, начинающихся с token"""
+        matched = set()
+        pos = bisect_left(self.terms, token)
+        while pos < len(self.terms) and self.terms[pos].startswith(token):
+            matched.update(self.postings[self.terms[pos]])
+            pos += 1
+        return matched
+
+    def search(self, query: str, limit: int = 30) -> list[str]:
+        """Возвращает скважины, в описании которых есть все слова запроса"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        result = None
+        for token in tokens:
+            matched = self._match_term(token)
+            result = matched if result is None else result & matched
+            if not result:
+                return []
+        return [self.wells[idx] for idx in sorted(result)[:limit]]
+
+    def dumps(self) -> bytes:
+        """Сериализует индекс: списки скважин дельта-кодируются, всё сжимается zlib"""
+        encoded = {}
+        for term, ids in self.postings.items():
+            previous = 0
+            deltas = []
+            for idx in ids:
+                deltas.append(idx - previous)
+                previous = idx
+            encoded[term] = deltas
+        payload = json.dumps({"w": self.wells, "t": encoded}, ensure_ascii=False, separators=(",", ":"))
+        return zlib.compress(payload.encode("utf-8"), 9)
+
+    @classmethod
+    def loads(cls, data: bytes):
+        """Восстанавливает индекс из dumps()"""
+        payload = json.loads(zlib.decompress(data).decode("utf-8"))
+        postings = {}
+        for term, deltas in payload["t"].items():
+            ids = array("H")
+            current = 0
+            for delta in deltas:
+                current += delta
+                ids.append(current)
+            postings[term] = ids
+        return cls(payload["w"], postings)
+
+    def __len__(self):
+        return len(self.wells)
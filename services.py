@@ -7,10 +7,17 @@ import ydb.iam
 import httpx
 import base64
 import re
+import bisect
 from dotenv import load_dotenv
 from utils import download_file
-from datetime import date
-from functools import lru_cache
+from datetime import date, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cache import get_cache, invalidate_wells, WELL_LIST_KEY
+from search_index import SearchIndex
+from metrics import timed
+from state_backend import create_state_backend
+from resilience import bounded, get_breaker, mark_degraded, timeout_for
 load_dotenv()
 
 
@@ -29,6 +36,27 @@ YDB_ENDPOINT = os.environ.get("YDB_ENDPOINT")
 YDB_DATABASE = os.environ.get("YDB_DATABASE")
 YDB_KEY_SA = os.environ.get("YDB_KEY_SA")
 
+# Потолки на один вызов YDB (внутри апдейта ещё и не позже его дедлайна), с
+YDB_TIMEOUT_SECONDS = float(os.environ.get("YDB_TIMEOUT_SECONDS", "5"))
+YDB_CONNECT_TIMEOUT_SECONDS = 10
+# Scan-запросы и создание таблиц
+YDB_LONG_TIMEOUT_SECONDS = 30
+
+ydb_breaker = get_breaker("ydb")
+# Отдельный выключатель для вспомогательных таблиц состояния (FSM, троттлинг):
+# их отказы не должны отключать чтение данных скважин, и наоборот
+ydb_state_breaker = get_breaker("ydb_state")
+
+# Потоки для блокирующих вызовов YDB. Поток, не уложившийся в таймаут, не прерывается
+# и занимает место до ответа YDB, поэтому пул ограничен: при зависшей YDB выключатель
+# размыкается раньше, чем потоки кончаются. Пул отдельный от пула event loop по умолчанию:
+# asyncio.run при завершении ждёт потоки своего пула, а эти — нет
+YDB_EXECUTOR_WORKERS = int(os.environ.get("YDB_EXECUTOR_WORKERS", "16"))
+_ydb_executor = ThreadPoolExecutor(max_workers=YDB_EXECUTOR_WORKERS, thread_name_prefix="ydb")
+
+# Сколько записей user_state переносить в fsm_state одной транзакцией
+USER_STATE_MIGRATION_BATCH = 100
+
 # Глобальные переменные
 _creds_dict = None
 _ydb_key_path = None
@@ -68,6 +96,21 @@ async def get_ydb_key_path():
 
     raise ValueError("YDB_SA_KEY_JSON or YDB_KEY_URL must be set in environment variables")
 
+async def run_ydb(name, func, *args, timeout=YDB_TIMEOUT_SECONDS, breaker=ydb_breaker):
+    """
+    Выполняет блокирующий вызов YDB в пуле потоков с замером задержки:
+    не дольше timeout и дедлайна апдейта, через выключатель breaker.
+    Поток по таймауту не прерывается, но апдейт его больше не ждёт.
+    """
+    loop = asyncio.get_event_loop()
+    async with breaker.guard():
+        async with timed("ydb", name):
+            return await bounded(lambda: loop.run_in_executor(_ydb_executor, func, *args), timeout)
+
+async def run_state_ydb(name, func, *args, timeout=YDB_TIMEOUT_SECONDS):
+    """run_ydb для таблиц состояния бота (FSM, троттлинг) — через ydb_state_breaker"""
+    return await run_ydb(name, func, *args, timeout=timeout, breaker=ydb_state_breaker)
+
 async def get_ydb_pool():
     """Инициализирует YDB драйвер и пул сессий"""
     global ydb_driver, ydb_pool
@@ -96,137 +139,39 @@ async def get_ydb_pool():
                 credentials=credentials
             )
             
-            # Асинхронное ожидание подключения
-            await asyncio.get_event_loop().run_in_executor(None, ydb_driver.wait, 10)
+            # Асинхронное ожидание подключения, но не дольше оставшегося времени апдейта
+            connect_timeout = timeout_for(YDB_CONNECT_TIMEOUT_SECONDS)
+            await run_ydb("connect", ydb_driver.wait, connect_timeout, timeout=connect_timeout + 1)
             
             # Создаем пул сессий
             ydb_pool = ydb.SessionPool(ydb_driver)
             
         except Exception as e:
-            logger.error(f"YDB initialization failed: {str(e)}", exc_info=True)
+            logger.error("YDB initialization failed: %s", e, exc_info=True)
             raise
     return ydb_pool
 
-@lru_cache(maxsize=32)
-async def get_well_list_ydb_cached(mode: str) -> tuple:
-    """Кэшированная версия получения списка скважин"""
-    today_str = date.today().strftime('%Y-%m-%d')
-    return await _get_well_list_ydb(mode, today_str)
+async def get_ydb_driver():
+    """Возвращает инициализированный YDB драйвер (нужен для BulkUpsert и scan-запросов)"""
+    await get_ydb_pool()
+    return ydb_driver
 
-async def set_user_state(user_id, mode):
-    """Reliable implementation for setting user state in YDB"""
-    try:
-        logger.info(f"Setting user {user_id} state to {mode}")
-        pool = await get_ydb_pool()
-        
-        def tx(session):
-            # Method 1: Using new YDB parameter binding syntax
-            try:
-                query = f"""
-                UPSERT INTO user_state (user_id, mode)
-                VALUES ({user_id}, "{mode}")
-                """
-                session.transaction().execute(
-                    query,
-                    commit_tx=True
-                )
-                return
-            except Exception as e:
-                logger.warning(f"Method 1 failed: {str(e)}")
-            
-            # Method 2: Using old-style parameter binding
-            try:
-                query = """
-                DECLARE $user_id AS Uint64;
-                DECLARE $mode AS Utf8;
-                
-                UPSERT INTO user_state (user_id, mode) 
-                VALUES ($user_id, $mode);
-                """
-                
-                # Old-style parameter binding
-                prepared_params = {
-                    '$user_id': user_id,
-                    '$mode': mode
-                }
-                
-                session.transaction().execute(
-                    query,
-                    parameters=prepared_params,
-                    commit_tx=True
-                )
-                return
-            except Exception as e:
-                logger.warning(f"Method 2 failed: {str(e)}")
-            
-            # Method 3: Using direct SQL with string formatting
-            query = f"""
-            UPSERT INTO user_state (user_id, mode)
-            VALUES ({user_id}, '{mode.replace("'", "''")}')
-            """
-            session.transaction().execute(
-                query,
-                commit_tx=True
-            )
-        
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-        logger.info("User state saved successfully")
-    except Exception as e:
-        logger.error(f"Error setting user state: {str(e)}")
-        raise
+_state_backend = None
 
-async def get_user_state(user_id):
-    """Получает состояние пользователя из YDB"""
-    try:
-        logger.info(f"Getting state for user {user_id}")
-        pool = await get_ydb_pool()
-        
-        def tx(session):
-            # Method 1: Try new parameter binding style first
-            try:
-                query = f"""
-                SELECT mode FROM user_state 
-                WHERE user_id = {user_id};
-                """
-                result = session.transaction().execute(
-                    query,
-                    commit_tx=True
-                )
-                if result[0].rows:
-                    return result[0].rows[0].mode
-                return None
-            except Exception as e:
-                logger.warning(f"Method 1 failed: {str(e)}")
-            
-            # Method 2: Fallback to old parameter binding
-            query = """
-            DECLARE $user_id AS Uint64;
-            
-            SELECT mode FROM user_state 
-            WHERE user_id = $user_id;
-            """
-            
-            prepared_params = {
-                '$user_id': user_id
-            }
-            
-            result = session.transaction().execute(
-                query,
-                parameters=prepared_params,
-                commit_tx=True
-            )
-            rows = result[0].rows
-            return rows[0].mode if rows else None
-        
-        loop = asyncio.get_event_loop()
-        state = await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-        logger.info(f"Retrieved user state: {state}")
-        return state
-    except Exception as e:
-        logger.error(f"Error getting user state: {str(e)}")
-        return None
+def get_state_backend():
+    """Возвращает хранилище состояния пользователей (выбирается через STATE_BACKEND)"""
+    global _state_backend
+    if _state_backend is None:
+        _state_backend = create_state_backend(
+            get_pool=get_ydb_pool, run=run_state_ydb, init_table=init_fsm_state_table
+        )
+        logger.info("User state backend: %s", _state_backend.name)
+    return _state_backend
 
+def set_state_backend(backend):
+    """Подменяет хранилище состояния (polling-режим, бенчмарки)"""
+    global _state_backend
+    _state_backend = backend
 
 def cleanup_temp_files():
     """Очищает временные файлы"""
@@ -234,37 +179,96 @@ def cleanup_temp_files():
     if _ydb_key_path and os.path.exists(_ydb_key_path):
         try:
             os.unlink(_ydb_key_path)
-            logger.info(f"Temporary YDB key file removed: {_ydb_key_path}")
+            logger.info("Temporary YDB key file removed: %s", _ydb_key_path)
         except Exception as e:
-            logger.error(f"Error removing temporary file: {str(e)}")
+            logger.error("Error removing temporary file: %s", e)
 
-async def init_user_state_table():
-    """Создает таблицу user_state если она не существует"""
-    try:
-        logger.info("Initializing user_state table...")
-        pool = await get_ydb_pool()
-        
-        def tx(session):
-            session.transaction().execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_state (
-                    user_id Uint64,
-                    mode Utf8,
-                    PRIMARY KEY (user_id)
-                )
-                """,
-                commit_tx=True
+async def init_fsm_state_table():
+    """Создает таблицу fsm_state (записи FSM aiogram) если она не существует"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                storage_key Utf8,
+                state Utf8,
+                data Utf8,
+                PRIMARY KEY (storage_key)
             )
-        
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-        logger.info("user_state table initialized successfully")
-    except Exception as e:
-        if "already exists" in str(e).lower():
-            logger.info("user_state table already exists")
-        else:
-            logger.error(f"Error creating user_state table: {str(e)}")
-            raise
+            """
+        )
+
+    await run_ydb("init_fsm_state_table", pool.retry_operation_sync, tx, timeout=YDB_LONG_TIMEOUT_SECONDS)
+    logger.info("fsm_state table initialized successfully")
+
+async def migrate_user_state():
+    """
+    Переносит режим и id последнего сообщения из таблицы user_state (хранилище до FSM)
+    в записи fsm_state личных чатов (ключ fsm:<user_id>:<user_id>). Уже существующие
+    записи fsm_state не трогаются, поэтому повторный запуск безопасен.
+    Возвращает число перенесённых записей.
+    """
+    backend = get_state_backend()
+    if backend.name != "ydb":
+        # SQLite переносит записи при открытии файла, в памяти переносить нечего
+        return 0
+    driver = await get_ydb_driver()
+
+    def scan():
+        legacy, existing = {}, set()
+        for part in driver.table_client.scan_query(ydb.ScanQuery("SELECT user_id, mode, message_id FROM user_state;", {})):
+            for row in part.result_set.rows:
+                legacy[row.user_id] = {"mode": row.mode, "message_id": row.message_id}
+        for part in driver.table_client.scan_query(ydb.ScanQuery("SELECT storage_key FROM fsm_state;", {})):
+            existing.update(row.storage_key for row in part.result_set.rows)
+        return legacy, existing
+
+    try:
+        legacy, existing = await run_ydb("scan_user_state", scan, timeout=YDB_LONG_TIMEOUT_SECONDS)
+    except ydb.SchemeError:
+        logger.debug("user_state table not found, nothing to migrate")
+        return 0
+
+    records = {}
+    for user_id, fields in legacy.items():
+        key = f"fsm:{user_id}:{user_id}"
+        if key not in existing:
+            records[key] = (None, {k: v for k, v in fields.items() if v is not None})
+    items = list(records.items())
+    for i in range(0, len(items), USER_STATE_MIGRATION_BATCH):
+        await backend.set_fsm_many(dict(items[i:i + USER_STATE_MIGRATION_BATCH]))
+    if records:
+        logger.info("Migrated %d user_state rows to fsm_state", len(records))
+    return len(records)
+
+# Как часто (в секундах) сверять локальные кэши с версией данных в YDB
+DATA_VERSION_CHECK_INTERVAL = float(os.environ.get("DATA_VERSION_CHECK_INTERVAL", "30"))
+
+well_list_cache = get_cache("well_list", maxsize=8)
+description_cache = get_cache("description")
+# Номер скважины -> (дата, описание): запасной ответ, когда YDB недоступна.
+# Ключи без даты, поэтому invalidate_wells их не сбрасывает
+last_known_descriptions = get_cache("description_last_known", maxsize=512)
+# (дата, скважина) -> дата ближайшей более ранней записи ("" если записей нет)
+history_cache = get_cache("history", maxsize=512)
+
+_EPOCH = date(1970, 1, 1)
+
+# date_str -> (версия данных, SearchIndex)
+_search_indexes = {}
+
+# Индекс для поиска скважин по префиксу номера: (снимок, номера в нижнем регистре, номера)
+_prefix_index = (None, [], [])
+
+# Если в кэше не хватает больше стольких описаний, день читается целиком одним scan-запросом
+DESCRIPTION_SCAN_THRESHOLD = 4
+
+# date_str -> (известная версия данных, время последней проверки)
+_data_versions = {}
+
+# Ответ для скважины без строки за дату. Не кэшируется: строка может появиться со следующей загрузкой
+WELL_NOT_FOUND_TEXT = "Скважина не найдена"
 
 async def _get_well_list_ydb(mode: str, date_str: str) -> tuple:
     """Внутренняя функция для получения списка скважин"""
@@ -277,17 +281,10 @@ async def _get_well_list_ydb(mode: str, date_str: str) -> tuple:
         result = session.transaction().execute(query, commit_tx=True)
         return tuple(row.well_number for row in result[0].rows)
     
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-
-@lru_cache(maxsize=32)
-async def get_well_description_ydb_cached(well_number: str) -> str:
-    """Кэшированная версия получения описания скважины"""
-    today_str = date.today().strftime('%Y-%m-%d')
-    return await _get_well_description_ydb(well_number, today_str)
+    return await run_ydb("get_well_list_ydb", pool.retry_operation_sync, tx)
 
-async def _get_well_description_ydb(well_number: str, date_str: str) -> str:
-    """Внутренняя функция для получения описания скважины"""
+async def _get_well_description_ydb(well_number: str, date_str: str):
+    """Внутренняя функция для получения описания скважины (None, если строки за дату нет)"""
     pool = await get_ydb_pool()
     safe_well_number = str(well_number).replace("'", "''")
     query = f"""
@@ -298,53 +295,405 @@ async def _get_well_description_ydb(well_number: str, date_str: str) -> str:
     def tx(session):
         result = session.transaction().execute(query, commit_tx=True)
         rows = result[0].rows
-        return rows[0].description if rows else "Скважина не найдена"
+        return rows[0].description if rows else None
     
-    loop = asyncio.get_event_loop()
-    description = await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-    return format_description(description)
+    description = await run_ydb("get_well_description_ydb", pool.retry_operation_sync, tx)
+    return None if description is None else format_description(description)
 
-async def get_well_list_ydb(mode):
-    """
-    Получает список скважин из таблицы wells в YDB только за текущие сутки.
-    """
+async def get_data_version(date_str: str):
+    """Возвращает версию данных wells за дату (None, если загрузок не было)"""
     pool = await get_ydb_pool()
-    today_str = date.today().strftime('%Y-%m-%d')
 
     def tx(session):
-        query = f"""
-        SELECT well_number FROM wells WHERE date = DATE('{today_str}')
+        query = """
+        DECLARE $date AS Date;
+        SELECT version FROM wells_versions WHERE date = $date;
         """
-        result = session.transaction().execute(query, commit_tx=True)
-        return [row.well_number for row in result[0].rows]
+        result = session.transaction().execute(
+            session.prepare(query),
+            {"$date": date.fromisoformat(date_str)},
+            commit_tx=True
+        )
+        rows = result[0].rows
+        return rows[0].version if rows else None
 
-    loop = asyncio.get_event_loop()
-    wells = await loop.run_in_executor(None, pool.retry_operation_sync, tx)
+    return await run_ydb("get_data_version", pool.retry_operation_sync, tx)
+
+async def is_ingest_complete(date_str: str) -> bool:
+    """Загружен ли за дату отчёт целиком (все листы; отметку ставит ingest.run_ingestion)"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        query = """
+        DECLARE $date AS Date;
+        SELECT completed_at FROM wells_ingested WHERE date = $date;
+        """
+        result = session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {"$date": date.fromisoformat(date_str)},
+            commit_tx=True
+        )
+        return bool(result[0].rows)
+
+    return await run_ydb("is_ingest_complete", pool.retry_operation_sync, tx)
+
+async def get_changed_wells(date_str: str, since_version: int) -> set:
+    """Возвращает номера скважин, изменившихся за дату после версии since_version"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        query = """
+        DECLARE $date AS Date;
+        DECLARE $since AS Uint64;
+        SELECT DISTINCT well_number FROM wells_changes
+        WHERE date = $date AND version > $since;
+        """
+        result = session.transaction().execute(
+            session.prepare(query),
+            {"$date": date.fromisoformat(date_str), "$since": since_version},
+            commit_tx=True
+        )
+        return {row.well_number for row in result[0].rows}
+
+    return await run_ydb("get_changed_wells", pool.retry_operation_sync, tx)
+
+async def sync_data_version(date_str: str):
+    """
+    Сверяет локальные кэши с версией данных за дату (не чаще DATA_VERSION_CHECK_INTERVAL).
+    При появлении новой версии сбрасывает только изменившиеся скважины.
+    """
+    checked = date_str in _data_versions
+    known_version, checked_at = _data_versions.get(date_str, (None, 0.0))
+    now = time.monotonic()
+    if now - checked_at < DATA_VERSION_CHECK_INTERVAL:
+        return known_version
+
+    try:
+        version = await get_data_version(date_str)
+        if version is not None and checked and version > (known_version or 0):
+            # Дата уже проверялась; версия None значит «загрузок ещё не было» — как версия 0
+            changed = await get_changed_wells(date_str, known_version or 0)
+            invalidate_wells(date_str, changed)
+        elif version != known_version:
+            # Версия неизвестна локально (холодный старт) — чужих данных в кэше нет,
+            # но список скважин мог быть закэширован до первой загрузки
+            invalidate_wells(date_str, [])
+        _data_versions[date_str] = (version, now)
+        return version
+    except Exception as e:
+        logger.warning("Data version check failed for %s: %s", date_str, e)
+        _data_versions[date_str] = (known_version, now)
+        return known_version
+
+def note_data_version(date_str: str, version: int):
+    """Запоминает версию, записанную этим же процессом (чтобы не перечитывать изменения)"""
+    _data_versions[date_str] = (version, time.monotonic())
+
+async def get_well_snapshot(date_str: str) -> tuple:
+    """
+    Отсортированный список скважин за дату. Кэшируется до изменения данных за дату;
+    на позиции в нём ссылаются кнопки скважин (см. callbacks).
+    """
+    await sync_data_version(date_str)
+
+    key = (date_str, WELL_LIST_KEY)
+    wells = well_list_cache.get(key)
+    if wells is None:
+        wells = tuple(sorted(await _get_well_list_ydb(None, date_str)))
+        well_list_cache.set(key, wells)
     return wells
 
 
+async def get_well_list_ydb(mode):
+    """
+    Получает список скважин из таблицы wells в YDB только за текущие сутки.
+    Результат кэшируется до изменения данных за дату.
+    """
+    return list(await get_well_snapshot(date.today().strftime('%Y-%m-%d')))
+
+
+def _remember_description(date_str: str, well_number: str, formatted: str):
+    # Заглушку не запоминаем: иначе при недоступной YDB она вернётся как «последнее известное»
+    if formatted == WELL_NOT_FOUND_TEXT:
+        return
+    description_cache.set((date_str, well_number), formatted)
+    last_known_descriptions.set(well_number, (date_str, formatted))
+
 async def get_well_description_ydb(well_number):
     """
     Получает описание скважины из YDB только за текущие сутки.
+    Результат кэшируется до изменения этой скважины. Если YDB недоступна,
+    возвращается последнее известное описание с пометкой (ответ считается деградированным).
+    """
+    today_str = date.today().strftime('%Y-%m-%d')
+    await sync_data_version(today_str)
+
+    key = (today_str, str(well_number))
+    formatted = description_cache.get(key)
+    if formatted is None:
+        try:
+            formatted = await _get_well_description_ydb(well_number, today_str)
+            if formatted is None:
+                return WELL_NOT_FOUND_TEXT
+        except Exception as e:
+            last_known = last_known_descriptions.get(str(well_number))
+            if last_known is None:
+                raise
+            logger.warning("Serving last known description of %s: %r", well_number, e)
+            mark_degraded("ydb")
+            known_date, known_text = last_known
+            return (
+                f"⚠️ <i>База данных недоступна, показано последнее известное описание "
+                f"({date.fromisoformat(known_date).strftime('%d.%m.%Y')})</i>\n\n{known_text}"
+            )
+        _remember_description(today_str, str(well_number), formatted)
+    return formatted
+
+async def get_well_descriptions(well_numbers) -> dict:
+    """
+    Описания нескольких скважин за текущие сутки: {номер: описание}.
+    Недостающие в кэше читаются параллельно, а если их много — одним scan-запросом за день.
     """
-    pool = await get_ydb_pool()
     today_str = date.today().strftime('%Y-%m-%d')
+    await sync_data_version(today_str)
+
+    result, missing = {}, []
+    for well in well_numbers:
+        formatted = description_cache.get((today_str, str(well)))
+        if formatted is None:
+            missing.append(str(well))
+        else:
+            result[well] = formatted
+
+    if len(missing) > DESCRIPTION_SCAN_THRESHOLD:
+        # Результат собирается из строк scan-запроса: кэш ограничен по размеру
+        # и может вытеснить часть описаний раньше, чем они будут прочитаны
+        scanned = {}
+        for well, description in await _scan_wells_for_date(today_str):
+            scanned[well] = format_description(description)
+            _remember_description(today_str, well, scanned[well])
+        for well in missing:
+            result[well] = scanned.get(well, WELL_NOT_FOUND_TEXT)
+    elif missing:
+        fetched = await asyncio.gather(*(_get_well_description_ydb(w, today_str) for w in missing))
+        for well, formatted in zip(missing, fetched):
+            if formatted is None:
+                result[well] = WELL_NOT_FOUND_TEXT
+                continue
+            _remember_description(today_str, well, formatted)
+            result[well] = formatted
+    return result
+
+async def find_wells_by_prefix(prefix: str, offset: int = 0, limit: int = 20):
+    """
+    Скважины за текущие сутки, номер которых начинается с prefix (без учёта регистра).
+    Бинарный поиск по отсортированному индексу в памяти; возвращает (скважины, есть ли ещё).
+    """
+    global _prefix_index
+    snapshot = await get_well_snapshot(date.today().strftime('%Y-%m-%d'))
+    if _prefix_index[0] is not snapshot:
+        pairs = sorted((well.lower(), well) for well in snapshot)
+        _prefix_index = (snapshot, [k for k, _ in pairs], [w for _, w in pairs])
+    _, keys, wells = _prefix_index
+
+    prefix = prefix.strip().lower()
+    lo = bisect.bisect_left(keys, prefix)
+    hi = bisect.bisect_right(keys, prefix + "\U0010ffff") if prefix else len(keys)
+    start = lo + offset
+    end = min(hi, start + limit)
+    return wells[start:end], end < hi
+
+async def _get_well_history_ydb(well_number: str, before_date_str: str, limit: int) -> list:
+    """
+    Диапазонное чтение по первичному ключу (well_number, date): до limit записей
+    строго раньше before_date_str, от новых к старым. Возвращает [(дата, описание)].
+    """
+    pool = await get_ydb_pool()
 
     def tx(session):
-        # Экранируем кавычки в номере скважины на всякий случай
-        safe_well_number = str(well_number).replace("'", "''")
-        query = f"""
-        SELECT description FROM wells
-        WHERE well_number = '{safe_well_number}' AND date = DATE('{today_str}')
+        query = """
+        DECLARE $well AS Utf8;
+        DECLARE $before AS Date;
+        DECLARE $limit AS Uint64;
+        SELECT date, description FROM wells
+        WHERE well_number = $well AND date < $before
+        ORDER BY date DESC
+        LIMIT $limit;
         """
-        result = session.transaction().execute(query, commit_tx=True)
+        result = session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {
+                "$well": str(well_number),
+                "$before": date.fromisoformat(before_date_str),
+                "$limit": limit,
+            },
+            commit_tx=True
+        )
+        return [
+            ((_EPOCH + timedelta(days=row.date)).isoformat(), row.description or "")
+            for row in result[0].rows
+        ]
+
+    rows = await run_ydb("get_well_history_ydb", pool.retry_operation_sync, tx)
+    return [(date_str, format_description(description)) for date_str, description in rows]
+
+def _remember_history(well_number: str, before_date_str: str, rows: list, limit: int):
+    """Складывает прочитанные страницы истории в кэши"""
+    previous = before_date_str
+    for date_str, description in rows:
+        history_cache.set((previous, well_number), date_str)
+        description_cache.set((date_str, well_number), description)
+        previous = date_str
+    if len(rows) < limit:
+        # Дальше в прошлое записей нет
+        history_cache.set((previous, well_number), "")
+
+async def get_well_history_page(well_number, before_date_str=None):
+    """
+    Возвращает страницу истории скважины — ближайший день раньше before_date_str
+    (по умолчанию раньше сегодняшнего) — как (дата, описание) или None.
+    Если страницы нет в кэше, она читается вместе со следующей.
+    """
+    well_number = str(well_number)
+    before_date_str = before_date_str or date.today().isoformat()
+
+    page_date = history_cache.get((before_date_str, well_number))
+    if page_date is not None:
+        if not page_date:
+            return None
+        description = description_cache.get((page_date, well_number))
+        if description is not None:
+            return page_date, description
+
+    rows = await _get_well_history_ydb(well_number, before_date_str, 2)
+    _remember_history(well_number, before_date_str, rows, 2)
+    return rows[0] if rows else None
+
+async def prefetch_well_history(well_number, page_date_str):
+    """Подгружает в кэш страницу, следующую за page_date_str (вызывается после отправки ответа)"""
+    well_number = str(well_number)
+    next_date = history_cache.get((page_date_str, well_number))
+    if next_date is not None and (not next_date or description_cache.get((next_date, well_number)) is not None):
+        return
+    try:
+        rows = await _get_well_history_ydb(well_number, page_date_str, 1)
+        _remember_history(well_number, page_date_str, rows, 1)
+    except Exception as e:
+        logger.warning("History prefetch failed for %s: %s", well_number, e)
+
+async def _scan_wells_for_date(date_str: str) -> list:
+    """Читает все описания за дату scan-запросом (без лимита в 1000 строк)"""
+    driver = await get_ydb_driver()
+    query = ydb.ScanQuery(
+        """
+        DECLARE $date AS Date;
+        SELECT well_number, description FROM wells WHERE date = $date;
+        """,
+        {"$date": ydb.PrimitiveType.Date}
+    )
+
+    def scan():
+        rows = []
+        for part in driver.table_client.scan_query(query, {"$date": date.fromisoformat(date_str)}):
+            rows.extend((row.well_number, row.description or "") for row in part.result_set.rows)
+        return rows
+
+    return await run_ydb("scan_wells_for_date", scan, timeout=YDB_LONG_TIMEOUT_SECONDS)
+
+async def get_day_descriptions(date_str: str) -> dict:
+    """Все описания за дату: {скважина: описание} (для рассылки дайджестов)"""
+    return dict(await _scan_wells_for_date(date_str))
+
+async def _load_search_index_ydb(date_str: str, version: int):
+    """Читает сохранённый индекс за дату, если он построен для этой версии данных"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        query = """
+        DECLARE $date AS Date;
+        SELECT version, payload FROM wells_search WHERE date = $date;
+        """
+        result = session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {"$date": date.fromisoformat(date_str)},
+            commit_tx=True
+        )
         rows = result[0].rows
-        return rows[0].description if rows else "Скважина не найдена"
+        if rows and rows[0].version == version:
+            return rows[0].payload
+        return None
 
-    loop = asyncio.get_event_loop()
-    description = await loop.run_in_executor(None, pool.retry_operation_sync, tx)
-    formatted = format_description(description)
-    return formatted
+    payload = await run_ydb("load_search_index_ydb", pool.retry_operation_sync, tx)
+    return SearchIndex.loads(payload) if payload else None
+
+async def save_search_index(date_str: str, version: int, index: SearchIndex):
+    """Сохраняет индекс за дату в wells_search"""
+    pool = await get_ydb_pool()
+    payload = index.dumps()
+
+    def tx(session):
+        query = """
+        DECLARE $date AS Date;
+        DECLARE $version AS Uint64;
+        DECLARE $payload AS String;
+        UPSERT INTO wells_search (date, version, payload)
+        VALUES ($date, $version, $payload);
+        """
+        session.transaction().execute(
+            session.prepare(query),
+            {"$date": date.fromisoformat(date_str), "$version": version, "$payload": payload},
+            commit_tx=True
+        )
+
+    await run_ydb("save_search_index", pool.retry_operation_sync, tx)
+    logger.info("Search index for %s v%s saved: %s wells, %s bytes", date_str, version, len(index), len(payload))
+
+async def rebuild_search_index(date_str: str, version: int) -> SearchIndex:
+    """Строит индекс по всем описаниям за дату и сохраняет его"""
+    index = SearchIndex.build(await _scan_wells_for_date(date_str))
+    _search_indexes[date_str] = (version, index)
+    await save_search_index(date_str, version, index)
+    return index
+
+async def get_search_index(date_str: str) -> SearchIndex:
+    """
+    Возвращает поисковый индекс за дату для текущей версии данных:
+    из памяти, из wells_search или (один раз на версию) строит его заново.
+    За даты без версии индекс строится по строкам wells один раз на процесс.
+    """
+    version = await sync_data_version(date_str)
+    cached = _search_indexes.get(date_str)
+    if cached and cached[0] == version:
+        return cached[1]
+    if not version:
+        # Версии нет: строки загружены до появления ingest (или за дату данных нет).
+        # Индекс строится один раз на процесс и хранится только в памяти
+        index = SearchIndex.build(await _scan_wells_for_date(date_str))
+        _search_indexes[date_str] = (version, index)
+        return index
+
+    index = await _load_search_index_ydb(date_str, version)
+    if index is None:
+        logger.info("Search index for %s v%s not found, building", date_str, version)
+        index = SearchIndex.build(await _scan_wells_for_date(date_str))
+        try:
+            await save_search_index(date_str, version, index)
+        except Exception as e:
+            logger.warning("Error saving search index: %s", e)
+    _search_indexes[date_str] = (version, index)
+    return index
+
+async def search_wells(query: str, days: int = 1, limit: int = 30) -> list:
+    """Ищет скважины по описаниям за последние days дней. Возвращает [(дата, скважина)]"""
+    results = []
+    today = date.today()
+    for offset in range(max(days, 1)):
+        date_str = (today - timedelta(days=offset)).isoformat()
+        index = await get_search_index(date_str)
+        results.extend((date_str, well) for well in index.search(query, limit - len(results)))
+        if len(results) >= limit:
+            break
+    return results
 
 def format_description(text: str) -> str:
     text = re.sub(r'(Работы за прошлые сутки[^\n\r:]*:)', r' <b>\1</b>', text)
@@ -0,0 +1,213 @@
+"""
+Хранилища записей FSM aiogram (состояние и данные по ключу хранилища; в данных —
+режим и id последнего сообщения со скважиной):
+- ydb — таблица fsm_state в YDB (облачная функция, несколько экземпляров);
+- sqlite — локальный файл SQLite в режиме WAL (polling на своём сервере);
+- memory — словарь в памяти процесса (отладка, бенчмарки).
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+import ydb
+from metrics import observe
+
+logger = logging.getLogger(__name__)
+
+# Выбор хранилища: ydb | sqlite | memory (читается при первом обращении)
+DEFAULT_BACKEND = "ydb"
+DEFAULT_SQLITE_PATH = "bot_state.sqlite3"
+
+
+class StateBackend(ABC):
+    """
+    Интерфейс хранилища записей FSM.
+    Хранилище без какого-либо из методов не создаётся (TypeError при создании).
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def get_fsm(self, key: str):
+        """Возвращает запись FSM: (состояние, данные); (None, {}) если записи нет"""
+
+    @abstractmethod
+    async def set_fsm_many(self, records: dict):
+        """Записывает несколько записей FSM {ключ: (состояние, данные)} одной транзакцией"""
+
+    async def close(self):
+        pass
+
+
+def _dump_data(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _load_data(text):
+    return json.loads(text) if text else {}
+
+
+class MemoryStateBackend(StateBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._fsm = {}
+        self._lock = threading.Lock()
+
+    async def get_fsm(self, key):
+        with self._lock:
+            state, data = self._fsm.get(key, (None, None))
+        return state, _load_data(data)
+
+    async def set_fsm_many(self, records):
+        # Данные хранятся сериализованными, как в настоящих хранилищах
+        with self._lock:
+            for key, (state, data) in records.items():
+                self._fsm[key] = (state, _dump_data(data))
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    SQLite в режиме WAL: чтение и запись занимают микросекунды, поэтому
+    выполняются прямо в event loop без пула потоков.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm_state ("
+            "storage_key TEXT PRIMARY KEY, state TEXT, data TEXT)"
+        )
+        self._migrate_user_state()
+        logger.info("SQLite state storage opened: %s", path)
+
+    def _migrate_user_state(self):
+        """
+        Переносит строки таблицы user_state (хранилище до FSM) в записи fsm_state
+        личных чатов; уже существующие записи не трогаются
+        """
+        legacy = self._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'user_state'"
+        ).fetchone()
+        if legacy is None:
+            return
+        rows = self._conn.execute("SELECT user_id, mode, message_id FROM user_state").fetchall()
+        records = [
+            (f"fsm:{user_id}:{user_id}", None,
+             _dump_data({k: v for k, v in (("mode", mode), ("message_id", message_id)) if v is not None}))
+            for user_id, mode, message_id in rows
+        ]
+        cursor = self._conn.executemany(
+            "INSERT OR IGNORE INTO fsm_state (storage_key, state, data) VALUES (?, ?, ?)", records
+        )
+        if cursor.rowcount > 0:
+            logger.info("Migrated %d user_state rows to fsm_state", cursor.rowcount)
+
+    async def get_fsm(self, key):
+        started = time.perf_counter()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, data FROM fsm_state WHERE storage_key = ?", (key,)
+            ).fetchone()
+        observe("state", "sqlite.get_fsm", (time.perf_counter() - started) * 1000)
+        if row is None:
+            return None, {}
+        return row[0], _load_data(row[1])
+
+    async def set_fsm_many(self, records):
+        started = time.perf_counter()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO fsm_state (storage_key, state, data) VALUES (?, ?, ?)",
+                    [(key, state, _dump_data(data)) for key, (state, data) in records.items()]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        observe("state", "sqlite.set_fsm_many", (time.perf_counter() - started) * 1000)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class YdbStateBackend(StateBackend):
+    """
+    Таблица fsm_state в YDB; пул, исполнитель и создание таблицы передаются из services.
+    Если таблицы нет (бот развёрнут без ingest --init), она создаётся при первом обращении.
+    """
+
+    name = "ydb"
+
+    def __init__(self, get_pool, run, init_table=None):
+        self._get_pool = get_pool
+        self._run = run
+        self._init_table = init_table
+
+    async def _execute(self, name, tx):
+        pool = await self._get_pool()
+        try:
+            return await self._run(name, pool.retry_operation_sync, tx)
+        except ydb.SchemeError:
+            if self._init_table is None:
+                raise
+            logger.warning("fsm_state table not found, creating it")
+            await self._init_table()
+            return await self._run(name, pool.retry_operation_sync, tx)
+
+    async def get_fsm(self, key):
+        query = """
+        DECLARE $key AS Utf8;
+        SELECT state, data FROM fsm_state WHERE storage_key = $key;
+        """
+
+        def tx(session):
+            result = session.transaction(ydb.OnlineReadOnly()).execute(
+                session.prepare(query), {"$key": key}, commit_tx=True
+            )
+            rows = result[0].rows
+            return (rows[0].state, rows[0].data) if rows else (None, None)
+
+        state, data = await self._execute("get_fsm", tx)
+        return state, _load_data(data)
+
+    async def set_fsm_many(self, records):
+        declares, upserts, params = [], [], {}
+        for idx, (key, (state, data)) in enumerate(records.items()):
+            declares.append(f"DECLARE $key{idx} AS Utf8; DECLARE $state{idx} AS Utf8?; DECLARE $data{idx} AS Utf8;")
+            upserts.append(
+                f"UPSERT INTO fsm_state (storage_key, state, data) VALUES ($key{idx}, $state{idx}, $data{idx});"
+            )
+            params.update({f"$key{idx}": key, f"$state{idx}": state, f"$data{idx}": _dump_data(data)})
+        query = "\n".join(declares + upserts)
+
+        def tx(session):
+            session.transaction(ydb.SerializableReadWrite()).execute(
+                session.prepare(query), params, commit_tx=True
+            )
+
+        await self._execute("set_fsm_many", tx)
+
+
+def create_state_backend(kind=None, get_pool=None, run=None, init_table=None):
+    """Создаёт хранилище по имени (по умолчанию — из STATE_BACKEND)"""
+    kind = kind or os.environ.get("STATE_BACKEND", DEFAULT_BACKEND)
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SqliteStateBackend(os.environ.get("STATE_SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    if kind == "ydb":
+        return YdbStateBackend(get_pool, run, init_table)
+    raise ValueError(f"Unknown STATE_BACKEND: {kind}")
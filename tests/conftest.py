@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_ydb(monkeypatch):
+    """FakeYdb вместо YDB и чистое состояние модулей: кэши, версии данных, выключатели"""
+    import cache
+    import services
+    import resilience
+    from benchmarks.fakes import FakeYdb, install_fake_ydb
+
+    db = FakeYdb()
+    monkeypatch.setattr(services, "ydb_driver", None)
+    monkeypatch.setattr(services, "ydb_pool", None)
+    monkeypatch.setattr(services, "_data_versions", {})
+    monkeypatch.setattr(services, "_search_indexes", {})
+    monkeypatch.setattr(services, "_prefix_index", (None, [], []))
+    monkeypatch.setattr(services, "YDB_DATABASE", "/local")
+    for breaker in resilience._breakers.values():
+        monkeypatch.setattr(breaker, "state", resilience.CLOSED)
+        monkeypatch.setattr(breaker, "failures", 0)
+    install_fake_ydb(db)
+    cache.clear_all()
+    yield db
+    cache.clear_all()
@@ -0,0 +1,94 @@
+"""Рассылка дайджеста: ожидание загрузки, курсор и продолжение после flood control"""
+import asyncio
+from datetime import date
+from types import SimpleNamespace
+import pytest
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+import broadcast
+
+TODAY = date.today()
+DAYS = (TODAY - date(1970, 1, 1)).days
+
+
+class FakeBot:
+    """send_message с ответами по chat_id: исключение или успешная отправка"""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        error = self.errors.get(chat_id)
+        if error is not None:
+            raise error
+        self.sent.append(chat_id)
+
+
+def _flood():
+    return TelegramRetryAfter(method=SimpleNamespace(), message="Too Many Requests", retry_after=0)
+
+
+@pytest.fixture
+def db(fake_ydb, monkeypatch):
+    monkeypatch.setattr(broadcast, "BROADCAST_PAGE_SIZE", 3)
+    monkeypatch.setattr(broadcast, "BROADCAST_RATE", 1000)
+    fake_ydb.load_wells([("101", "Бурение"), ("102", "Промывка")], TODAY)
+    for user_id in range(1, 8):
+        fake_ydb.upsert_row("subscriptions", {"user_id": user_id, "chat_id": user_id, "wells": ""})
+    return fake_ydb
+
+
+def _mark_ingested(db):
+    db.upsert_row("wells_ingested", {"date": DAYS, "wells": 2})
+
+
+def _run(bot):
+    return asyncio.run(broadcast.run_broadcast(bot))
+
+
+def test_waits_until_report_is_fully_ingested(db):
+    bot = FakeBot()
+    assert _run(bot) == {"status": "waiting"}
+    assert bot.sent == []
+
+
+def test_sends_everyone_once(db):
+    _mark_ingested(db)
+    bot = FakeBot()
+    result = _run(bot)
+    assert (result["status"], result["sent"], result["last_user_id"]) == ("done", 7, 7)
+    assert sorted(bot.sent) == list(range(1, 8))
+    assert _run(FakeBot())["status"] == "done"
+
+
+def test_flood_control_keeps_cursor_on_postponed_recipient(db, monkeypatch):
+    _mark_ingested(db)
+    # Одна отправка за раз: после отказа следующие подписчики не начинаются
+    monkeypatch.setattr(broadcast, "BROADCAST_CONCURRENCY", 1)
+    bot = FakeBot({5: _flood()})
+
+    result = _run(bot)
+    assert (result["status"], result["last_user_id"], result["sent"]) == ("partial", 4, 4)
+    assert bot.sent == [1, 2, 3, 4]
+    assert db.tables["broadcast_cursor"][(DAYS,)]["last_user_id"] == 4
+
+    bot = FakeBot()
+    result = _run(bot)
+    assert (result["status"], result["last_user_id"], result["sent"]) == ("done", 7, 7)
+    assert bot.sent == [5, 6, 7]
+
+
+def test_blocked_user_is_unsubscribed(db):
+    _mark_ingested(db)
+    blocked = TelegramForbiddenError(method=SimpleNamespace(), message="bot was blocked by the user")
+    result = _run(FakeBot({3: blocked}))
+    assert (result["status"], result["sent"], result["failed"]) == ("done", 6, 1)
+    assert (3,) not in db.tables["subscriptions"]
+
+
+def test_digest_is_rendered_once_per_wells_selection():
+    renderer = broadcast.DigestRenderer(TODAY.isoformat(), {"101": "Бурение", "102": "Промывка"})
+    assert renderer.render(()) is renderer.render(())
+    text, markup = renderer.render(("102", "999"))[-1]
+    assert "скважин: 1" in text and "102" in text and "101" not in text
+    assert len(markup.inline_keyboard[0]) == 1
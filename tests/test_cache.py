@@ -0,0 +1,36 @@
+"""KeyedCache: вытеснение и точечная инвалидация по (дата, скважина)"""
+import cache
+
+
+def test_lru_eviction():
+    c = cache.KeyedCache("test_lru", maxsize=2)
+    c.set(("d", "1"), 1)
+    c.set(("d", "2"), 2)
+    c.get(("d", "1"))
+    c.set(("d", "3"), 3)
+    assert c.get(("d", "2")) is None
+    assert c.get(("d", "1")) == 1
+    assert c.get(("d", "3")) == 3
+
+
+def test_invalidate_wells_touches_only_changed_wells_of_the_date():
+    first = cache.get_cache("test_invalidate_first")
+    second = cache.get_cache("test_invalidate_second")
+    first.set(("2024-05-17", "101"), "a")
+    first.set(("2024-05-17", "102"), "b")
+    first.set(("2024-05-16", "101"), "old")
+    second.set(("2024-05-17", "101"), "c")
+    second.set(("2024-05-17", cache.WELL_LIST_KEY), ("101", "102"))
+
+    cache.invalidate_wells("2024-05-17", ["101"])
+
+    assert first.get(("2024-05-17", "101")) is None
+    assert second.get(("2024-05-17", "101")) is None
+    assert first.get(("2024-05-17", "102")) == "b"
+    assert first.get(("2024-05-16", "101")) == "old"
+    # Список скважин за дату сбрасывается при любом изменении
+    assert second.get(("2024-05-17", cache.WELL_LIST_KEY)) is None
+
+
+def test_get_cache_returns_the_same_instance():
+    assert cache.get_cache("test_same") is cache.get_cache("test_same")
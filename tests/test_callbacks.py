@@ -0,0 +1,57 @@
+"""Кодек callback_data: упаковка, разбор и ограничение Telegram в 64 байта"""
+import pytest
+import callbacks as cbd
+
+DAY = "2024-05-17"
+SNAPSHOT = ("101", "102", "205-бис", "7")
+
+
+def test_well_data_round_trip_by_snapshot_index():
+    ref = cbd.decode(cbd.well_data("205-бис", DAY, SNAPSHOT, "completion"))
+    assert ref.action == cbd.WELL
+    assert ref.mode == "completion"
+    assert ref.day == DAY
+    assert ref.well is None
+    assert SNAPSHOT[ref.index] == "205-бис"
+    assert ref.check == cbd._check("205-бис")
+
+
+def test_well_outside_snapshot_is_passed_by_number():
+    ref = cbd.decode(cbd.well_data("999", DAY, SNAPSHOT))
+    assert (ref.action, ref.mode, ref.well) == (cbd.WELL, None, "999")
+
+
+@pytest.mark.parametrize("data", [
+    cbd.summary_data("102", DAY, SNAPSHOT),
+    cbd.history_data("102", DAY, "2024-05-10", SNAPSHOT, "drilling"),
+    cbd.changes_data("102", DAY, SNAPSHOT, "drilling"),
+])
+def test_follow_reproduces_callback_data(data):
+    ref = cbd.decode(data)
+    assert cbd.follow(ref, ref.action, ref.before) == data
+
+
+def test_history_keeps_before_date():
+    ref = cbd.decode(cbd.history_data("7", DAY, "2024-05-10", SNAPSHOT))
+    assert (ref.action, ref.day, ref.before) == (cbd.HISTORY, DAY, "2024-05-10")
+
+
+def test_legacy_callback_data_is_still_decoded():
+    assert cbd.decode("drilling") == cbd.CallbackRef(cbd.MODE, mode="drilling")
+    assert cbd.decode("summary_101").well == "101"
+    ref = cbd.decode("history_101_2024-05-10")
+    assert (ref.action, ref.well, ref.before) == (cbd.HISTORY, "101", "2024-05-10")
+
+
+def test_pack_limit_is_counted_in_bytes():
+    # 30 кириллических символов — 60 байт: вместе с префиксом больше 64
+    well = "я" * 30
+    with pytest.raises(ValueError):
+        cbd.well_data(well, DAY)
+    assert len(cbd.well_data("1" * 30, DAY).encode("utf-8")) <= cbd.MAX_CALLBACK_BYTES
+
+
+def test_snapshot_reference_fits_for_long_well_numbers():
+    well = "я" * 40
+    data = cbd.well_data(well, DAY, tuple(sorted(SNAPSHOT + (well,))), "drilling")
+    assert len(data.encode("utf-8")) <= cbd.MAX_CALLBACK_BYTES
@@ -0,0 +1,50 @@
+"""Сравнение описаний скважины по разделам"""
+from changes import diff_descriptions, split_sections, render_changes, PREAMBLE_TITLE
+from services import format_description
+
+PREVIOUS = format_description(
+    "Работы за прошлые сутки: Бурение до 1500 м. Промывка.\n"
+    "Работы за текущие сутки: Подъём КНБК.\n"
+    "Проблемные вопросы: нет"
+)
+
+
+def test_split_sections_by_headings():
+    sections = split_sections(PREVIOUS)
+    assert list(sections) == ["Работы за прошлые сутки", "Работы за текущие сутки", "Проблемные вопросы"]
+    assert sections["Работы за прошлые сутки"] == ["Бурение до 1500 м.", "Промывка."]
+    assert PREAMBLE_TITLE not in sections
+
+
+def test_identical_descriptions_have_no_changes():
+    digest = diff_descriptions(PREVIOUS, PREVIOUS)
+    assert not digest.changed
+    assert digest.ratio == 0.0
+
+
+def test_changed_fragment_is_reported_in_its_section():
+    current = PREVIOUS.replace("Подъём КНБК.", "Спуск обсадной колонны.")
+    digest = diff_descriptions(PREVIOUS, current)
+    assert digest.changed
+    by_title = {s.title: s for s in digest.sections}
+    assert by_title["Работы за текущие сутки"].added == ["Спуск обсадной колонны."]
+    assert by_title["Работы за текущие сутки"].removed == ["Подъём КНБК."]
+    assert not by_title["Проблемные вопросы"].added
+
+
+def test_number_only_change_is_small():
+    digest = diff_descriptions(PREVIOUS, PREVIOUS.replace("1500", "1550"))
+    assert digest.changed
+    assert not digest.large
+
+
+def test_rewritten_description_is_large():
+    current = format_description("Работы за текущие сутки: Монтаж бурового станка на новом кусту")
+    assert diff_descriptions(PREVIOUS, current).large
+
+
+def test_render_escapes_html():
+    digest = diff_descriptions("", "Работы за текущие сутки: давление <100 атм")
+    text = render_changes(digest, "101", "2024-05-16", "2024-05-17")
+    assert "&lt;100" in text
+    assert "16.05.2024 → 17.05.2024" in text
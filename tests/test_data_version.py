@@ -0,0 +1,87 @@
+"""Сверка кэшей с версией данных и удаление скважин, пропавших из отчёта"""
+import asyncio
+from datetime import date
+import pytest
+import ingest
+import services
+from cache import get_cache
+
+TODAY = date.today()
+DAYS = (TODAY - date(1970, 1, 1)).days
+
+
+@pytest.fixture
+def db(fake_ydb, monkeypatch):
+    monkeypatch.setattr(services, "DATA_VERSION_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(ingest, "YDB_DATABASE", "/local")
+    monkeypatch.setattr(ingest, "_wells_migrated", True)
+    return fake_ydb
+
+
+def _load(db, rows):
+    """Загрузка отчёта другим экземпляром: версия и wells_changes, без сброса локальных кэшей"""
+    db.load_wells(rows, TODAY)
+    version = db.tables["wells_versions"][(DAYS,)]["version"]
+    for well, _ in rows:
+        db.upsert_row("wells_changes", {"date": DAYS, "version": version, "well_number": well})
+
+
+def test_description_read_before_first_load_is_not_kept(db):
+    assert asyncio.run(services.get_well_description_ydb("101")) == services.WELL_NOT_FOUND_TEXT
+    assert services.last_known_descriptions.get("101") is None
+
+    _load(db, [("101", "Бурение")])
+    assert asyncio.run(services.get_well_description_ydb("101")) == "Бурение"
+
+
+def test_first_version_invalidates_entries_cached_while_unversioned(db):
+    today_str = TODAY.isoformat()
+    asyncio.run(services.sync_data_version(today_str))
+    parts = get_cache("rendered_parts")
+    parts.set((today_str, "101"), ["placeholder"])
+
+    _load(db, [("101", "Бурение")])
+    assert asyncio.run(services.sync_data_version(today_str)) == 1
+    assert parts.get((today_str, "101")) is None
+
+
+def test_new_version_invalidates_only_changed_wells(db):
+    today_str = TODAY.isoformat()
+    _load(db, [("101", "Бурение"), ("102", "Промывка")])
+    assert asyncio.run(services.get_well_description_ydb("101")) == "Бурение"
+    assert asyncio.run(services.get_well_description_ydb("102")) == "Промывка"
+
+    db.upsert_row("wells", {"well_number": "102", "date": DAYS, "description": "Крепление"})
+    db.upsert_row("wells_versions", {"date": DAYS, "version": 2})
+    db.upsert_row("wells_changes", {"date": DAYS, "version": 2, "well_number": "102"})
+    round_trips = db.round_trips
+    assert asyncio.run(services.get_well_description_ydb("102")) == "Крепление"
+    assert asyncio.run(services.get_well_descriptions(["101"])) == {"101": "Бурение"}
+    # версия, изменения, описание 102; проверка версии для 101 и описание из кэша
+    assert db.round_trips - round_trips == 4
+
+
+def _run_csv(tmp_path, rows, name="report.csv"):
+    path = tmp_path / name
+    path.write_text("well,description\n" + "".join(f"{w},{d}\n" for w, d in rows), encoding="utf-8")
+    return asyncio.run(ingest.run_ingestion(str(path), TODAY))
+
+
+def test_wells_missing_from_report_are_removed_and_published(db, tmp_path):
+    _run_csv(tmp_path, [("101", "Бурение"), ("102", "Промывка")])
+    results = _run_csv(tmp_path, [("101", "Бурение")])
+
+    assert results[-1]["removed_wells"] == ["102"]
+    assert ("102", DAYS) not in db.tables["wells"]
+    assert ("101", DAYS) in db.tables["wells"]
+    assert db.tables["wells_versions"][(DAYS,)]["version"] == 2
+    assert (DAYS, 2, "102") in db.tables["wells_changes"]
+    assert db.tables["wells_ingested"][(DAYS,)]["wells"] == 1
+
+
+def test_empty_report_removes_nothing(db, tmp_path):
+    _run_csv(tmp_path, [("101", "Бурение")])
+    results = _run_csv(tmp_path, [])
+
+    assert results[-1]["removed_wells"] == []
+    assert ("101", DAYS) in db.tables["wells"]
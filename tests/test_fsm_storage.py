@@ -0,0 +1,149 @@
+"""FSM-хранилище с отложенной записью и перенос записей из user_state"""
+import asyncio
+import json
+import sqlite3
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+import pytest
+from aiogram.types import Chat, User
+from aiogram.dispatcher.middlewares.user_context import EventContext, EVENT_CONTEXT_KEY
+import bot
+import services
+import state_backend
+from fsm_storage import WriteBehindStorage, FsmFlushMiddleware
+
+USER_ID = 501
+KEY = f"fsm:{USER_ID}:{USER_ID}"
+
+
+@pytest.fixture
+def backend(fake_ydb, monkeypatch):
+    backend = state_backend.create_state_backend(
+        "ydb", services.get_ydb_pool, services.run_state_ydb, services.init_fsm_state_table
+    )
+    monkeypatch.setattr(services, "_state_backend", backend)
+    return backend
+
+
+def _update_data(user_id=USER_ID):
+    return {
+        "bot": SimpleNamespace(id=1),
+        EVENT_CONTEXT_KEY: EventContext(
+            chat=Chat(id=user_id, type="private"),
+            user=User(id=user_id, is_bot=False, first_name="Test"),
+        ),
+    }
+
+
+def _run_update(storage, handler):
+    return asyncio.run(FsmFlushMiddleware(storage)(handler, None, _update_data()))
+
+
+def test_update_reads_once_and_writes_once(backend, fake_ydb):
+    storage = WriteBehindStorage(backend)
+
+    async def handler(event, data):
+        state = data["state"]
+        await state.update_data(mode="drilling")
+        await state.update_data(message_id=10)
+        assert await state.get_data() == {"mode": "drilling", "message_id": 10}
+
+    round_trips = fake_ydb.round_trips
+    _run_update(storage, handler)
+    assert fake_ydb.round_trips - round_trips == 2
+    assert json.loads(fake_ydb.tables["fsm_state"][(KEY,)]["data"]) == {"mode": "drilling", "message_id": 10}
+
+
+def test_update_without_changes_does_not_write(backend, fake_ydb):
+    storage = WriteBehindStorage(backend)
+
+    async def handler(event, data):
+        await data["state"].get_data()
+
+    round_trips = fake_ydb.round_trips
+    _run_update(storage, handler)
+    assert fake_ydb.round_trips - round_trips == 1
+    assert (KEY,) not in fake_ydb.tables["fsm_state"]
+
+
+def test_handler_without_state_access_costs_nothing(backend, fake_ydb):
+    round_trips = fake_ydb.round_trips
+    _run_update(WriteBehindStorage(backend), AsyncMock())
+    assert fake_ydb.round_trips == round_trips
+
+
+def test_flush_failure_does_not_fail_the_update(backend, monkeypatch):
+    storage = WriteBehindStorage(backend)
+    monkeypatch.setattr(backend, "set_fsm_many", AsyncMock(side_effect=RuntimeError("ydb down")))
+
+    async def handler(event, data):
+        await data["state"].update_data(message_id=10)
+        return "handled"
+
+    assert _run_update(storage, handler) == "handled"
+
+
+def test_missing_fsm_table_is_created_on_first_use(backend, fake_ydb):
+    del fake_ydb.tables["fsm_state"]
+    assert asyncio.run(backend.get_fsm(KEY)) == (None, {})
+    asyncio.run(backend.set_fsm_many({KEY: (None, {"message_id": 7})}))
+    assert asyncio.run(backend.get_fsm(KEY)) == (None, {"message_id": 7})
+
+
+def test_well_view_survives_state_read_failure():
+    state = SimpleNamespace(
+        get_data=AsyncMock(side_effect=RuntimeError("ydb_state circuit is open")),
+        update_data=AsyncMock(side_effect=RuntimeError("ydb_state circuit is open")),
+    )
+    message = SimpleNamespace(
+        chat=SimpleNamespace(id=USER_ID), answer=AsyncMock(return_value=SimpleNamespace(message_id=11))
+    )
+    callback = SimpleNamespace(message=message, bot=SimpleNamespace(delete_message=AsyncMock()))
+
+    asyncio.run(bot.send_parts_replacing_last(callback, state, ["часть 1", "часть 2"], None))
+    assert message.answer.await_count == 2
+    callback.bot.delete_message.assert_not_awaited()
+
+
+def test_user_state_rows_are_migrated_to_fsm_state(backend, fake_ydb):
+    fake_ydb.upsert_row("user_state", {"user_id": USER_ID, "mode": "completion", "message_id": 9})
+    fake_ydb.upsert_row("user_state", {"user_id": 502, "mode": None, "message_id": 4})
+    fake_ydb.upsert_row("user_state", {"user_id": 503, "mode": "drilling", "message_id": None})
+    # У пользователя 503 уже есть запись FSM — она не перезаписывается
+    fake_ydb.upsert_row("fsm_state", {"storage_key": "fsm:503:503", "state": None,
+                                      "data": json.dumps({"mode": "completion"})})
+
+    assert asyncio.run(services.migrate_user_state()) == 2
+    assert asyncio.run(backend.get_fsm(KEY)) == (None, {"mode": "completion", "message_id": 9})
+    assert asyncio.run(backend.get_fsm("fsm:502:502")) == (None, {"message_id": 4})
+    assert asyncio.run(backend.get_fsm("fsm:503:503")) == (None, {"mode": "completion"})
+    # Повторный запуск ничего не переносит
+    assert asyncio.run(services.migrate_user_state()) == 0
+
+
+def test_missing_user_state_table_is_skipped(backend, fake_ydb):
+    del fake_ydb.tables["user_state"]
+    assert asyncio.run(services.migrate_user_state()) == 0
+
+
+def test_sqlite_backend_migrates_user_state_on_open(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE user_state (user_id INTEGER PRIMARY KEY, mode TEXT, message_id INTEGER)")
+    conn.execute("INSERT INTO user_state VALUES (?, 'drilling', 42)", (USER_ID,))
+    conn.commit()
+    conn.close()
+
+    backend = state_backend.SqliteStateBackend(path)
+    try:
+        assert asyncio.run(backend.get_fsm(KEY)) == (None, {"mode": "drilling", "message_id": 42})
+        asyncio.run(backend.set_fsm_many({KEY: ("menu", {"mode": "completion"})}))
+    finally:
+        asyncio.run(backend.close())
+
+    # Повторное открытие не затирает новую запись старой строкой user_state
+    backend = state_backend.SqliteStateBackend(path)
+    try:
+        assert asyncio.run(backend.get_fsm(KEY)) == ("menu", {"mode": "completion"})
+    finally:
+        asyncio.run(backend.close())
@@ -0,0 +1,58 @@
+"""Загрузка отчёта: пропуск неизменившихся строк по хэшу, версии данных за день"""
+import asyncio
+from datetime import date
+import pytest
+import ingest
+
+REPORT_DATE = date(2024, 5, 17)
+DAYS = (REPORT_DATE - date(1970, 1, 1)).days
+
+
+@pytest.fixture
+def db(fake_ydb, monkeypatch):
+    monkeypatch.setattr(ingest, "YDB_DATABASE", "/local")
+    monkeypatch.setattr(ingest, "_wells_migrated", False)
+    return fake_ydb
+
+
+def _ingest(rows, batch_size=2):
+    async def source():
+        for row in rows:
+            yield row
+    return asyncio.run(ingest.ingest_report(source(), REPORT_DATE, batch_size=batch_size))
+
+
+def _changes(db, version):
+    return sorted(well for (day, v, well) in db.tables["wells_changes"] if day == DAYS and v == version)
+
+
+def test_first_load_writes_all_rows_in_batches(db):
+    stats = _ingest([("101", "Бурение"), ("102", "Промывка"), ("103", "Крепление")])
+    assert (stats["rows"], stats["written"], stats["batches"], stats["version"]) == (3, 3, 2, 1)
+    assert db.tables["wells"][("101", DAYS)]["content_hash"] == ingest.content_hash("Бурение")
+    assert _changes(db, 1) == ["101", "102", "103"]
+
+
+def test_unchanged_rows_are_skipped(db):
+    rows = [("101", "Бурение"), ("102", "Промывка")]
+    _ingest(rows)
+    round_trips = db.round_trips
+    stats = _ingest(rows)
+    assert (stats["written"], stats["unchanged"], stats["version"]) == (0, 2, None)
+    assert db.tables["wells_versions"][(DAYS,)]["version"] == 1
+    # Без изменений — только чтение хэшей, без записи и новой версии
+    assert db.round_trips - round_trips == 1
+
+
+def test_only_changed_rows_are_written_and_published(db):
+    _ingest([("101", "Бурение"), ("102", "Промывка")])
+    stats = _ingest([("101", "Бурение"), ("102", "Промывка до забоя")])
+    assert (stats["written"], stats["version"], stats["changed_wells"]) == (1, 2, ["102"])
+    assert db.tables["wells"][("102", DAYS)]["description"] == "Промывка до забоя"
+    assert _changes(db, 2) == ["102"]
+
+
+def test_duplicate_well_in_report_keeps_last_row(db):
+    stats = _ingest([("101", "Бурение"), ("101", "Бурение, исправлено")])
+    assert stats["written"] == 2
+    assert db.tables["wells"][("101", DAYS)]["description"] == "Бурение, исправлено"
@@ -0,0 +1,18 @@
+"""Поиск скважин по началу номера (inline-режим)"""
+import asyncio
+import services
+
+
+def test_find_wells_by_prefix(monkeypatch):
+    snapshot = ("10", "101", "102", "2-Бис", "205")
+
+    async def fake_snapshot(date_str):
+        return snapshot
+
+    monkeypatch.setattr(services, "get_well_snapshot", fake_snapshot)
+    monkeypatch.setattr(services, "_prefix_index", (None, [], []))
+
+    assert asyncio.run(services.find_wells_by_prefix("10")) == (["10", "101", "102"], False)
+    assert asyncio.run(services.find_wells_by_prefix("10", offset=1, limit=1)) == (["101"], True)
+    assert asyncio.run(services.find_wells_by_prefix("2-б")) == (["2-Бис"], False)
+    assert asyncio.run(services.find_wells_by_prefix("9")) == ([], False)
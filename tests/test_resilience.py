@@ -0,0 +1,133 @@
+"""Переходы состояний выключателя (circuit breaker)"""
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+import pytest
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def _call(breaker, fail=False):
+    async def run():
+        async with breaker.guard():
+            if fail:
+                raise RuntimeError("dependency failed")
+    asyncio.run(run())
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test_open", failures=3, reset_seconds=30)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            _call(breaker, fail=True)
+    assert breaker.state == CLOSED
+    with pytest.raises(RuntimeError):
+        _call(breaker, fail=True)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        _call(breaker)
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("test_reset", failures=2, reset_seconds=30)
+    with pytest.raises(RuntimeError):
+        _call(breaker, fail=True)
+    _call(breaker)
+    with pytest.raises(RuntimeError):
+        _call(breaker, fail=True)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    breaker = CircuitBreaker("test_probe", failures=1, reset_seconds=30)
+    with pytest.raises(RuntimeError):
+        _call(breaker, fail=True)
+    assert not breaker.available()
+
+    clock.now += 30
+    assert breaker.available()
+    with pytest.raises(RuntimeError):
+        _call(breaker, fail=True)
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    _call(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_only_one_probe_in_half_open(clock):
+    breaker = CircuitBreaker("test_single_probe", failures=1, reset_seconds=30)
+    with pytest.raises(RuntimeError):
+        _call(breaker, fail=True)
+    clock.now += 30
+
+    async def run():
+        async with breaker.guard():
+            assert breaker.state == HALF_OPEN
+            with pytest.raises(CircuitOpenError):
+                async with breaker.guard():
+                    pass
+    asyncio.run(run())
+    assert breaker.state == CLOSED
+
+
+def test_deadline_is_not_a_dependency_failure(clock):
+    breaker = CircuitBreaker("test_deadline", failures=1, reset_seconds=30)
+
+    async def run():
+        async with breaker.guard():
+            raise resilience.DeadlineExceeded("update deadline reached")
+
+    with pytest.raises(resilience.DeadlineExceeded):
+        asyncio.run(run())
+    assert breaker.state == CLOSED
+
+
+def _summary_callback():
+    return SimpleNamespace(answer=AsyncMock(), message=SimpleNamespace(answer=AsyncMock()))
+
+
+@pytest.mark.parametrize("error", [asyncio.TimeoutError(), RuntimeError("ydb read failed")])
+def test_summary_handler_replies_instead_of_raising(monkeypatch, error):
+    import bot
+    monkeypatch.setattr(bot, "resolve_well", AsyncMock(return_value="101"))
+    monkeypatch.setattr(bot, "get_well_description_ydb", AsyncMock(side_effect=error))
+    callback = _summary_callback()
+
+    asyncio.run(bot.process_summary_request(callback, None, None))
+
+    callback.answer.assert_awaited_once()
+    callback.message.answer.assert_awaited_once_with(bot.SUMMARY_UNAVAILABLE_TEXT)
+
+
+def test_summary_handler_answers_callback_when_failing_early(monkeypatch):
+    import bot
+    monkeypatch.setattr(bot, "resolve_well", AsyncMock(side_effect=RuntimeError("ydb down")))
+    callback = _summary_callback()
+
+    asyncio.run(bot.process_summary_request(callback, None, None))
+
+    callback.answer.assert_awaited_once_with(bot.SUMMARY_UNAVAILABLE_TEXT, show_alert=True)
+    callback.message.answer.assert_not_awaited()
+
+
+def test_fallback_never_returns_not_found_placeholder(fake_ydb):
+    import services
+    services._remember_description("2024-01-01", "101", services.WELL_NOT_FOUND_TEXT)
+    assert services.last_known_descriptions.get("101") is None
+    assert services.description_cache.get(("2024-01-01", "101")) is None
@@ -0,0 +1,49 @@
+"""Инвертированный индекс: префиксный поиск по основам слов и сериализация"""
+import asyncio
+from datetime import date
+import services
+from search_index import SearchIndex
+
+ROWS = [
+    ("101", "Бурение под кондуктор. Промывка скважины"),
+    ("102", "Крепление обсадной колонной"),
+    ("205", "Промывка, подготовка к креплению"),
+]
+
+
+def test_prefix_matches_all_terms_with_that_start():
+    index = SearchIndex.build(ROWS)
+    assert index.search("пром") == ["101", "205"]
+    assert index.search("креплен") == ["102", "205"]
+
+
+def test_all_query_words_must_match():
+    index = SearchIndex.build(ROWS)
+    assert index.search("промывка креплению") == ["205"]
+    assert index.search("промывка обсадной") == []
+
+
+def test_empty_index_and_stopword_query():
+    assert SearchIndex((), {}).search("промывка") == []
+    assert SearchIndex.build(ROWS).search("и на") == []
+
+
+def test_dumps_loads_round_trip():
+    index = SearchIndex.build(ROWS)
+    restored = SearchIndex.loads(index.dumps())
+    assert restored.wells == index.wells
+    assert restored.search("пром") == index.search("пром")
+
+
+def test_dates_loaded_before_versioning_are_searchable(fake_ydb):
+    day = date(2024, 5, 10)
+    # Строки без wells_versions — как данные, загруженные до появления ingest
+    for well, description in ROWS:
+        fake_ydb.upsert_row("wells", {"well_number": well, "date": (day - date(1970, 1, 1)).days,
+                                      "description": description})
+
+    assert asyncio.run(services.get_search_index(day.isoformat())).search("пром") == ["101", "205"]
+    round_trips = fake_ydb.round_trips
+    asyncio.run(services.get_search_index(day.isoformat()))
+    # Повторно индекс берётся из памяти (только проверка версии, и та — не чаще интервала)
+    assert fake_ydb.round_trips - round_trips <= 1
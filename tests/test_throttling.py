@@ -0,0 +1,39 @@
+"""Корзина токенов и антидребезг троттлинга колбэков"""
+import pytest
+import throttling
+from throttling import RATE_LIMITS, DEBOUNCE_SECONDS, _take_token, _new_state, _decide
+
+
+def test_bucket_allows_capacity_then_limits():
+    capacity, refill_rate = RATE_LIMITS["summary"]
+    buckets = {}
+    for _ in range(capacity):
+        assert _take_token(buckets, "summary", 100.0) == (True, 0.0)
+    allowed, retry_after = _take_token(buckets, "summary", 100.0)
+    assert not allowed
+    assert retry_after == pytest.approx(1 / refill_rate)
+
+
+def test_bucket_refills_over_time():
+    capacity, refill_rate = RATE_LIMITS["summary"]
+    buckets = {"summary": (0.0, 100.0)}
+    assert not _take_token(buckets, "summary", 100.0 + 0.5 / refill_rate)[0]
+    assert _take_token(buckets, "summary", 100.0 + 1 / refill_rate)[0]
+
+
+def test_refill_is_capped_by_capacity():
+    capacity, _ = RATE_LIMITS["well"]
+    buckets = {"well": (0.0, 0.0)}
+    _take_token(buckets, "well", 1e6)
+    assert buckets["well"][0] == capacity - 1
+
+
+def test_repeated_press_is_debounced():
+    state = _new_state()
+    assert _decide(state, "s:1:0.ab", "summary", 10.0)[0] == "ok"
+    assert _decide(state, "s:1:0.ab", "summary", 10.0 + DEBOUNCE_SECONDS / 2)[0] == "debounce"
+    assert _decide(state, "s:1:1.cd", "summary", 10.0 + DEBOUNCE_SECONDS / 2)[0] == "ok"
+
+
+def test_local_state_is_bounded():
+    assert throttling._states.maxsize == throttling.THROTTLE_MAX_USERS
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import logging
+import ydb
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+from services import get_ydb_pool, run_ydb, run_state_ydb, YDB_LONG_TIMEOUT_SECONDS
+from metrics import inc
+from cache import get_cache
+import callbacks as cbd
+
+logger = logging.getLogger(__name__)
+
+# Повторное нажатие той же кнопки в этом окне (с) считается дублем
+DEBOUNCE_SECONDS = float(os.environ.get("CALLBACK_DEBOUNCE_SECONDS", "1.5"))
+
+# memory — состояние в памяти тёплого экземпляра (по умолчанию, без обращений к YDB);
+# ydb — общая таблица callback_throttle: лимит соблюдается между экземплярами,
+# но каждое ограничиваемое нажатие стоит одной транзакции до вызова обработчика
+THROTTLE_BACKEND = os.environ.get("THROTTLE_BACKEND", "memory")
+
+# Лимиты дорогих действий: действие -> (ёмкость корзины, пополнение токенов в секунду)
+RATE_LIMITS = {
+    "summary": (3, 1 / 20),
+    "well": (10, 1.0),
+    "history": (10, 1.0),
+    "changes": (10, 1.0),
+}
+
+# Выключатель для отладки и бенчмарков
+THROTTLE_ENABLED = os.environ.get("THROTTLE_ENABLED", "1") != "0"
+
+# Ограничиваемые действия кнопок; навигация дёшева и не ограничивается
+LIMITED_ACTIONS = {
+    cbd.SUMMARY: "summary",
+    cbd.WELL: "well",
+    cbd.HISTORY: "history",
+    cbd.CHANGES: "changes",
+}
+
+
+# Локальное состояние живёт на уровне модуля: в функции диспетчер создаётся на каждый апдейт.
+# user_id -> состояние; LRU, чтобы память не росла с числом пользователей
+THROTTLE_MAX_USERS = int(os.environ.get("THROTTLE_MAX_USERS", "10000"))
+_states = get_cache("throttle_state", maxsize=THROTTLE_MAX_USERS)
+
+
+def classify_callback(ref: cbd.CallbackRef):
+    """Возвращает имя ограничиваемого действия для разобранных callback_data или None"""
+    return LIMITED_ACTIONS.get(ref.action)
+
+
+def _take_token(buckets, action, now):
+    """Пополняет корзину действия и пытается взять токен; возвращает (успех, секунд до токена)"""
+    capacity, refill_rate = RATE_LIMITS[action]
+    tokens, updated_at = buckets.get(action, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+    if tokens >= 1:
+        buckets[action] = (tokens - 1, now)
+        return True, 0.0
+    buckets[action] = (tokens, now)
+    return False, (1 - tokens) / refill_rate
+
+
+def _new_state():
+    return {"last_data": None, "last_at": 0.0, "buckets": {}}
+
+
+def _decide(state, callback_data, action, now):
+    """
+    Проверяет нажатие по состоянию пользователя и обновляет его.
+    Возвращает ("debounce" | "limited" | "ok", секунд до следующего токена).
+    """
+    if state["last_data"] == callback_data and now - state["last_at"] < DEBOUNCE_SECONDS:
+        return "debounce", 0.0
+    allowed, retry_after = _take_token(state["buckets"], action, now)
+    state["last_data"] = callback_data
+    state["last_at"] = now
+    return ("ok" if allowed else "limited"), retry_after
+
+
+async def init_throttle_table():
+    """Создает таблицу callback_throttle если она не существует"""
+    pool = await get_ydb_pool()
+
+    def tx(session):
+        session.execute_scheme(
+            """
+            CREATE TABLE IF NOT EXISTS callback_throttle (
+                user_id Uint64,
+                last_data Utf8,
+                last_at Double,
+                buckets Utf8,
+                PRIMARY KEY (user_id)
+            )
+            """
+        )
+
+    await run_ydb("init_throttle_table", pool.retry_operation_sync, tx, timeout=YDB_LONG_TIMEOUT_SECONDS)
+    logger.info("callback_throttle table initialized successfully")
+
+
+async def decide_shared(user_id, callback_data, action, now):
+    """
+    То же, что _decide, но над строкой callback_throttle: чтение, решение и запись
+    в одной serializable-транзакции, поэтому параллельные нажатия на разных
+    экземплярах не берут один и тот же токен (при конфликте транзакция повторяется).
+    """
+    pool = await get_ydb_pool()
+    select_query = """
+    DECLARE $user_id AS Uint64;
+    SELECT last_data, last_at, buckets FROM callback_throttle WHERE user_id = $user_id;
+    """
+    upsert_query = """
+    DECLARE $user_id AS Uint64;
+    DECLARE $last_data AS Utf8;
+    DECLARE $last_at AS Double;
+    DECLARE $buckets AS Utf8;
+    UPSERT INTO callback_throttle (user_id, last_data, last_at, buckets)
+    VALUES ($user_id, $last_data, $last_at, $buckets);
+    """
+
+    def tx(session):
+        transaction = session.transaction(ydb.SerializableReadWrite())
+        result = transaction.execute(session.prepare(select_query), {"$user_id": user_id})
+        rows = result[0].rows
+        state = _new_state()
+        if rows:
+            state["last_data"] = rows[0].last_data
+            state["last_at"] = rows[0].last_at or 0.0
+            state["buckets"] = {k: tuple(v) for k, v in json.loads(rows[0].buckets or "{}").items()}
+
+        verdict, retry_after = _decide(state, callback_data, action, now)
+        if verdict == "debounce":
+            transaction.commit()
+            return verdict, retry_after
+        buckets = json.dumps(
+            {k: [round(t, 3), round(ts, 3)] for k, (t, ts) in state["buckets"].items()},
+            separators=(",", ":")
+        )
+        transaction.execute(
+            session.prepare(upsert_query),
+            {
+                "$user_id": user_id,
+                "$last_data": state["last_data"] or "",
+                "$last_at": state["last_at"],
+                "$buckets": buckets,
+            },
+            commit_tx=True
+        )
+        return verdict, retry_after
+
+    return await run_state_ydb("decide_throttle", pool.retry_operation_sync, tx)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Отбрасывает повторные нажатия одной кнопки в окне DEBOUNCE_SECONDS и ограничивает
+    дорогие действия корзиной токенов на пользователя. Состояние хранится в памяти
+    тёплого экземпляра или (THROTTLE_BACKEND=ydb) в таблице callback_throttle.
+    """
+
+    def __init__(self, backend=THROTTLE_BACKEND):
+        self.shared = backend == "ydb"
+
+    def _decide_local(self, user_id, callback_data, action, now):
+        state = _states.get(user_id)
+        if state is None:
+            state = _new_state()
+            _states.set(user_id, state)
+        return _decide(state, callback_data, action, now)
+
+    async def __call__(self, handler, event: CallbackQuery, data):
+        user_id = event.from_user.id
+        callback_data = event.data or ""
+        # callback_data уже разобраны CallbackRoutingMiddleware
+        ref = data.get("cb") or cbd.decode(callback_data)
+        action = classify_callback(ref)
+        if action is None:
+            return await handler(event, data)
+
+        now = time.time()
+        if self.shared:
+            try:
+                verdict, retry_after = await decide_shared(user_id, callback_data, action, now)
+            except Exception as e:
+                # Таблица недоступна — решаем по памяти экземпляра, а не блокируем нажатие
+                logger.warning("Shared throttle state unavailable, using local: %s", e)
+                verdict, retry_after = self._decide_local(user_id, callback_data, action, now)
+        else:
+            verdict, retry_after = self._decide_local(user_id, callback_data, action, now)
+
+        if verdict == "debounce":
+            inc("callbacks_suppressed_total", "debounce")
+            logger.debug("Duplicate callback %r from user %s suppressed", callback_data, user_id)
+            await event.answer()
+            return None
+
+        if verdict == "limited":
+            inc("callbacks_suppressed_total", f"rate_limit:{action}")
+            logger.debug("Callback %r from user %s rate limited", callback_data, user_id)
+            await event.answer(f"⏳ Слишком часто, попробуйте через {int(retry_after) + 1} с")
+            return None
+
+        return await handler(event, data)